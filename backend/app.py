@@ -3,109 +3,405 @@ import json
 import uuid
 import glob
 import time
-import pandas as pd
-import numpy as np
-import google.generativeai as genai
-from flask import Flask, request, jsonify, send_file
+import shutil
+import cProfile
+import threading
+from contextlib import contextmanager
+from flask import Flask, Blueprint, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from pypdf import PdfReader, PdfWriter
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from jobs import JobQueue, QueueFull
+from project_store import ProjectStore
+from search_index import SearchIndex
+from statement_mapping import MappingError
+from consolidation import PLANS, extract_columns, build_statements, iter_statements, get_plan, pins_for, row_value, recalculate, overrides_from_model
+from pdf_filter import create_filtered_pdf, classify_pages, section_chunks, write_pages, HEADER_PATTERN
+from cache import ContentCache, MemoryCache, cache_key, file_stamp
+from uploads import UploadSessions, UploadError, OffsetMismatch, save_upload, content_hash
+from override_journal import OverrideJournal
+from trial_balance import load_trial_balance
+from valuation import value_company, ValuationError
+from providers import get_provider, active_providers, PROVIDERS, ProviderError
+from governor import process_share
+from metrics import metrics
+from locks import file_lock
+from tb_mapping import get_mapper, tb_columns, apply_tb_columns, reconcile
 
 # Load API Key
 load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-app = Flask(__name__)
-CORS(app)
+api = Blueprint('api', __name__)
 
 BASE_DIR = os.path.join(os.getcwd(), 'data')
 PROJECTS_FILE = os.path.join(BASE_DIR, 'projects.json')
+PROJECTS_DB = os.path.join(BASE_DIR, 'projects.db')
 ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'xls', 'csv', 'docx', 'doc'}
 
-# --- UTILS ---
-def load_projects():
-    if not os.path.exists(PROJECTS_FILE): return {}
-    try:
-        with open(PROJECTS_FILE, 'r') as f: return json.load(f)
-    except: return {}
+# Project metadata (imports the legacy projects.json on first use)
+project_store = ProjectStore(PROJECTS_DB, legacy_json=PROJECTS_FILE)
+
+# Full-text index over every extracted report's notes; catches up with files written while the app was down
+# (see start_background)
+search_index = SearchIndex(os.path.join(BASE_DIR, 'search.db'))
+
+# Background extraction: worker pool with a bounded backlog, plus a cap on concurrent model calls
+job_queue = JobQueue(
+    max_workers=int(os.getenv("EXTRACT_WORKERS", 4)),
+    max_pending=int(os.getenv("EXTRACT_QUEUE_SIZE", 32)),
+    spool=os.path.join(BASE_DIR, '_jobs')  # job status and events, readable from every worker process
+)
+_model_slots = None
+_model_slots_lock = threading.Lock()
+
+def model_slots():
+    """ This process's share of MAX_MODEL_CALLS, sized on first use: after the fork in a preforked worker. """
+    global _model_slots
+    with _model_slots_lock:
+        if _model_slots is None:
+            _model_slots = threading.BoundedSemaphore(process_share(int(os.getenv("MAX_MODEL_CALLS", 2))))
+        return _model_slots
+
+# Per-section model calls of one report run side by side (still bounded by model_slots)
+section_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SECTION_WORKERS", 4)), thread_name_prefix="section")
+SECTION_RETRIES = int(os.getenv("SECTION_RETRIES", 2))
+
+# Parsed extraction JSON and computed consolidations, checked against file mtime/size
+memory_cache = MemoryCache(int(os.getenv("MEMORY_CACHE_BYTES", 256 * 1024 ** 2)))
+
+# Large scanned reports are sent in chunks through resumable upload sessions
+upload_sessions = UploadSessions(os.path.join(BASE_DIR, '_uploads'))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Filtered PDFs and parsed model output, keyed by report content hash
+content_cache = ContentCache(
+    os.path.join(BASE_DIR, '_cache'),
+    max_bytes=int(os.getenv("CACHE_MAX_BYTES", 2 * 1024 ** 3))
+)
+
+# Per-request cProfile dumps (X-Profile: 1), only when PROFILE_REQUESTS is set; the newest PROFILE_KEEP are kept
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "").lower() in ("1", "true", "yes")
+PROFILE_KEEP = max(int(os.getenv("PROFILE_KEEP", 50)), 1)
+PROFILES_DIR = os.path.join(BASE_DIR, '_profiles')
+
+
+# --- INSTRUMENTATION ---
+def _governor_stats():
+    for name, provider in active_providers().items():
+        gov = getattr(provider, "governor", None)
+        if gov is None: continue
+        for key, value in dict(gov.stats).items(): yield {"provider": name, "stat": key}, value
+
+def _cache_ratios():
+    for cache in ("content", "page_index", "remote_file"):
+        hits, misses = (metrics.value("cache_requests_total", cache=cache, result=r) for r in ("hit", "miss"))
+        if hits + misses: yield {"cache": cache}, hits / (hits + misses)
+    lookups = memory_cache.hits + memory_cache.misses
+    if lookups: yield {"cache": "memory"}, memory_cache.hits / lookups
+
+metrics.collector("jobs", "gauge", "Extraction jobs kept, by status", lambda: [({"status": k}, v) for k, v in job_queue.counts().items()])
+metrics.collector("model_governor_total", "counter", "Model API calls, retries, throttled seconds and deadline misses", _governor_stats)
+metrics.collector("memory_cache_bytes", "gauge", "Approximate size of the in-memory cache", lambda: [({}, memory_cache.size)])
+metrics.collector("cache_hit_ratio", "gauge", "Hits over lookups since start, per cache", _cache_ratios)
+
+@api.before_app_request
+def start_request():
+    g.started = time.perf_counter()
+    if PROFILE_REQUESTS and request.headers.get('X-Profile') == '1':
+        g.profiler = cProfile.Profile()
+        try: g.profiler.enable()
+        except ValueError: g.profiler = None  # another request is being profiled right now
+
+@api.after_app_request
+def finish_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{uuid.uuid4().hex[:8]}.prof"
+        profiler.dump_stats(os.path.join(PROFILES_DIR, name))
+        prune_profiles()
+        response.headers['X-Profile-File'] = name
+    # Streamed responses (SSE, NDJSON) are timed up to their first byte
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("http_request_seconds", time.perf_counter() - g.pop('started', time.perf_counter()),
+                    route=route, method=request.method, status=response.status_code)
+    return response
+
+def prune_profiles():
+    """ Removes the oldest profile dumps beyond PROFILE_KEEP. """
+    dumps = []
+    for name in os.listdir(PROFILES_DIR):
+        if not name.endswith('.prof'): continue
+        try: dumps.append((os.path.getmtime(os.path.join(PROFILES_DIR, name)), name))
+        except OSError: continue  # removed by another worker meanwhile
+    for _, name in sorted(dumps)[:-PROFILE_KEEP]:
+        try: os.remove(os.path.join(PROFILES_DIR, name))
+        except OSError: pass
+
+@api.teardown_app_request
+def stop_profiler(error=None):
+    profiler = g.pop('profiler', None)
+    if profiler: profiler.disable()
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-def save_project_metadata(company_id, data):
-    projects = load_projects()
-    projects[company_id] = data
-    with open(PROJECTS_FILE, 'w') as f: json.dump(projects, f, indent=4)
 
+# --- UTILS ---
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def clean_json_string(json_str):
-    if "```json" in json_str:
-        json_str = json_str.split("```json")[1].split("```")[0]
-    elif "```" in json_str:
-        json_str = json_str.split("```")[1].split("```")[0]
-    return json_str.strip()
-
-# --- SMART PDF FILTERING ---
-def create_filtered_pdf(original_path, output_path):
-    reader = PdfReader(original_path)
-    writer = PdfWriter()
-    num_pages = len(reader.pages)
+
+# --- PARSED DATA CACHE ---
+def extraction_path(company_id, year):
+    return os.path.join(BASE_DIR, company_id, str(year), f"{company_id}_{year}_extracted.json")
+
+def saved_consolidation_path(company_id):
+    return os.path.join(BASE_DIR, company_id, 'consolidated_saved.json')
+
+def overrides_path(company_id):
+    """ Override file written by earlier versions, before the journal. """
+    return os.path.join(BASE_DIR, company_id, 'consolidated_overrides.json')
+
+def load_json_cached(company_id, kind, path):
+    """ Parsed JSON file, served from memory while its mtime and size are unchanged. Do not mutate. """
+    stamp = file_stamp(path)
+    if stamp is None: return None
+    key = (company_id, kind, path)
+    data = memory_cache.get(key, stamp)
+    if data is None:
+        with open(path, 'r') as f: data = json.load(f)
+        memory_cache.put(key, data, stamp[1], stamp)
+    return data
+
+# --- TRIAL BALANCE ---
+def tb_source(company_id, year):
+    files = glob.glob(os.path.join(BASE_DIR, company_id, str(year), f"TB_{year}.*"))
+    return files[0] if files else None
+
+def load_tb(company_id, year):
+    """ The year's trial balance store (ingested on first use or when the upload changes), or None. """
+    source = tb_source(company_id, year)
+    if not source: return None
+    key, stamp = (company_id, 'tb', str(year)), file_stamp(source)
+    tb = memory_cache.get(key, stamp)
+    if tb is None:
+        tb = load_trial_balance(source, os.path.join(BASE_DIR, company_id, str(year), 'trial_balance'))
+        memory_cache.put(key, tb, 4096, stamp)
+    return tb
+
+# --- EXTRACTION PIPELINE ---
+EXTRACTION_STAGES = ["ingesting", "filtering", "model_processing", "parsing", "saving"]
+
+def build_prompt(year):
+    return f"""
+    You are an expert financial analyst. Analyze the Financial Statements for {year}.
     
-    HEADERS = {
-        "financial": [
-            "statement of financial position", "balance sheet",
-            "statement of profit or loss", "comprehensive income", "income statement",
-            "statement of changes in equity",
-            "statement of cash flows", "cash flows"
-        ],
-        "notes": ["notes to the financial statements"]
+    OUTPUT JSON STRUCTURE:
+    {{
+        "statement_of_financial_position": [ {{ "line_item": "...", "note_ref": "...", "value": 0, "is_header": false }} ],
+        "statement_of_profit_or_loss": [ ... ],
+        "statement_of_cash_flows": [ ... ],
+        "notes": {{ "1": "Markdown content..." }},
+        "note_tables": {{ "17": [ {{ "Line_Item": "...", "{year}": "..." }} ] }}
+    }}
+
+    RULES:
+    - Extract data for YEAR {year} ONLY.
+    - Ensure 'value' is a number. If header, 0.
+    - Preserve note references.
+    - "note_tables" should extract structured tables from the notes (like PPE, Intangible Assets, Cost of Sales).
+    - Return ONLY raw JSON.
+    """
+
+SECTION_TITLES = {
+    "statement_of_financial_position": "Statement of Financial Position",
+    "statement_of_profit_or_loss": "Statement of Profit or Loss",
+    "statement_of_cash_flows": "Statement of Cash Flows",
+}
+
+def build_section_prompt(year, section):
+    if section in SECTION_TITLES:
+        return f"""
+    You are an expert financial analyst. These pages contain the {SECTION_TITLES[section]} for {year}.
+
+    OUTPUT JSON STRUCTURE:
+    {{
+        "{section}": [ {{ "line_item": "...", "note_ref": "...", "value": 0, "is_header": false }} ]
+    }}
+
+    RULES:
+    - Extract data for YEAR {year} ONLY.
+    - Ensure 'value' is a number. If header, 0.
+    - Preserve note references.
+    - Return ONLY raw JSON.
+    """
+    return f"""
+    You are an expert financial analyst. These pages are part of the notes to the {year} Financial Statements.
+
+    OUTPUT JSON STRUCTURE:
+    {{
+        "notes": {{ "1": "Markdown content..." }},
+        "note_tables": {{ "17": [ {{ "Line_Item": "...", "{year}": "..." }} ] }}
+    }}
+
+    RULES:
+    - Key every note by its number, including a note that continues from earlier pages.
+    - "note_tables" should extract structured tables from the notes (like PPE, Intangible Assets, Cost of Sales).
+    - Return ONLY raw JSON.
+    """
+
+def call_model(provider, pdf_path, prompt, section=None, progress=None):
+    """ The provider's parsed JSON answer for a PDF (ValueError if unparseable). """
+    # Upload, remote processing and generation all count against the model slots
+    with model_slots():
+        return provider.extract(pdf_path, prompt, section, progress)
+
+def extract_section(provider, report_hash, original_pdf_path, save_dir, year, section, pages, progress=None):
+    """
+    One section's JSON, from the content cache or a model call retried up to
+    SECTION_RETRIES times. A repaired (cut short) answer is returned but not cached.
+    """
+    prompt = build_section_prompt(year, section)
+    key = cache_key(report_hash, section, pages, prompt, provider.name)
+    cached = content_cache.get_json(key)
+    if cached is not None:
+        if progress:
+            for section_key, value in cached.items(): progress("section", key=section_key, value=value)
+        return cached
+
+    # Unique per call: another worker process may be extracting the same year
+    pdf_path = os.path.join(save_dir, f"temp_{section}_{year}_{uuid.uuid4().hex[:8]}.pdf")
+    write_pages(original_pdf_path, pages, pdf_path)
+    try:
+        for attempt in range(SECTION_RETRIES + 1):
+            try:
+                result = call_model(provider, pdf_path, prompt, section, progress)
+                break
+            except ProviderError:
+                # Transient API errors were already retried by the provider
+                raise
+            except Exception as e:
+                print(f"Section {section} ({year}) attempt {attempt + 1} failed: {e}")
+                if attempt == SECTION_RETRIES: raise
+    finally:
+        os.remove(pdf_path)
+    if not result.get("repaired"): content_cache.put_json(key, result)
+    return result
+
+def merge_sections(parts):
+    """ Section results combined into the single financial_statements layout. """
+    merged = {s: [] for s in SECTION_TITLES}
+    merged.update({"notes": {}, "note_tables": {}})
+    for part in parts:
+        for section in SECTION_TITLES:
+            if isinstance(part.get(section), list): merged[section].extend(part[section])
+        # A note split across two chunks comes back under the same number from both
+        for ref, text in (part.get("notes") or {}).items():
+            merged["notes"][ref] = f"{merged['notes'][ref]}\n\n{text}" if ref in merged["notes"] else text
+        for ref, rows in (part.get("note_tables") or {}).items():
+            if isinstance(rows, list): merged["note_tables"].setdefault(ref, []).extend(rows)
+    return merged
+
+def extract_sections(provider, report_hash, original_pdf_path, save_dir, year, chunks, progress=None):
+    """
+    Runs the section calls concurrently; returns the merged result, with the names of
+    sections that still failed or were only salvaged in "failed_sections" / "repaired_sections".
+    """
+    futures = {
+        section_pool.submit(extract_section, provider, report_hash, original_pdf_path, save_dir, year, section, pages, progress): section
+        for section, pages in chunks
+    }
+    results, failed = {}, []
+    for future in as_completed(futures):
+        try: results[futures[future]] = future.result()
+        except Exception: failed.append(futures[future])
+    # Merge in document order so notes split across chunks read top to bottom
+    merged = merge_sections([results[s] for s, _ in chunks if s in results])
+    repaired = [s for s, _ in chunks if results.get(s, {}).get("repaired")]
+    if failed: merged["failed_sections"] = sorted(failed)
+    if repaired: merged["repaired_sections"] = repaired
+    return merged
+
+def run_extraction(job, company_id, year, provider=None):
+    save_dir = os.path.join(BASE_DIR, company_id, str(year))
+    output_file = extraction_path(company_id, year)
+
+    response_data = {
+        "trial_balance": None,
+        "financial_statements": {}
     }
-    
-    pages_to_keep = set()
-    found_notes_start = False
-    
-    for i in range(num_pages):
-        page_text = reader.pages[i].extract_text()
-        if not page_text: continue
-        lower_text = page_text.lower()
-        
-        if found_notes_start:
-            pages_to_keep.add(i)
-            continue
-
-        if any(h in lower_text for h in HEADERS["notes"]):
-            found_notes_start = True
-            pages_to_keep.add(i)
-            continue
-
-        if any(h in lower_text for h in HEADERS["financial"]):
-            pages_to_keep.add(i)
-    
-    if not pages_to_keep:
-        pages_to_keep = set(range(num_pages))
 
-    sorted_pages = sorted(list(pages_to_keep))
-    for p in sorted_pages:
-        writer.add_page(reader.pages[p])
-    
-    with open(output_path, "wb") as f:
-        writer.write(f)
-
-# --- HELPER: FIND VALUE IN EXTRACTION ---
-def find_val(items, keywords):
-    """ Searches a list of items for the first match of keywords and returns value. """
-    if not items: return 0
-    for item in items:
-        line_item = str(item.get('line_item', '')).lower()
-        if any(k in line_item for k in keywords):
-            val = item.get('value', 0)
-            if isinstance(val, (int, float)): return val
-            try: return float(str(val).replace(',', '').strip())
-            except: return 0
-    return 0
+    # 1. Process Trial Balance (Excel/CSV) - OPTIONAL: stored as typed columns, served in pages
+    job.set_stage("ingesting")
+    try:
+        tb = load_tb(company_id, year)
+        if tb: response_data["trial_balance"] = tb.info()
+    except Exception as e:
+        print(f"Trial balance error: {e}")
+
+    # 2. Process PDF (Financial Statements)
+    fs_files = glob.glob(os.path.join(save_dir, f"financial_report_{year}.*"))
+    if fs_files:
+        original_pdf_path = fs_files[0]
+        metrics.inc("pdf_bytes_total", os.path.getsize(original_pdf_path), stage="received")
+        temp_pdf_path = os.path.join(save_dir, f"temp_filtered_{year}_{uuid.uuid4().hex[:8]}.pdf")
+
+        # Identical filings (re-uploads, group subsidiaries...) are served from the content cache
+        provider = get_provider(provider)
+        report_hash = content_hash(original_pdf_path)
+        prompt = build_prompt(year)
+        result_key = cache_key(report_hash, prompt, provider.name)
+        cached_result = content_cache.get_json(result_key)
+
+        if cached_result is not None:
+            response_data["financial_statements"] = cached_result
+        else:
+            job.set_stage("filtering")
+            pages_scanned = lambda done, total: job.emit("pages", done=done, total=total)
+            chunks = section_chunks(classify_pages(original_pdf_path, pages_scanned)["pages"])
+            if chunks:
+                # One model call per statement / run of notes pages, merged back into one result
+                job.set_stage("model_processing")
+                extracted_json = extract_sections(provider, report_hash, original_pdf_path, save_dir, year, chunks, job.emit)
+                job.set_stage("parsing")
+                response_data["financial_statements"] = extracted_json
+                if not ("failed_sections" in extracted_json or "repaired_sections" in extracted_json):
+                    content_cache.put_json(result_key, extracted_json)
+            else:
+                # No statement headers found (e.g. scanned report): send the filtered document whole
+                filter_key = cache_key(report_hash, HEADER_PATTERN.pattern)
+                if not content_cache.copy_to(filter_key, 'pdf', temp_pdf_path):
+                    create_filtered_pdf(original_pdf_path, temp_pdf_path, pages_scanned)
+                    content_cache.put_file(filter_key, 'pdf', temp_pdf_path)
+
+                job.set_stage("model_processing")
+                try:
+                    extracted_json = call_model(provider, temp_pdf_path, prompt, progress=job.emit)
+                    job.set_stage("parsing")
+                    response_data["financial_statements"] = extracted_json
+                    if not extracted_json.get("repaired"): content_cache.put_json(result_key, extracted_json)
+                except ValueError as e:
+                    print(f"AI Parse Error: {e}")
+                    response_data["financial_statements"] = {"error": "Failed to parse AI response"}
+                finally:
+                    if os.path.exists(temp_pdf_path): os.remove(temp_pdf_path)
+
+    # Save locally
+    job.set_stage("saving")
+    with open(output_file, 'w') as f:
+        json.dump(response_data, f, indent=4)
+    memory_cache.discard(company_id)
+    try: search_index.index_file(company_id, year, output_file)
+    except Exception as e: print(f"Search index error: {e}")
+
+    return response_data
 
 # --- EXTRACTION ENDPOINT ---
-@app.route('/extract', methods=['POST'])
+@api.route('/extract', methods=['POST'])
 def extract_data():
     try:
         data = request.json
@@ -114,425 +410,353 @@ def extract_data():
 
         if not company_id or not year:
             return jsonify({"error": "Missing parameters"}), 400
+        provider = data.get('provider')
+        if provider and provider not in PROVIDERS: return jsonify({"error": f"Unknown provider {provider}"}), 400
 
-        save_dir = os.path.join(BASE_DIR, company_id, str(year))
-        output_file = os.path.join(save_dir, f"{company_id}_{year}_extracted.json")
-
-        if os.path.exists(output_file):
-            with open(output_file, 'r') as f:
-                return jsonify(json.load(f)), 200
-
-        response_data = {
-            "trial_balance": [],
-            "financial_statements": {}
-        }
-
-        # 1. Process Excel (Trial Balance) - OPTIONAL
-        tb_files = glob.glob(os.path.join(save_dir, f"TB_{year}.*"))
-        if tb_files:
-            try:
-                df = pd.read_excel(tb_files[0])
-                df = df.fillna('')
-                response_data["trial_balance"] = df.to_dict(orient='records')
-            except Exception as e:
-                print(f"Excel error: {e}")
-
-        # 2. Process PDF (Financial Statements)
-        fs_files = glob.glob(os.path.join(save_dir, f"financial_report_{year}.*"))
-        if fs_files:
-            original_pdf_path = fs_files[0]
-            temp_pdf_path = os.path.join(save_dir, f"temp_filtered_{year}.pdf")
-            
-            create_filtered_pdf(original_pdf_path, temp_pdf_path)
-            
-            uploaded_file = genai.upload_file(temp_pdf_path, mime_type="application/pdf")
-            
-            while uploaded_file.state.name == "PROCESSING":
-                time.sleep(1)
-                uploaded_file = genai.get_file(uploaded_file.name)
+        extracted = load_json_cached(company_id, 'extracted', extraction_path(company_id, year))
+        if extracted is not None:
+            return jsonify(extracted), 200
 
-            if uploaded_file.state.name == "FAILED":
-                return jsonify({"error": "AI File processing failed"}), 500
-
-            prompt = f"""
-            You are an expert financial analyst. Analyze the Financial Statements for {year}.
-            
-            OUTPUT JSON STRUCTURE:
-            {{
-                "statement_of_financial_position": [ {{ "line_item": "...", "note_ref": "...", "value": 0, "is_header": false }} ],
-                "statement_of_profit_or_loss": [ ... ],
-                "statement_of_cash_flows": [ ... ],
-                "notes": {{ "1": "Markdown content..." }},
-                "note_tables": {{ "17": [ {{ "Line_Item": "...", "{year}": "..." }} ] }}
-            }}
-
-            RULES:
-            - Extract data for YEAR {year} ONLY.
-            - Ensure 'value' is a number. If header, 0.
-            - Preserve note references.
-            - "note_tables" should extract structured tables from the notes (like PPE, Intangible Assets, Cost of Sales).
-            - Return ONLY raw JSON.
-            """
-
-            model = genai.GenerativeModel("gemini-2.5-flash") # Updated model name for better speed/cost
-            result = model.generate_content([uploaded_file, prompt])
-            
-            try:
-                cleaned_json = clean_json_string(result.text)
-                extracted_json = json.loads(cleaned_json)
-                response_data["financial_statements"] = extracted_json
-            except Exception as e:
-                print(f"AI Parse Error: {e}")
-                response_data["financial_statements"] = {"error": "Failed to parse AI response"}
-        
-        # Save locally
-        with open(output_file, 'w') as f:
-            json.dump(response_data, f, indent=4)
+        try:
+            job = job_queue.submit("extract", (company_id, str(year)), run_extraction,
+                                   {"company_id": company_id, "year": year, "provider": provider}, EXTRACTION_STAGES)
+        except QueueFull:
+            return jsonify({"error": "Extraction queue is full, retry shortly"}), 503
 
-        return jsonify(response_data), 200
+        return jsonify({**job.to_dict(), "status_url": f"/jobs/{job.id}"}), 202
 
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
-# --- CONSOLIDATE ENDPOINT ---
-@app.route('/consolidate', methods=['POST'])
+# --- BATCH EXTRACTION (all years of a project) ---
+@api.route('/extract_batch', methods=['POST'])
+def extract_batch():
+    data = request.json or {}
+    company_id = data.get('company_id')
+    if not company_id: return jsonify({"error": "Missing company_id"}), 400
+
+    project = project_store.get(company_id)
+    if not project: return jsonify({"error": "Project not found"}), 404
+    years = [str(y) for y in data.get('years') or project.get('years', [])]
+    provider = data.get('provider')
+    if provider and provider not in PROVIDERS: return jsonify({"error": f"Unknown provider {provider}"}), 400
+
+    def generate():
+        # Queue every year up front so they run side by side, then report each as it finishes
+        pending = {}
+        for year in years:
+            save_dir = os.path.join(BASE_DIR, company_id, year)
+            if os.path.exists(extraction_path(company_id, year)):
+                yield json.dumps({"year": year, "status": "cached"}) + "\n"
+                continue
+            if not glob.glob(os.path.join(save_dir, f"financial_report_{year}.*")):
+                yield json.dumps({"year": year, "status": "skipped", "error": "No financial report uploaded"}) + "\n"
+                continue
+            try:
+                job = job_queue.submit("extract", (company_id, year), run_extraction,
+                                       {"company_id": company_id, "year": year, "provider": provider}, EXTRACTION_STAGES)
+            except QueueFull:
+                yield json.dumps({"year": year, "status": "failed", "error": "Extraction queue is full, retry shortly"}) + "\n"
+                continue
+            pending[job.future] = job
+            yield json.dumps({"year": year, "status": "queued", "job_id": job.id}) + "\n"
+
+        for future in as_completed(pending):
+            job = pending[future]
+            yield json.dumps({"year": job.params["year"], "status": job.status, "job_id": job.id, "error": job.error}) + "\n"
+
+        yield json.dumps({"done": True}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- SERVER-SENT EVENTS ---
+SSE_HEARTBEAT = 15  # seconds between keep-alive comments, so proxies don't drop an idle stream
+
+def sse(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- JOB STATUS ENDPOINTS ---
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@api.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    A job's progress as server-sent events (stage, pages, upload, section), ending with
+    "done" or "failed". Reconnecting clients resume after Last-Event-ID.
+    """
+    job = job_queue.get(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    last_id = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+
+    def generate():
+        seen = last_id
+        while True:
+            events = job.events_after(seen, SSE_HEARTBEAT)
+            if not events:
+                if job.finished: return
+                yield ": keep-alive\n\n"
+                continue
+            for e in events:
+                yield sse(e["event"], e["data"], e["id"])
+                seen = e["id"]
+                if e["event"] in ("done", "failed"): return
+
+    return sse_response(generate())
+
+@api.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    if job.status == "failed": return jsonify({"error": job.error}), 500
+    # While running: the sections extracted so far
+    if job.status != "done": return jsonify({**job.to_dict(), "partial": job.partial}), 202
+    return jsonify(job.result), 200
+
+# --- CONSOLIDATED MODEL ---
+# Manual edits are cell overrides per mapping template, appended to a per-company journal
+# and replayed over the computed model; an edit only re-evaluates what depends on it.
+overrides_lock = threading.Lock()
+LOCKS_DIR = os.path.join(BASE_DIR, '_locks')
+
+@contextmanager
+def company_lock(company_id):
+    """ Serializes journal edits of a company across threads and, where flock exists, across worker processes. """
+    with overrides_lock, file_lock(os.path.join(LOCKS_DIR, f"{secure_filename(company_id)}.lock")):
+        yield
+
+def load_yearly_data(company_id, years):
+    yearly_data = {}
+    for year in years:
+        full_data = load_json_cached(company_id, 'extracted', extraction_path(company_id, year))
+        if full_data is not None:
+            fs = full_data.get('financial_statements', {})
+            yearly_data[year] = {
+                "pl": fs.get('statement_of_profit_or_loss', []),
+                "bs": fs.get('statement_of_financial_position', []),
+                "cf": fs.get('statement_of_cash_flows', []),
+                "tb": full_data.get('trial_balance', []),
+                "note_tables": fs.get('note_tables', {})
+            }
+        else:
+            yearly_data[year] = {"pl": [], "bs": [], "cf": [], "tb": [], "note_tables": {}}
+    return yearly_data
+
+def load_columns(company_id, years, plan):
+    """ The plan's input vectors for a company, kept in memory until an extracted file changes. """
+    key = (company_id, 'columns', plan.name)
+    stamp = (tuple(years), tuple(file_stamp(extraction_path(company_id, y)) for y in years))
+    columns = memory_cache.get(key, stamp)
+    if columns is None:
+        columns = extract_columns(years, load_yearly_data(company_id, years), plan)
+        memory_cache.put(key, columns, 8 * len(years) * len(columns), stamp)
+    return columns
+
+def load_tb_mappings(company_id, years, plan):
+    """ ({year: mapped TB}, {year: error}) for the years that have a trial balance. """
+    results, errors = {}, {}
+    for year in years:
+        source = tb_source(company_id, year)
+        if not source: continue
+        key, stamp = (company_id, 'tb_map', plan.name, str(year)), file_stamp(source)
+        result = memory_cache.get(key, stamp)
+        if result is None:
+            try: result = get_mapper(plan).map(load_tb(company_id, year))
+            except MappingError as e:
+                errors[year] = str(e)
+                continue
+            memory_cache.put(key, result, 4096, stamp)
+        results[year] = result
+    return results, errors
+
+def journal_for(company_id):
+    return OverrideJournal(os.path.join(BASE_DIR, company_id))
+
+def load_journal(company_id):
+    """ Replayed override journal, kept in memory while the log file is unchanged. """
+    journal = journal_for(company_id)
+    key, stamp = (company_id, 'journal'), file_stamp(journal.path)
+    state = memory_cache.get(key, stamp)
+    if state is None:
+        state = journal.read()
+        memory_cache.put(key, state, stamp[1] if stamp else 0, stamp)
+    return journal, state
+
+def append_journal(company_id, state):
+    # Cache the state we just wrote: two quick appends can leave the same mtime behind
+    memory_cache.put((company_id, 'journal'), state, state.offset, file_stamp(journal_for(company_id).path))
+    return state
+
+def migrate_saved_consolidation(company_id, years, plan):
+    """ Moves overrides stored by older versions (a full saved model, or an overrides file) into the journal. """
+    saved_path, legacy_path = saved_consolidation_path(company_id), overrides_path(company_id)
+    if not os.path.exists(saved_path) and not os.path.exists(legacy_path): return
+    journal, state = load_journal(company_id)
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'r') as f: legacy = json.load(f)
+        for template, overrides in legacy.items():
+            state = journal.replace(state, template, overrides)
+        os.remove(legacy_path)
+    if os.path.exists(saved_path):
+        with open(saved_path, 'r') as f: saved = json.load(f)
+        overrides = {n: dict(c) for n, c in state.template(plan.name).items()}
+        for name, cells in overrides_from_model(years, plan, load_columns(company_id, years, plan), saved).items():
+            overrides.setdefault(name, {}).update(cells)
+        state = journal.replace(state, plan.name, overrides)
+        os.remove(saved_path)
+    append_journal(company_id, state)
+
+def model_stamp(company_id, years, state):
+    return (tuple(years), tuple(file_stamp(extraction_path(company_id, y)) for y in years), state.seq)
+
+def load_model(company_id, years, plan):
+    """ (evaluated env, journal state) for a company, cached on the extracted files and the journal position. """
+    _, state = load_journal(company_id)
+    key, stamp = (company_id, 'env', plan.name), model_stamp(company_id, years, state)
+    env = memory_cache.get(key, stamp)
+    if env is None:
+        env = plan.evaluate(load_columns(company_id, years, plan), pins_for(years, state.template(plan.name)))
+        memory_cache.put(key, env, 8 * len(years) * len(env), stamp)
+    return env, state
+
+def project_plan(data):
+    """ (company_id, years, plan) for a request body, or an error response. """
+    company_id = data.get('company_id')
+    if not company_id: return None, (jsonify({"error": "Missing company_id"}), 400)
+    project = project_store.get(company_id)
+    if not project: return None, (jsonify({"error": "Project not found"}), 404)
+    plan = get_plan(data.get('template'))
+    if not plan: return None, (jsonify({"error": "Unknown mapping template"}), 400)
+    return (company_id, sorted(project.get('years', [])), plan), None
+
+def consolidated_env(company_id, years, plan, source=None):
+    """ The evaluated model: with the journal's manual edits, or rebuilt from the trial balances. """
+    # Rebuilt from the trial balances where mapped (read-only: manual overrides don't apply)
+    if source == 'trial_balance':
+        with metrics.timer("stage_seconds", stage="consolidation"):
+            results, _ = load_tb_mappings(company_id, years, plan)
+            return plan.evaluate(apply_tb_columns(load_columns(company_id, years, plan), tb_columns(years, results, plan)))
+
+    with company_lock(company_id), metrics.timer("stage_seconds", stage="consolidation"):
+        migrate_saved_consolidation(company_id, years, plan)
+        env, _ = load_model(company_id, years, plan)
+    return env
+
+@api.route('/consolidate', methods=['POST'])
 def consolidate_data():
     try:
-        data = request.json
-        company_id = data.get('company_id')
-        if not company_id: return jsonify({"error": "Missing company_id"}), 400
-
-        # NEW: Check for saved manual overrides first
-        saved_file = os.path.join(BASE_DIR, company_id, 'consolidated_saved.json')
-        if os.path.exists(saved_file):
-            with open(saved_file, 'r') as f:
-                return jsonify(json.load(f)), 200
-
-        projects = load_projects()
-        if company_id not in projects: return jsonify({"error": "Project not found"}), 404
-        
-        years = sorted(projects[company_id].get('years', []))
-        consolidated = {
-            "years": years,
-            "calculated_income_statement": [],
-            "calculated_balance_sheet": [],
-            "calculated_cash_flow": [] # <--- NEW FIELD
-        }
+        found, error = project_plan(request.json)
+        if error: return error
+        company_id, years, plan = found
+        env = consolidated_env(company_id, years, plan, request.json.get('source'))
+        return jsonify(build_statements(years, plan, env)), 200
 
-        # Temp storage for calc logic
-        yearly_data = {}
-
-        for year in years:
-            extract_path = os.path.join(BASE_DIR, company_id, str(year), f"{company_id}_{year}_extracted.json")
-            if os.path.exists(extract_path):
-                with open(extract_path, 'r') as f:
-                    full_data = json.load(f)
-                    fs = full_data.get('financial_statements', {})
-                    yearly_data[year] = {
-                        "pl": fs.get('statement_of_profit_or_loss', []),
-                        "bs": fs.get('statement_of_financial_position', []),
-                        "cf": fs.get('statement_of_cash_flows', []),
-                        "tb": full_data.get('trial_balance', []),
-                        "note_tables": fs.get('note_tables', {})
-                    }
-            else:
-                yearly_data[year] = {"pl": [], "bs": [], "cf": [], "tb": [], "note_tables": {}}
-
-        # --- HELPER: BUILD ROW ---
-            def build_row(label, value_map, format_as_percent=False, is_header=False):
-                        row = {"line_item": label, "is_header": is_header, "is_percentage": format_as_percent} # Added is_percentage flag
-                        if is_header:
-                            for y in years: row[y] = ""
-                        else:
-                            for y in years:
-                                val = value_map.get(y, 0)
-                                # KEEP RAW NUMBERS for frontend calculation, formatting happens in UI
-                                row[y] = val 
-                        return row
-        # ==========================================
-        # 1. INCOME STATEMENT CALCULATIONS
-        # ==========================================
-        
-        # 1. Revenue
-        rev_map = {}
-        for y in years:
-            rev_map[y] = find_val(yearly_data[y]['pl'], ['revenue', 'turnover', 'sales'])
-        consolidated['calculated_income_statement'].append(build_row("Revenue from Operations", rev_map))
-
-        # 2. Revenue Growth Rate
-        growth_map = {}
-        for i, y in enumerate(years):
-            if i == 0: growth_map[y] = 0
-            else:
-                prev_rev = rev_map[years[i-1]]
-                curr_rev = rev_map[y]
-                if prev_rev != 0:
-                    growth_map[y] = ((curr_rev - prev_rev) / prev_rev) * 100
-                else: growth_map[y] = 0
-        consolidated['calculated_income_statement'].append(build_row("Revenue Growth Rate (%)", growth_map, True))
-
-        # 3. COGS
-        cogs_map = {}
-        for y in years:
-            cogs_map[y] = find_val(yearly_data[y]['pl'], ['cost of sales', 'cost of revenue', 'cost of goods'])
-        consolidated['calculated_income_statement'].append(build_row("Cost Of Sales", cogs_map))
-
-        # 5. Gross Profit (Rev - COGS)
-        gp_map = {}
-        for y in years:
-            gp_map[y] = rev_map[y] + cogs_map[y]
-        consolidated['calculated_income_statement'].append(build_row("Gross Profit", gp_map))
-
-        # 6. COGS % & GP Margin %
-        cogs_pct_map = {}
-        gp_margin_map = {}
-        for y in years:
-            rev = rev_map[y] if rev_map[y] != 0 else 1
-            cogs_pct_map[y] = np.abs((cogs_map[y] / rev) * 100)
-            gp_margin_map[y] = np.abs((gp_map[y] / rev) * 100)
-        consolidated['calculated_income_statement'].append(build_row("COS%", cogs_pct_map, True))
-        consolidated['calculated_income_statement'].append(build_row("GP Margin %", gp_margin_map, True))
-
-        # 8. Other Income
-        other_inc_map = {}
-        for y in years:
-            other_inc_map[y] = find_val(yearly_data[y]['pl'], ['other income'])
-        consolidated['calculated_income_statement'].append(build_row("Other Income", other_inc_map))
-
-        # 9. G&A Expenses
-        ga_map = {}
-        for y in years:
-            ga_map[y] = find_val(yearly_data[y]['pl'], ['general', 'administrative', 'operating exp'])
-        consolidated['calculated_income_statement'].append(build_row("General & Administrative Expenses", ga_map))
-
-        # 10. G&A %
-        ga_pct_map = {}
-        for y in years:
-            rev = rev_map[y] if rev_map[y] != 0 else 1
-            ga_pct_map[y] = np.abs((ga_map[y] / rev) * 100)
-        consolidated['calculated_income_statement'].append(build_row("G&A as % of Revenue", ga_pct_map, True))
-
-        # 11. EBITDA
-        ebitda_map = {}
-        for y in years:
-            ebitda_map[y] = gp_map[y] + other_inc_map[y] + ga_map[y]
-        consolidated['calculated_income_statement'].append(build_row("EBITDA", ebitda_map))
-
-        # 12. EBITDA Margin
-        ebitda_pct_map = {}
-        for y in years:
-            rev = rev_map[y] if rev_map[y] != 0 else 1
-            ebitda_pct_map[y] = (ebitda_map[y] / rev) * 100
-        consolidated['calculated_income_statement'].append(build_row("EBITDA Margin %", ebitda_pct_map, True))
-
-        # 13. Depreciation & Amortization
-        depr_map = {}
-        amort_map = {}
-        for y in years:
-            depr_map[y] = find_val(yearly_data[y]['pl'], ['depreciation'])
-            if depr_map[y] == 0:
-                depr_map[y] = find_val(yearly_data[y]['cf'], ['depreciation'])
-            
-            amort_map[y] = find_val(yearly_data[y]['cf'], ['amortisation'])
-        
-        consolidated['calculated_income_statement'].append(build_row("Depreciation", depr_map))
-        consolidated['calculated_income_statement'].append(build_row("Amortization", amort_map))
-
-        # 14. EBIT
-        ebit_map = {}
-        for y in years:
-            ebit_map[y] = ebitda_map[y] - depr_map[y] - amort_map[y]
-        consolidated['calculated_income_statement'].append(build_row("EBIT", ebit_map))
-
-        # 15. EBIT Margin
-        ebit_pct_map = {}
-        for y in years:
-            rev = rev_map[y] if rev_map[y] != 0 else 1
-            ebit_pct_map[y] = (ebit_map[y] / rev) * 100
-        consolidated['calculated_income_statement'].append(build_row("EBIT Margin %", ebit_pct_map, True))
-
-        # 16. Interest Expenses
-        int_map = {}
-        for y in years:
-            int_map[y] = find_val(yearly_data[y]['pl'], ['finance cost', 'interest exp'])
-        consolidated['calculated_income_statement'].append(build_row("Interest Expenses", int_map))
-
-        # 17. EBT
-        ebt_map = {}
-        for y in years:
-            ebt_map[y] = ebit_map[y] - int_map[y]
-        consolidated['calculated_income_statement'].append(build_row("EBT", ebt_map))
-
-        # 18. EBT Margin
-        ebt_pct_map = {}
-        for y in years:
-            rev = rev_map[y] if rev_map[y] != 0 else 1
-            ebt_pct_map[y] = (ebt_map[y] / rev) * 100
-        consolidated['calculated_income_statement'].append(build_row("EBT Margin %", ebt_pct_map, True))
-
-        # 19. Taxes
-        tax_map = {}
-        for y in years:
-            tax_map[y] = ebit_map[y] * 0.09
-        consolidated['calculated_income_statement'].append(build_row("Taxes (9% on EBIT)", tax_map))
-
-        # 20. Net Income
-        ni_map = {}
-        for y in years:
-            ni_map[y] = ebt_map[y] - tax_map[y]
-        consolidated['calculated_income_statement'].append(build_row("Net Income", ni_map))
-
-        # 21. Net Income Margin
-        ni_pct_map = {}
-        for y in years:
-            rev = rev_map[y] if rev_map[y] != 0 else 1
-            ni_pct_map[y] = (ni_map[y] / rev) * 100
-        consolidated['calculated_income_statement'].append(build_row("Net Income Margin %", ni_pct_map, True))
-
-        # ==========================================
-        # 2. BALANCE SHEET CONSOLIDATION
-        # ==========================================
-        
-        # Structure Definition: (Label, Search Keys, IsHeader)
-        # Search keys is None if it's a Header or a Total we calculate manually
-        bs_structure = [
-            ("Assets", None, True),
-            ("Non-current assets", None, True),
-            ("Property and equipment", ["property and equipment", "property, plant"], False),
-            ("Intangible assets", ["intangible assets"], False),
-            ("Total non-current assets", ["total non-current assets"], False), # Extracted directly or calculated? Using extraction for now to match source
-            ("Current Assets", None, True),
-            ("Inventories", ["inventories", "stock"], False),
-            ("Trade and other receivables", ["trade and other receivables"], False),
-            ("Cash and cash equivalents", ["cash and cash equivalents"], False),
-            ("Total current assets", ["total current assets"], False),
-            ("Total Assets", ["total assets"], False),
-            
-            ("Shareholders' funds and liabilities", None, True),
-            ("Equity", None, True),
-            ("Share capital", ["share capital"], False),
-            ("Statutory reserve", ["statutory reserve"], False),
-            ("Retained earnings/(accumulated losses)", ["retained earnings", "accumulated losses"], False),
-            ("Total equity/(deficit)", ["total equity", "total deficit"], False),
-            ("Shareholders' current accounts", ["shareholders' current", "partners' current"], False),
-            ("Total shareholders' funds", ["total shareholders' funds"], False), # Fallback to total equity if funds not explicit?
-            
-            ("Non-current liabilities", None, True),
-            ("Provision for employees' end of service benefits", ["end of service", "EOSB"], False),
-            ("Bank borrowings (NC)", ["bank borrowings", "term loan"], False), # Special handling needed for duplicate names
-            ("Total non-current liabilities", ["total non-current liabilities"], False),
-            
-            ("Current liabilities", None, True),
-            ("Trade and other payables", ["trade and other payables"], False),
-            ("Bank borrowings (C)", ["bank borrowings", "term loan"], False),
-            ("Total current liabilities", ["total current liabilities"], False),
-            ("Total liabilities", ["total liabilities"], False),
-            ("Total shareholders' funds and liabilities", ["total shareholders' funds and liabilities", "total equity and liabilities"], False)
-        ]
-
-        # Helper to find specific BS items contextually
-        def get_bs_value(year_bs_items, keywords, section_hint=None):
-            if not year_bs_items: return 0
-            
-            # Simple Filter first
-            matches = []
-            for item in year_bs_items:
-                line_item = str(item.get('line_item', '')).lower()
-                if any(k in line_item for k in keywords):
-                    val = item.get('value', 0)
-                    try: val = float(str(val).replace(',', '').strip())
-                    except: val = 0
-                    matches.append(val)
-            
-            if not matches: return 0
-            
-            # Context Logic for duplicates like "Bank borrowings"
-            if section_hint == "NC": # Non-Current (usually appears first)
-                return matches[0]
-            elif section_hint == "C": # Current (usually appears second)
-                return matches[1] if len(matches) > 1 else 0
-            
-            return matches[0]
+    except Exception as e:
+        print(e)
+        return jsonify({"error": str(e)}), 500
 
-        for label, keywords, is_header in bs_structure:
-            if is_header:
-                consolidated['calculated_balance_sheet'].append(build_row(label, {}, False, True))
-                continue
+@api.route('/project/<company_id>/consolidate/events', methods=['GET'])
+def stream_consolidation(company_id):
+    """ /consolidate as server-sent events: the years, then each calculated statement as it is built. """
+    found, error = project_plan({"company_id": company_id, "template": request.args.get('template')})
+    if error: return error
+    company_id, years, plan = found
+    source = request.args.get('source')
+
+    def generate():
+        yield sse("years", {"years": years})
+        try:
+            yield sse("stage", {"stage": "evaluating"})
+            env = consolidated_env(company_id, years, plan, source)
+            for key, rows in iter_statements(years, plan, env):
+                yield sse("statement", {"key": key, "rows": rows})
+            yield sse("done", {})
+        except Exception as e:
+            print(e)
+            yield sse("failed", {"error": str(e)})
+
+    return sse_response(generate())
+
+@api.route('/project/<company_id>/reconciliation', methods=['GET'])
+def get_reconciliation(company_id):
+    """ Trial balance figures against the extracted statements, per mapped line item and year. """
+    try:
+        found, error = project_plan({"company_id": company_id, "template": request.args.get('template')})
+        if error: return error
+        company_id, years, plan = found
+
+        results, errors = load_tb_mappings(company_id, years, plan)
+        report = reconcile(years, plan, tb_columns(years, results, plan), load_columns(company_id, years, plan))
+        report["accounts"] = {y: {k: v for k, v in r.items() if k != "totals"} for y, r in results.items()}
+        report["errors"] = errors
+        return jsonify({"years": years, **report}), 200
+    except Exception as e:
+        print(e)
+        return jsonify({"error": str(e)}), 500
 
-            row_map = {}
-            for y in years:
-                items = yearly_data[y]['bs']
-                
-                # Special handling for Bank Borrowings split
-                if label == "Bank borrowings (NC)":
-                    row_map[y] = get_bs_value(items, keywords, "NC")
-                elif label == "Bank borrowings (C)":
-                    row_map[y] = get_bs_value(items, keywords, "C")
-                else:
-                    row_map[y] = get_bs_value(items, keywords)
-            
-            # Clean up label names for display
-            display_label = label.replace(" (NC)", "").replace(" (C)", "")
-            consolidated['calculated_balance_sheet'].append(build_row(display_label, row_map, False, False))
-
-            # ==========================================
-        # 3. CASH FLOW CONSOLIDATION (NEW)
-        # ==========================================
-        
-        cf_structure = [
-            ("Cash flows from operating activities", None, True),
-            ("Profit for the year", ["profit for the year", "profit before tax"], False),
-            ("Adjustments for:", None, True),
-            ("Depreciation", ["depreciation"], False),
-            ("Amortisation", ["amortisation", "amortization"], False),
-            ("Provision for employees' end of service benefits", ["provision for employees", "end of service benefits"], False),
-            ("Operating cash flows before changes in working capital", ["operating cash flows before", "working capital"], False),
-            ("Movements in:", None, True),
-            ("Inventories", ["inventories"], False),
-            ("Trade and other receivables", ["trade and other receivables"], False),
-            ("Trade and other payables", ["trade and other payables"], False),
-            ("Cash generated from operations", ["cash generated from operations", "Net cash generated from/(used in) operating activities"], False),
-            ("Employees' end of service benefits paid", ["employees' end of service benefits paid", "benefits paid"], False),
-            ("Net cash generated from operating activities", ["net cash generated from operating", "net cash from operating"], False),
-            
-            ("Cash flows from investing activities", None, True),
-            ("Purchase of property and equipment", ["purchase of property and equipment"], False),
-            ("Net cash generated from/ (used in) investing activities", ["net cash generated from/(used in) operating activities", "net cash used in investing", "net cash from investing"], False),
-            
-            ("Cash flows from financing activities", None, True),
-            ("Net movements in shareholders' current accounts", ["shareholders' current"], False),
-            ("Net movements in bank borrowings", ["movements in bank borrowings"], False),
-            ("Net movements in due from a related party", ["due from a related party", "related parties"], False),
-            ("Net cash (used in)/generated from financing activities", ["net cash (used in)/generated from financing", "net cash from financing", "net cash used in financing"], False),
-            
-            ("Net increase in cash and cash equivalents", ["net increase in cash"], False),
-            ("Cash and cash equivalents at the beginning of the year", ["beginning of the year"], False),
-            ("Cash and cash equivalents at the end of the year", ["end of the year"], False)
-        ]
-        for label, keywords, is_header in cf_structure:
-            if is_header:
-                consolidated['calculated_cash_flow'].append(build_row(label, {}, False, True))
-                continue
+@api.route('/valuation', methods=['POST'])
+def value_project():
+    """
+    DCF valuation of the consolidated model. Optional body keys: "assumptions" (overrides of
+    the defaults derived from history), "sensitivity" ({rows, cols}: {name, values}) and
+    "monte_carlo" ({draws, seed, spread}).
+    """
+    try:
+        data = request.json or {}
+        found, error = project_plan(data)
+        if error: return error
+        company_id, years, plan = found
+        model = build_statements(years, plan, consolidated_env(company_id, years, plan, data.get('source')))
+        return jsonify(value_company(model, data.get('assumptions'), data.get('sensitivity'), data.get('monte_carlo'))), 200
+    except ValuationError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(e)
+        return jsonify({"error": str(e)}), 500
 
-            row_map = {}
-            for y in years:
-                # Use standard find_val for CF items as they are usually unique in the CF list
-                row_map[y] = find_val(yearly_data[y]['cf'], keywords)
-            
-            consolidated['calculated_cash_flow'].append(build_row(label, row_map, False, False))
-        return jsonify(consolidated), 200
+@api.route('/recalculate', methods=['POST'])
+def recalculate_cell():
+    """ Applies one edited cell ({statement, row, year, value}) and returns only the rows that changed. """
+    try:
+        data = request.json
+        found, error = project_plan(data)
+        if error: return error
+        company_id, years, plan = found
+
+        name = row_value(plan, data.get('statement'), data.get('row', -1))
+        if name is None: return jsonify({"error": "Not an editable row"}), 400
+        year = str(data.get('year'))
+        if year not in map(str, years): return jsonify({"error": f"Unknown year {year}"}), 400
+        try: value = float(str(data.get('value')).replace(',', '').replace('%', '').strip())
+        except ValueError: return jsonify({"error": "Value must be a number"}), 400
+
+        with company_lock(company_id):
+            migrate_saved_consolidation(company_id, years, plan)
+            env, state = load_model(company_id, years, plan)
+            state = append_journal(company_id, journal_for(company_id).set(state, plan.name, name, year, value))
+            env, delta = recalculate(years, plan, env, state.template(plan.name), name, year, value)
+            memory_cache.put((company_id, 'env', plan.name), env, 8 * len(years) * len(env), model_stamp(company_id, years, state))
+        return jsonify({"delta": delta, "seq": state.seq}), 200
 
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/project/<company_id>/files', methods=['GET'])
+@api.route('/project/<company_id>/files', methods=['GET'])
 def get_project_files(company_id):
-    projects = load_projects()
-    if company_id not in projects: return jsonify({"error": "Not found"}), 404
+    project = project_store.get(company_id)
+    if not project: return jsonify({"error": "Not found"}), 404
     file_map = {}
-    for year in projects[company_id].get('years', []):
+    for year in project.get('years', []):
         year_path = os.path.join(BASE_DIR, company_id, str(year))
         file_map[year] = {
             "Financial Statement": None, 
@@ -553,13 +777,70 @@ def get_project_files(company_id):
     return jsonify(file_map), 200
 
 # --- EXISTING ENDPOINTS ---
-@app.route('/projects', methods=['GET'])
-def get_projects():
-    projects = load_projects()
-    project_list = [{"id": k, **v} for k, v in projects.items()]
-    return jsonify(project_list), 200
+@api.route('/project/<company_id>/trial_balance/<year>', methods=['GET'])
+def get_trial_balance(company_id, year):
+    """ One page of the trial balance: ?offset=&limit=&sort=<column>&desc=1 """
+    try:
+        tb = load_tb(company_id, year)
+        if tb is None: return jsonify({"error": "No trial balance for this year"}), 404
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        sort = request.args.get('sort')
+        if sort is not None and sort not in tb.columns: return jsonify({"error": f"Unknown column {sort}"}), 400
+        rows = tb.page(offset, limit, sort, request.args.get('desc') == '1')
+        return jsonify({**tb.info(), "offset": offset, "limit": limit, "data": rows}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-@app.route('/initialize', methods=['POST'])
+@api.route('/project/<company_id>/trial_balance/<year>/aggregate', methods=['GET'])
+def aggregate_trial_balance(company_id, year):
+    """ Totals of the numeric columns, optionally grouped: ?by=<column>&values=<col>,<col> """
+    try:
+        tb = load_tb(company_id, year)
+        if tb is None: return jsonify({"error": "No trial balance for this year"}), 404
+        by = request.args.get('by')
+        values = [v for v in request.args.get('values', '').split(',') if v] or None
+        for name in [by] + (values or []):
+            if name is not None and name not in tb.columns: return jsonify({"error": f"Unknown column {name}"}), 400
+        if values and any(tb.kinds[v] != "number" for v in values):
+            return jsonify({"error": "Only numeric columns can be summed"}), 400
+        return jsonify(tb.aggregate(by, values)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- SEARCH ---
+@api.route('/search', methods=['GET'])
+def search():
+    """
+    Notes and note-table rows across every company and year. q matches the text, title
+    the note heading; min/max (with optional label) find numeric table cells instead.
+    company_id, year, note and kind ("note" / "table") narrow either search.
+    """
+    args = request.args
+    try:
+        low, high = [float(args[k]) if args.get(k) else None for k in ('min', 'max')]
+        limit, offset = min(int(args.get('limit', 50)), 500), int(args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "min, max, limit and offset must be numbers"}), 400
+    filters = {k: args.get(k) for k in ('company_id', 'year', 'note')}
+    result = {}
+    if args.get('q') or args.get('title'):
+        result["hits"] = search_index.search(args.get('q'), args.get('title'), kind=args.get('kind'), limit=limit, offset=offset, **filters)
+    if low is not None or high is not None:
+        result["cells"] = search_index.cells(low, high, args.get('label'), limit=limit, offset=offset, **filters)
+    if not result: return jsonify({"error": "Give q, title, min or max"}), 400
+    return jsonify(result), 200
+
+@api.route('/projects', methods=['GET'])
+def get_projects():
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    # Paged when the client asks for a page; the project picker loads the whole list
+    limit = request.args.get('limit', type=int)
+    if limit is not None: limit = min(max(limit, 1), 1000)
+    project_list = project_store.list(offset, limit)
+    return jsonify(project_list), 200, {"X-Total-Count": str(project_store.count())}
+
+@api.route('/initialize', methods=['POST'])
 def initialize_project():
     try:
         data = request.json
@@ -569,11 +850,20 @@ def initialize_project():
         company_id = str(uuid.uuid4())
         for year in years:
             os.makedirs(os.path.join(BASE_DIR, company_id, str(year)), exist_ok=True)
-        save_project_metadata(company_id, {"name": company_name, "years": years})
+        project_store.save(company_id, {"name": company_name, "years": years})
         return jsonify({"company_id": company_id, "company_name": company_name, "years": years}), 201
     except Exception as e: return jsonify({"error": str(e)}), 500
 
-@app.route('/upload', methods=['POST'])
+def upload_target(company_id, year, doc_type, original_name):
+    ext = original_name.rsplit('.', 1)[1].lower()
+    if doc_type == "Financial Statement": filename = f"financial_report_{year}.{ext}"
+    elif doc_type == "Trial Balance": filename = f"TB_{year}.{ext}"
+    else: filename = secure_filename(original_name)
+    save_path = os.path.join(BASE_DIR, company_id, str(year))
+    os.makedirs(save_path, exist_ok=True)
+    return os.path.join(save_path, filename), ext
+
+@api.route('/upload', methods=['POST'])
 def upload_file():
     try:
         if 'file' not in request.files: return jsonify({"error": "No file"}), 400
@@ -582,18 +872,61 @@ def upload_file():
         year = request.form.get('year')
         doc_type = request.form.get('doc_type')
         if file and allowed_file(file.filename):
-            ext = file.filename.rsplit('.', 1)[1].lower()
-            if doc_type == "Financial Statement": filename = f"financial_report_{year}.{ext}"
-            elif doc_type == "Trial Balance": filename = f"TB_{year}.{ext}"
-            else: filename = secure_filename(file.filename)
-            save_path = os.path.join(BASE_DIR, company_id, year)
-            os.makedirs(save_path, exist_ok=True)
-            file.save(os.path.join(save_path, filename))
-            return jsonify({"message": "Saved"}), 200
+            target, ext = upload_target(company_id, year, doc_type, file.filename)
+            meta = save_upload(file.stream, target, ext)
+            return jsonify({"message": "Saved", **meta}), 200
         return jsonify({"error": "Invalid file"}), 400
+    except UploadError as e: return jsonify({"error": str(e)}), 400
     except Exception as e: return jsonify({"error": str(e)}), 500
 
-@app.route('/delete_file', methods=['POST'])
+# --- RESUMABLE CHUNKED UPLOADS ---
+# POST /uploads starts a session, PUT /uploads/<id>?offset=N appends the raw request body,
+# GET /uploads/<id> reports the offset to resume from, POST /uploads/<id>/complete finalizes.
+@api.route('/uploads', methods=['POST'])
+def start_upload():
+    try:
+        data = request.json or {}
+        company_id = data.get('company_id')
+        year = data.get('year')
+        filename = data.get('filename', '')
+        if not company_id or not year: return jsonify({"error": "Missing params"}), 400
+        if not allowed_file(filename): return jsonify({"error": "Invalid file"}), 400
+        target, ext = upload_target(company_id, year, data.get('doc_type'), filename)
+        state = upload_sessions.create(target, ext, data.get('size'))
+        return jsonify({"upload_id": state["upload_id"], "offset": 0, "chunk_size": UPLOAD_CHUNK_SIZE}), 201
+    except UploadError as e: return jsonify({"error": str(e)}), 400
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+@api.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    state = upload_sessions.get(upload_id)
+    if not state: return jsonify({"error": "Upload not found"}), 404
+    return jsonify({"upload_id": upload_id, "offset": state["offset"], "size": state["total_size"]}), 200
+
+@api.route('/uploads/<upload_id>', methods=['PUT'])
+def append_upload(upload_id):
+    state = upload_sessions.get(upload_id)
+    if not state: return jsonify({"error": "Upload not found"}), 404
+    try:
+        upload_sessions.append(state, request.args.get('offset', 0, type=int), request.stream)
+        return jsonify({"upload_id": upload_id, "offset": state["offset"]}), 200
+    except OffsetMismatch as e: return jsonify({"error": str(e), "offset": state["offset"]}), 409
+    except UploadError as e:
+        upload_sessions.abort(upload_id)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e: return jsonify({"error": str(e), "offset": state["offset"]}), 500
+
+@api.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    state = upload_sessions.get(upload_id)
+    if not state: return jsonify({"error": "Upload not found"}), 404
+    try:
+        meta = upload_sessions.complete(state)
+        return jsonify({"message": "Saved", **meta}), 200
+    except UploadError as e: return jsonify({"error": str(e), "offset": state["offset"]}), 400
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+@api.route('/delete_file', methods=['POST'])
 def delete_file():
     try:
         data = request.json
@@ -606,37 +939,83 @@ def delete_file():
         return jsonify({"error": "Not found"}), 404
     except Exception as e: return jsonify({"error": str(e)}), 500
 
-@app.route('/save_consolidated', methods=['POST'])
+@api.route('/save_consolidated', methods=['POST'])
 def save_consolidated():
+    """ Accepts a full edited model (older clients) and keeps the cells that differ as overrides. """
     try:
         data = request.json
-        company_id = data.get('company_id')
-        consolidated_data = data.get('data')
-        
-        if not company_id or not consolidated_data:
-            return jsonify({"error": "Missing data"}), 400
-            
-        save_path = os.path.join(BASE_DIR, company_id, 'consolidated_saved.json')
-        with open(save_path, 'w') as f:
-            json.dump(consolidated_data, f, indent=4)
-            
+        if not data.get('data'): return jsonify({"error": "Missing data"}), 400
+        found, error = project_plan(data)
+        if error: return error
+        company_id, years, plan = found
+
+        with company_lock(company_id):
+            migrate_saved_consolidation(company_id, years, plan)
+            journal, state = load_journal(company_id)
+            overrides = overrides_from_model(years, plan, load_columns(company_id, years, plan), data['data'])
+            append_journal(company_id, journal.replace(state, plan.name, overrides))
         return jsonify({"message": "Saved successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # --- NEW: RESET TO ORIGINAL ---
-@app.route('/reset_consolidated', methods=['POST'])
+# Reset and undo append to the journal like any other edit, so they can be undone too
+@api.route('/reset_consolidated', methods=['POST'])
 def reset_consolidated():
     try:
         data = request.json
         company_id = data.get('company_id')
-        save_path = os.path.join(BASE_DIR, company_id, 'consolidated_saved.json')
-        if os.path.exists(save_path):
-            os.remove(save_path)
+        if not company_id: return jsonify({"error": "Missing company_id"}), 400
+        with company_lock(company_id):
+            for path in (saved_consolidation_path(company_id), overrides_path(company_id)):
+                if os.path.exists(path): os.remove(path)
+            journal, state = load_journal(company_id)
+            if state.overrides: append_journal(company_id, journal.reset(state))
         return jsonify({"message": "Reset to original extraction"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-if __name__ == '__main__':
+@api.route('/project/<company_id>/edits', methods=['GET'])
+def get_edit_history(company_id):
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    return jsonify({"edits": journal_for(company_id).history(limit)}), 200
+
+@api.route('/undo_consolidated', methods=['POST'])
+def undo_consolidated():
+    """ Goes back to the state after edit `seq`; without one, undoes the latest edit that is not itself an undo. """
+    try:
+        data = request.json
+        company_id = data.get('company_id')
+        if not company_id: return jsonify({"error": "Missing company_id"}), 400
+        with company_lock(company_id):
+            journal, state = load_journal(company_id)
+            if 'seq' in data: seq = data['seq']
+            else:
+                seq = journal.undo_target(state)
+                if seq is None: return jsonify({"error": "Nothing to undo"}), 400
+            if not isinstance(seq, int) or not 0 <= seq <= state.seq: return jsonify({"error": "Invalid seq"}), 400
+            if seq < journal.oldest(): return jsonify({"error": "Edit is too old to undo"}), 400
+            state = append_journal(company_id, journal.revert(state, seq))
+        return jsonify({"message": "Reverted", "seq": state.seq}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- APP FACTORY ---
+def preload():
+    """ Builds the read-only state every request shares, so a preforking server loads it once before forking. """
+    for plan in PLANS.values(): get_mapper(plan)
+
+def start_background(search_sync=True):
+    """ Threads do not survive a fork: start them in each process that serves requests. """
+    if search_sync: threading.Thread(target=lambda: search_index.sync(BASE_DIR), daemon=True).start()
+
+def create_app(background=True):
     os.makedirs(BASE_DIR, exist_ok=True)
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(api)
+    if background: start_background()
+    return app
+
+if __name__ == '__main__':
+    create_app().run(debug=True, port=5000)
@@ -0,0 +1,90 @@
+"""
+Micro-benchmark: cost of the statement line-item lookups made by one consolidation,
+comparing the original per-lookup linear scan against the keyword index.
+
+    python benchmarks/bench_line_items.py
+"""
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from consolidation import get_plan, index_statements
+
+PLAN = get_plan()
+
+
+# --- BEFORE: linear scan per lookup ---
+def find_val(items, keywords):
+    if not items: return 0
+    for item in items:
+        line_item = str(item.get('line_item', '')).lower()
+        if any(k in line_item for k in keywords):
+            val = item.get('value', 0)
+            if isinstance(val, (int, float)): return val
+            try: return float(str(val).replace(',', '').strip())
+            except: return 0
+    return 0
+
+def get_bs_value(items, keywords, section_hint=None):
+    if not items: return 0
+    matches = []
+    for item in items:
+        line_item = str(item.get('line_item', '')).lower()
+        if any(k in line_item for k in keywords):
+            try: matches.append(float(str(item.get('value', 0)).replace(',', '').strip()))
+            except: matches.append(0)
+    if not matches: return 0
+    if section_hint == "C": return matches[1] if len(matches) > 1 else 0
+    return matches[0]
+
+def lookups_scan(yearly_data):
+    for data in yearly_data.values():
+        for inp in PLAN.inputs.values():
+            if inp.occurrence is None: find_val(data[inp.statement], inp.keywords)
+            else: get_bs_value(data[inp.statement], inp.keywords, "C" if inp.occurrence else "NC")
+
+
+# --- AFTER: index once, then O(matches) lookups ---
+def lookups_indexed(yearly_data):
+    index = index_statements(yearly_data, PLAN)
+    for y in yearly_data:
+        for inp in PLAN.inputs.values():
+            inp.lookup(index[y][inp.statement])
+
+
+def lookups_indexed_cold(yearly_data):
+    PLAN.matcher._cache.clear()
+    lookups_indexed(yearly_data)
+
+
+def synthetic_years(n_years, n_items, seed=7):
+    rng = random.Random(seed)
+    labels = [row["label"] for rows in PLAN.statements.values() for row in rows if not row["header"]]
+    labels += ["Revenue", "Cost of sales", "Other income", "General and administrative expenses", "Finance costs"]
+    filler = ["Prepayments and deposits", "Advances to suppliers", "Accrued expenses", "Other reserves",
+              "Foreign exchange differences", "Lease liabilities", "Right-of-use assets", "Deferred income"]
+    def statement():
+        names = rng.sample(labels, min(len(labels), n_items // 2))
+        names += [f"{rng.choice(filler)} {i}" for i in range(n_items - len(names))]
+        rng.shuffle(names)
+        return [{"line_item": n, "value": f"{rng.randint(-10 ** 7, 10 ** 8):,}"} for n in names]
+    return {str(2000 + y): {"pl": statement(), "bs": statement(), "cf": statement()} for y in range(n_years)}
+
+
+def main():
+    # "cold" clears the per-label match memo first; "warm" is the steady state where labels recur
+    print(f"{'years':>5} {'items':>6} {'scan (ms)':>10} {'cold (ms)':>10} {'warm (ms)':>10} {'speedup':>8}")
+    for n_years, n_items in [(3, 40), (10, 40), (10, 200), (30, 500)]:
+        data = synthetic_years(n_years, n_items)
+        runs = 20
+        scan = min(timeit.repeat(lambda: lookups_scan(data), number=runs, repeat=3)) / runs * 1000
+        cold = min(timeit.repeat(lambda: lookups_indexed_cold(data), number=runs, repeat=3)) / runs * 1000
+        warm = min(timeit.repeat(lambda: lookups_indexed(data), number=runs, repeat=3)) / runs * 1000
+        print(f"{n_years:>5} {n_items:>6} {scan:>10.3f} {cold:>10.3f} {warm:>10.3f} {scan / cold:>4.1f}-{scan / warm:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+End-to-end benchmark of the backend on synthetic data: PDF filtering, extraction through
+/extract (with the model replaced by a local stub), trial balance ingestion and paging,
+and /consolidate across data sizes. Each (stage, size) runs in a fresh process and work
+directory, so peak RSS is per case and no cache carries over between cases. Results
+(p50/p99 latency, throughput, peak RSS) are written as JSON for comparing runs.
+
+    python benchmarks/bench_pipeline.py                    # everything, 5 runs per case
+    python benchmarks/bench_pipeline.py --quick            # smallest size of each stage
+    python benchmarks/bench_pipeline.py --stages extract consolidate --runs 10
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/old.json
+    python benchmarks/bench_pipeline.py --compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+
+SEED = 7
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+STREAM_CHUNK = 2048  # characters per streamed chunk from the stub model
+COMPANY = "bench"
+TB_PAGE_ROWS = 100
+
+# stage -> (unit of size, default sizes)
+STAGES = {
+    "filter_pdf": ("pages", [20, 100, 400]),
+    "extract": ("pages", [20, 100, 400]),
+    "extract_cached": ("pages", [20, 100, 400]),
+    "tb_ingest_csv": ("rows", [10000, 100000, 500000]),
+    "tb_ingest_xlsx": ("rows", [10000, 50000]),
+    "tb_page": ("rows", [10000, 100000, 500000]),  # size of the table; items/s counts the rows served
+    "consolidate": ("years", [3, 10, 30]),
+    "consolidate_warm": ("years", [3, 10, 30]),
+}
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+# --- STUB MODEL ---
+def stub_provider(latency):
+    from providers import ExtractionProvider
+
+    class StubProvider(ExtractionProvider):
+        """ Canned answers in place of the model: streamed in chunks after `latency` seconds. """
+        name = "bench-stub"
+
+        def stream(self, pdf_path, prompt, section=None, progress=None):
+            if latency: time.sleep(latency)
+            if section is None:
+                answer = synthetic.extracted_report(0, seed=SEED)["financial_statements"]
+            elif section.startswith("notes_"):
+                answer = synthetic.notes_answer(int(section.split('_')[1]) * 10, 10, SEED)
+            else:
+                answer = synthetic.section_answer(section, 0, SEED)
+            text = json.dumps(answer)
+            for i in range(0, len(text), STREAM_CHUNK): yield text[i:i + STREAM_CHUNK]
+
+    return StubProvider()
+
+
+def load_app(model_latency=0.0):
+    """ (app module, test client), importing the app from the current (scratch) directory with the stub registered. """
+    import providers
+    provider = stub_provider(model_latency)
+    providers.PROVIDERS["bench"] = lambda: provider
+    import app
+    return app, app.create_app(background=False).test_client()
+
+
+def year_dir(app, year):
+    path = os.path.join(app.BASE_DIR, COMPANY, str(year))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# --- CASES (each returns the per-run latencies in seconds and the items each run handled; setup is not timed) ---
+def bench_filter_pdf(size, runs, args):
+    from pdf_filter import create_filtered_pdf, _index_path
+    synthetic.write_report('report.pdf', size, 2023, args.statements_at, args.scanned_every, SEED)
+    times = []
+    for _ in range(runs):
+        # The page index would turn every run after the first into a cache hit
+        if os.path.exists(_index_path('report.pdf')): os.remove(_index_path('report.pdf'))
+        times.append(timed(lambda: create_filtered_pdf('report.pdf', 'filtered.pdf')))
+    return times, size
+
+
+def _extract(app, client, year):
+    r = client.post('/extract', json={"company_id": COMPANY, "year": str(year), "provider": "bench"})
+    if r.status_code == 202:
+        app.job_queue.get(r.get_json()["job_id"]).future.result()
+        r = client.get(f"/jobs/{r.get_json()['job_id']}/result")
+    if r.status_code != 200: raise RuntimeError(f"/extract failed: {r.status_code} {r.get_data(as_text=True)[:200]}")
+
+
+def bench_extract(size, runs, args, cached=False):
+    app, client = load_app(args.model_latency)
+    # One year per run, each a different report, so only extract_cached hits the content cache
+    years = [2000 + i for i in range(runs)]
+    for i, year in enumerate(years):
+        synthetic.write_report(os.path.join(year_dir(app, year), f"financial_report_{year}.pdf"),
+                               size, year, args.statements_at, args.scanned_every, SEED + i)
+    if cached:
+        for year in years:
+            _extract(app, client, year)
+            os.remove(app.extraction_path(COMPANY, year))
+    return [timed(lambda: _extract(app, client, year)) for year in years], size
+
+
+def bench_tb_ingest(size, runs, args, ext='csv'):
+    from trial_balance import load_trial_balance
+    write = synthetic.write_tb_csv if ext == 'csv' else synthetic.write_tb_xlsx
+    source = f"TB_2023.{ext}"
+    write(source, size, SEED)
+    times = []
+    for _ in range(runs):
+        shutil.rmtree('tb_store', ignore_errors=True)
+        times.append(timed(lambda: load_trial_balance(source, 'tb_store')))
+    return times, size
+
+
+def bench_tb_page(size, runs, args):
+    app, client = load_app()
+    synthetic.write_tb_csv(os.path.join(year_dir(app, 2023), "TB_2023.csv"), size, SEED)
+    url = f"/project/{COMPANY}/trial_balance/2023"
+    client.get(url)  # ingests the upload; the runs measure paging the stored columns
+    times = []
+    for i in range(runs):
+        offset = (i * 7919) % max(1, size - TB_PAGE_ROWS)
+        r = None
+        def page():
+            nonlocal r
+            r = client.get(f"{url}?offset={offset}&limit={TB_PAGE_ROWS}&sort=Debit&desc=1")
+        times.append(timed(page))
+        if r.status_code != 200: raise RuntimeError(f"trial balance page failed: {r.status_code}")
+    return times, TB_PAGE_ROWS
+
+
+def bench_consolidate(size, runs, args, warm=False):
+    app, client = load_app()
+    years = [str(2000 + i) for i in range(size)]
+    company_id = client.post('/initialize', json={"company_name": "Bench", "years": years}).get_json()["company_id"]
+    for year in years:
+        synthetic.write_extracted(app.extraction_path(company_id, year), year, seed=SEED)
+
+    def consolidate():
+        r = client.post('/consolidate', json={"company_id": company_id})
+        if r.status_code != 200: raise RuntimeError(f"/consolidate failed: {r.status_code} {r.get_data(as_text=True)[:200]}")
+
+    if warm: consolidate()
+    times = []
+    for _ in range(runs):
+        if not warm: app.memory_cache.discard(company_id)
+        times.append(timed(consolidate))
+    return times, size
+
+
+CASES = {
+    "filter_pdf": bench_filter_pdf,
+    "extract": bench_extract,
+    "extract_cached": lambda size, runs, args: bench_extract(size, runs, args, cached=True),
+    "tb_ingest_csv": bench_tb_ingest,
+    "tb_ingest_xlsx": lambda size, runs, args: bench_tb_ingest(size, runs, args, ext='xlsx'),
+    "tb_page": bench_tb_page,
+    "consolidate": bench_consolidate,
+    "consolidate_warm": lambda size, runs, args: bench_consolidate(size, runs, args, warm=True),
+}
+
+
+def summarize(stage, size, times, items):
+    ms = np.array(times) * 1000
+    total = sum(times)
+    return {
+        "stage": stage,
+        "unit": STAGES[stage][0],
+        "size": size,
+        "runs": len(times),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+        "ops_per_s": len(times) / total if total else None,
+        "items_per_s": len(times) * items / total if total else None,
+    }
+
+
+def run_case(args):
+    """ Child process: one (stage, size) in a scratch directory; the summary goes to args.result_file. """
+    stage, size = args.case.split(':')
+    size = int(size)
+    work = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(work)  # the app keeps its data under the working directory
+    try:
+        baseline = peak_rss_mb()
+        times, items = CASES[stage](size, args.runs, args)
+        result = {**summarize(stage, size, times, items), "rss_at_start_mb": baseline, "peak_rss_mb": peak_rss_mb(),
+                  "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN)}
+    finally:
+        os.chdir(BACKEND)
+        if not args.keep: shutil.rmtree(work, ignore_errors=True)
+    with open(args.result_file, 'w') as f: json.dump(result, f)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_all(args):
+    cases = [(stage, size) for stage in args.stages
+             for size in (args.sizes or (STAGES[stage][1][:1] if args.quick else STAGES[stage][1]))]
+    results = []
+    print(f"{'stage':<18} {'size':>8} {'p50 (ms)':>10} {'p99 (ms)':>10} {'items/s':>12} {'peak RSS (MB)':>14}")
+    for stage, size in cases:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f: result_file = f.name
+        cmd = [sys.executable, os.path.abspath(__file__), "--case", f"{stage}:{size}", "--runs", str(args.runs),
+               "--result-file", result_file, "--model-latency", str(args.model_latency),
+               "--statements-at", str(args.statements_at), "--scanned-every", str(args.scanned_every)]
+        if args.keep: cmd.append("--keep")
+        proc = subprocess.run(cmd, cwd=BACKEND, capture_output=True, text=True)
+        try:
+            with open(result_file, 'r') as f: result = json.load(f)
+        except (OSError, ValueError):
+            print(f"{stage:<18} {size:>8} failed:\n{proc.stderr[-2000:]}")
+            continue
+        finally:
+            if os.path.exists(result_file): os.remove(result_file)
+        results.append(result)
+        print(f"{stage:<18} {size:>8} {result['p50_ms']:>10.1f} {result['p99_ms']:>10.1f} "
+              f"{result['items_per_s'] or 0:>12.1f} {result['peak_rss_mb']:>14.1f}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "runs": args.runs,
+            "seed": SEED,
+            "model_latency": args.model_latency,
+            "statements_at": args.statements_at,
+            "scanned_every": args.scanned_every,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f: json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return output
+
+
+def compare(baseline_path, current_path):
+    """ p50 / p99 / peak RSS of two result files side by side, for the cases both contain. """
+    load = lambda path: {(r["stage"], r["size"]): r for r in json.load(open(path))["results"]}
+    old, new = load(baseline_path), load(current_path)
+    print(f"{'stage':<18} {'size':>8} {'p50 before':>11} {'p50 after':>10} {'change':>8} {'p99 change':>11} {'RSS change':>11}")
+    change = lambda a, b: f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        print(f"{key[0]:<18} {key[1]:>8} {a['p50_ms']:>11.1f} {b['p50_ms']:>10.1f} {change(a['p50_ms'], b['p50_ms']):>8} "
+              f"{change(a['p99_ms'], b['p99_ms']):>11} {change(a['peak_rss_mb'], b['peak_rss_mb']):>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--sizes", nargs='+', type=int, help="sizes to run for every selected stage")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--quick", action='store_true', help="only the smallest default size of each stage")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="seconds the stub model waits per call")
+    parser.add_argument("--statements-at", type=float, default=0.2, help="where the statements start, as a fraction of the report")
+    parser.add_argument("--scanned-every", type=int, default=0, help="every n-th narrative page has no text layer")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/pipeline-<time>.json)")
+    parser.add_argument("--compare", nargs='+', metavar="RESULTS", help="baseline [current]: compare result files")
+    parser.add_argument("--keep", action='store_true', help="keep the scratch directories")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case: return run_case(args)
+    if args.compare and len(args.compare) > 1: return compare(*args.compare[:2])
+    output = run_all(args)
+    if args.compare: compare(args.compare[0], output)
+
+
+if __name__ == '__main__':
+    main()
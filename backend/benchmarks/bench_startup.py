@@ -0,0 +1,250 @@
+"""
+Start-up and serving benchmark. Cold start: time to import the app, build it with
+create_app() and preload() in a fresh process, resident memory before and after the
+first request, and which heavy libraries got loaded; compared with the heavy imports
+forced up front (how the app started before they became lazy). Server mode (Linux):
+gunicorn with the production config, time until the first /projects answer, RSS and PSS
+per worker (PSS shows what the preloaded master shares), and /projects latency while
+other clients keep the workers busy with Monte Carlo valuations.
+
+    python benchmarks/bench_startup.py                     # cold start, 10 runs each
+    python benchmarks/bench_startup.py --server --workers 1 3
+    python benchmarks/bench_startup.py --server --load-clients 4 --load-seconds 20
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+from bench_pipeline import BACKEND, RESULTS_DIR, SEED, git_revision
+
+HEAVY_MODULES = ["numpy", "pandas", "pypdf", "openpyxl", "google.generativeai"]
+# What importing the app loaded (and configured) before the imports were made lazy
+EAGER_IMPORTS = ["pandas", "pypdf", "google.generativeai"]
+
+# Runs in a fresh interpreter so nothing is imported yet: argv[1] is a JSON list of modules to import first
+COLD_START = """
+import os, sys, json, time
+start = time.perf_counter()
+missing = []
+for name in json.loads(sys.argv[1]):
+    try: __import__(name)
+    except ImportError: missing.append(name)
+if "google.generativeai" in sys.modules:
+    sys.modules["google.generativeai"].configure(api_key=os.getenv("GOOGLE_API_KEY"))
+import app
+flask_app = app.create_app(background=False)
+app.preload()
+ready = time.perf_counter() - start
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+
+heavy = json.loads(sys.argv[2])
+loaded = [m for m in heavy if m in sys.modules]
+rss_ready = rss_mb()
+started = time.perf_counter()
+status = flask_app.test_client().get('/projects').status_code
+first = time.perf_counter() - started
+print(json.dumps({"ready_s": ready, "first_request_s": first, "status": status, "rss_ready_mb": rss_ready,
+                  "rss_first_request_mb": rss_mb(), "loaded_at_start": loaded, "eager_missing": missing}))
+"""
+
+
+def percentiles(values):
+    ms = np.array(values) * 1000
+    return {"runs": len(values), "p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99)),
+            "mean_ms": float(ms.mean()), "max_ms": float(ms.max())}
+
+
+# --- COLD START ---
+def cold_start(mode, runs):
+    """ `runs` fresh processes importing and building the app; mode "eager" imports the heavy libraries first. """
+    first = EAGER_IMPORTS if mode == "eager" else []
+    samples = []
+    work = tempfile.mkdtemp(prefix="bench-startup-")
+    env = {**os.environ, "PYTHONPATH": BACKEND}
+    try:
+        for _ in range(runs):
+            proc = subprocess.run([sys.executable, "-c", COLD_START, json.dumps(first), json.dumps(HEAVY_MODULES)],
+                                  cwd=work, env=env, capture_output=True, text=True)
+            if proc.returncode != 0: raise RuntimeError(f"Cold start failed:\n{proc.stderr[-2000:]}")
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return {
+        "mode": mode,
+        "ready": percentiles([s["ready_s"] for s in samples]),
+        "first_request": percentiles([s["first_request_s"] for s in samples]),
+        "rss_ready_mb": float(np.median([s["rss_ready_mb"] for s in samples])),
+        "rss_first_request_mb": float(np.median([s["rss_first_request_mb"] for s in samples])),
+        "loaded_at_start": samples[-1]["loaded_at_start"],
+        "eager_missing": samples[-1]["eager_missing"],  # not installed here, so left out of the eager run
+    }
+
+
+# --- SERVER ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http(url, body=None, timeout=60):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"} if data else {})
+    with urllib.request.urlopen(req, timeout=timeout) as r: return r.status, r.read()
+
+
+def memory_mb(pid):
+    """ (RSS, PSS) of a process in MB from /proc, or (None, None) where that is not available. """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split()[-1] == 'kB'}
+        return fields["Rss"] / 1024, fields["Pss"] / 1024
+    except (OSError, KeyError):
+        return None, None
+
+
+def worker_pids(master):
+    try:
+        with open(f"/proc/{master}/task/{master}/children") as f: return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def serve(workers, args):
+    """ Starts gunicorn with `workers` processes in a scratch directory and measures it; stops it afterwards. """
+    work = tempfile.mkdtemp(prefix="bench-server-")
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "PYTHONPATH": BACKEND, "BIND": f"127.0.0.1:{port}", "WEB_WORKERS": str(workers),
+           "WEB_THREADS": str(args.threads)}
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(BACKEND, "gunicorn.conf.py")],
+                              cwd=work, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while True:
+            if server.poll() is not None: raise RuntimeError(f"gunicorn exited:\n{server.stderr.read().decode()[-2000:]}")
+            try:
+                if http(f"{base}/projects", timeout=1)[0] == 200: break
+            except OSError:
+                time.sleep(0.02)
+        ready = time.perf_counter() - started
+        time.sleep(1)  # let every worker finish booting before reading its memory
+        pids = worker_pids(server.pid)
+        memory = [memory_mb(pid) for pid in pids]
+        master_rss, master_pss = memory_mb(server.pid)
+
+        # A company for the valuations to work on
+        years = [str(2000 + i) for i in range(args.years)]
+        _, body = http(f"{base}/initialize", {"company_name": "Bench", "years": years})
+        company_id = json.loads(body)["company_id"]
+        for year in years:
+            path = os.path.join(work, "data", company_id, year, f"{company_id}_{year}_extracted.json")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            synthetic.write_extracted(path, year, seed=SEED)
+        valuation = {"company_id": company_id, "monte_carlo": {"draws": args.load_draws, "seed": SEED}}
+        if http(f"{base}/valuation", valuation)[0] != 200: raise RuntimeError("/valuation failed")
+
+        idle = [timed_get(f"{base}/projects") for _ in range(args.probes)]
+        stop, load_times, errors = threading.Event(), [], []
+
+        def load():
+            while not stop.is_set():
+                t = time.perf_counter()
+                try: http(f"{base}/valuation", valuation, timeout=300)
+                except OSError as e: errors.append(str(e)); continue
+                load_times.append(time.perf_counter() - t)
+
+        clients = [threading.Thread(target=load, daemon=True) for _ in range(args.load_clients)]
+        for c in clients: c.start()
+        busy, deadline = [], time.time() + args.load_seconds
+        while time.time() < deadline:
+            busy.append(timed_get(f"{base}/projects"))
+            time.sleep(args.probe_interval)
+        stop.set()
+        for c in clients: c.join(timeout=300)
+    finally:
+        server.terminate()
+        try: server.wait(timeout=30)
+        except subprocess.TimeoutExpired: server.kill()
+        shutil.rmtree(work, ignore_errors=True)
+
+    return {
+        "workers": workers,
+        "threads": args.threads,
+        "time_to_first_response_s": ready,
+        "master_rss_mb": master_rss,
+        "master_pss_mb": master_pss,
+        "worker_rss_mb": [m[0] for m in memory],
+        "worker_pss_mb": [m[1] for m in memory],
+        "total_pss_mb": sum(m[1] or 0 for m in memory) + (master_pss or 0),
+        "projects_idle": percentiles(idle),
+        "projects_under_load": percentiles(busy) if busy else None,
+        "valuations": {**percentiles(load_times), "per_s": len(load_times) / args.load_seconds} if load_times else None,
+        "load_errors": len(errors),
+    }
+
+
+def timed_get(url):
+    start = time.perf_counter()
+    http(url)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes per cold start mode")
+    parser.add_argument("--server", action='store_true', help="also benchmark gunicorn (Linux)")
+    parser.add_argument("--workers", nargs='+', type=int, default=[1, 3], help="worker counts to compare")
+    parser.add_argument("--threads", type=int, default=16, help="threads per worker")
+    parser.add_argument("--years", type=int, default=10, help="years of the company being valued")
+    parser.add_argument("--load-clients", type=int, default=4, help="clients requesting valuations meanwhile")
+    parser.add_argument("--load-draws", type=int, default=200000, help="Monte Carlo draws per valuation")
+    parser.add_argument("--load-seconds", type=float, default=10)
+    parser.add_argument("--probes", type=int, default=50, help="/projects requests on the idle server")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/startup-<time>.json)")
+    args = parser.parse_args()
+
+    report = {"meta": {"timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'), "git": git_revision(),
+                       "python": sys.version.split()[0], "cpus": os.cpu_count(), "runs": args.runs},
+              "cold_start": [], "server": []}
+    print(f"{'cold start':<12} {'ready p50 (ms)':>15} {'first req (ms)':>15} {'RSS (MB)':>9} {'after req':>10}  heavy modules loaded")
+    for mode in ("lazy", "eager"):
+        r = cold_start(mode, args.runs)
+        report["cold_start"].append(r)
+        print(f"{mode:<12} {r['ready']['p50_ms']:>15.1f} {r['first_request']['p50_ms']:>15.1f} "
+              f"{r['rss_ready_mb']:>9.1f} {r['rss_first_request_mb']:>10.1f}  {', '.join(r['loaded_at_start']) or '-'}")
+
+    if args.server:
+        print(f"\n{'workers':>7} {'ready (s)':>10} {'PSS total (MB)':>15} {'idle p50 (ms)':>14} {'busy p50':>9} {'busy p99':>9} {'valuations/s':>13}")
+        for workers in args.workers:
+            r = serve(workers, args)
+            report["server"].append(r)
+            busy = r["projects_under_load"] or {}
+            print(f"{workers:>7} {r['time_to_first_response_s']:>10.2f} {r['total_pss_mb']:>15.1f} "
+                  f"{r['projects_idle']['p50_ms']:>14.1f} {busy.get('p50_ms', 0):>9.1f} {busy.get('p99_ms', 0):>9.1f} "
+                  f"{(r['valuations'] or {}).get('per_s', 0):>13.2f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f: json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Synthetic inputs for the benchmarks: annual-report PDFs, trial balances (CSV / XLSX)
+and extracted JSON, all seeded so every run builds the same bytes.
+"""
+import os
+import sys
+import csv
+import json
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from consolidation import get_plan
+
+PLAN = get_plan()
+STATEMENT_TITLES = {
+    "statement_of_financial_position": "Statement of financial position",
+    "statement_of_profit_or_loss": "Statement of profit or loss and other comprehensive income",
+    "statement_of_changes_in_equity": "Statement of changes in equity",
+    "statement_of_cash_flows": "Statement of cash flows",
+}
+PLAN_STATEMENTS = {"bs": "statement_of_financial_position", "pl": "statement_of_profit_or_loss", "cf": "statement_of_cash_flows"}
+NOTE_TITLES = ["General information", "Basis of preparation", "Significant accounting policies", "Revenue",
+               "Cost of sales", "Property, plant and equipment", "Intangible assets", "Inventories",
+               "Trade and other receivables", "Cash and cash equivalents", "Share capital", "Bank borrowings",
+               "Trade and other payables", "Related party transactions", "Financial risk management"]
+FILLER = ["Prepayments and deposits", "Advances to suppliers", "Accrued expenses", "Other reserves",
+          "Foreign exchange differences", "Lease liabilities", "Right-of-use assets", "Deferred income"]
+WORDS = ("the company group year management board financial reporting standards assets liabilities "
+         "recognised measured cost fair value impairment depreciation revenue contracts customers").split()
+LINES_PER_PAGE = 48
+
+
+def _amount(rng):
+    value = rng.randint(-10 ** 6, 10 ** 8)
+    return f"({-value:,})" if value < 0 else f"{value:,}"
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def statement_labels(key):
+    """ Line items for one statement: the plan's keywords first, so consolidation finds them. """
+    plan_key = next((k for k, v in PLAN_STATEMENTS.items() if v == key), None)
+    labels = [inp.keywords[0].capitalize() for inp in PLAN.inputs.values() if inp.statement == plan_key]
+    return list(dict.fromkeys(labels)) + FILLER
+
+
+# --- PDF ---
+def _pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, pages):
+    """ A minimal text PDF: one page per list of lines, in Helvetica (a page with no lines has no text layer). """
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pages_id = 2 * len(pages) + 2
+    kids = []
+    for lines in pages:
+        ops = "BT /F1 10 Tf 50 800 Td 15 TL " + " ".join(f"({_pdf_text(line)}) '" for line in lines) + " ET" if lines else ""
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(ops), ops.encode('latin-1', 'replace')))
+        objects.append(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R"
+                       b" /Resources << /Font << /F1 1 0 R >> >> >>" % (pages_id, len(objects)))
+        kids.append(len(objects))
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids)))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    with open(path, 'wb') as f: f.write(out)
+    return len(out)
+
+
+def report_pages(pages, year, statements_at=0.2, scanned_every=0, seed=0):
+    """
+    Page texts of an annual report with `pages` pages: narrative pages, then the four
+    primary statements starting at fraction `statements_at` of the front matter, then
+    the notes to the end. Every scanned_every-th narrative page has no text layer.
+    """
+    rng = random.Random(f"{seed}-{year}")
+    notes_pages = max(1, pages - len(STATEMENT_TITLES) - int((pages - len(STATEMENT_TITLES)) * statements_at))
+    front = max(0, pages - len(STATEMENT_TITLES) - notes_pages)
+    out = []
+    for i in range(front):
+        blank = scanned_every and (i + 1) % scanned_every == 0
+        out.append([] if blank else ["Directors' report"] + [_sentence(rng) for _ in range(LINES_PER_PAGE - 1)])
+    for key, title in STATEMENT_TITLES.items():
+        lines = [title, f"For the year ended 31 December {year}"]
+        for label in statement_labels(key):
+            lines.append(f"{label} {rng.randint(3, 30)} {_amount(rng)} {_amount(rng)}")
+        out.append(lines)
+    ref = 0
+    for i in range(notes_pages):
+        lines = ["Notes to the financial statements"] if i == 0 else []
+        while len(lines) < LINES_PER_PAGE:
+            ref = ref % 99 + 1
+            lines.append(f"{ref}. {NOTE_TITLES[ref % len(NOTE_TITLES)]}")
+            lines += [_sentence(rng) for _ in range(8)]
+            lines += [f"{rng.choice(FILLER)} {_amount(rng)} {_amount(rng)}" for _ in range(6)]
+        out.append(lines[:LINES_PER_PAGE])
+    return out
+
+
+def write_report(path, pages, year, statements_at=0.2, scanned_every=0, seed=0):
+    """ Writes a synthetic report PDF; returns its size in bytes. """
+    return write_pdf(path, report_pages(pages, year, statements_at, scanned_every, seed))
+
+
+# --- TRIAL BALANCES ---
+def tb_rows(rows, seed=0):
+    """ (header, rows) of a trial balance: code, name, debit, credit; names drawn from the plan's TB rules. """
+    rng = random.Random(seed)
+    names = [k.capitalize() for inp in PLAN.inputs.values() if inp.tb for k in inp.tb.get("names", [])] or FILLER
+    names += FILLER
+    out = []
+    for i in range(rows):
+        amount = round(rng.uniform(0, 10 ** 6), 2)
+        debit = rng.random() < 0.5
+        out.append([f"{rng.randint(1, 9)}{i:07d}", f"{rng.choice(names)} {i % 97}", amount if debit else 0, 0 if debit else amount])
+    return ["Account Code", "Account Name", "Debit", "Credit"], out
+
+
+def write_tb_csv(path, rows, seed=0):
+    header, data = tb_rows(rows, seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(data)
+    return os.path.getsize(path)
+
+
+def write_tb_xlsx(path, rows, seed=0):
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("TB")
+    header, data = tb_rows(rows, seed)
+    ws.append(header)
+    for row in data: ws.append(row)
+    wb.save(path)
+    return os.path.getsize(path)
+
+
+# --- EXTRACTED JSON ---
+def section_answer(key, year, seed=0):
+    """ What a model would return for one statement section. """
+    rng = random.Random(f"{seed}-{key}-{year}")
+    rows = [{"line_item": label, "note_ref": str(rng.randint(3, 30)), "value": rng.randint(-10 ** 6, 10 ** 8), "is_header": False}
+            for label in statement_labels(key)]
+    return {key: rows}
+
+
+def notes_answer(first_ref, count, seed=0):
+    """ What a model would return for a run of notes pages: note texts and their tables. """
+    rng = random.Random(f"{seed}-notes-{first_ref}")
+    notes, tables = {}, {}
+    for ref in range(first_ref, first_ref + count):
+        title = NOTE_TITLES[ref % len(NOTE_TITLES)]
+        notes[str(ref)] = f"**{title}**\n" + " ".join(_sentence(rng) for _ in range(20))
+        tables[str(ref)] = [{"line_item": rng.choice(FILLER), "current_year": _amount(rng), "prior_year": _amount(rng)} for _ in range(8)]
+    return {"notes": notes, "note_tables": tables}
+
+
+def extracted_report(year, notes=30, seed=0):
+    """ One year's *_extracted.json, as /extract saves it. """
+    fs = {}
+    for key in STATEMENT_TITLES:
+        fs.update(section_answer(key, year, seed))
+    fs.update(notes_answer(1, notes, seed))
+    return {"trial_balance": None, "financial_statements": fs}
+
+
+def write_extracted(path, year, notes=30, seed=0):
+    with open(path, 'w') as f: json.dump(extracted_report(year, notes, seed), f)
+    return os.path.getsize(path)
@@ -0,0 +1,174 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+import threading
+from collections import OrderedDict
+from metrics import metrics
+
+
+def cache_key(*parts):
+    """ Combines content hashes, prompt text, model names... into one cache key. """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ContentCache:
+    """
+    Content-addressed disk cache. Entries are files named by key; a hit refreshes the
+    entry's mtime, and once the directory grows past max_bytes the least recently
+    used entries are removed. The directory is only walked when the running total
+    (taken from one walk, then kept up to date by puts) goes over the limit.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None  # bytes on disk, or None until the first put walks the directory
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def get_path(self, key, ext):
+        path = self._path(key, ext)
+        try:
+            os.utime(path)
+        except OSError:
+            metrics.inc("cache_requests_total", cache="content", result="miss")
+            return None
+        metrics.inc("cache_requests_total", cache="content", result="hit")
+        return path
+
+    def copy_to(self, key, ext, dest_path):
+        """ Copies a cached file to dest_path; False on a miss, including an entry evicted meanwhile. """
+        path = self.get_path(key, ext)
+        if not path: return False
+        try: shutil.copyfile(path, dest_path)
+        except FileNotFoundError: return False
+        return True
+
+    def put_file(self, key, ext, src_path):
+        path = self._path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write(path, lambda tmp: shutil.copyfile(src_path, tmp))
+        return path
+
+    def get_json(self, key):
+        path = self.get_path(key, 'json')
+        if not path: return None
+        try:
+            with open(path, 'r') as f: return json.load(f)
+        except FileNotFoundError:
+            return None  # evicted between the lookup and the read
+        except Exception as e:
+            print(f"Cache read error: {e}")
+            return None
+
+    def put_json(self, key, data):
+        path = self._path(key, 'json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        def write(tmp):
+            with open(tmp, 'w') as f: json.dump(data, f)
+        self._write(path, write)
+        return path
+
+    def _write(self, path, write):
+        """ write(tmp) into a temp name unique across threads and processes, then moves it into place. """
+        tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        try:
+            write(tmp)
+            self._replace(tmp, path)
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+
+    def _replace(self, tmp, path):
+        size = os.path.getsize(tmp)
+        try: replaced = os.path.getsize(path)
+        except OSError: replaced = 0
+        os.replace(tmp, path)
+        with self._lock:
+            if self._total is not None: self._total += size - replaced
+            if self._total is None or self._total > self.max_bytes: self._evict()
+
+    def _evict(self):
+        """ Walks the directory for the real total (other processes share it) and removes LRU entries. Needs _lock. """
+        entries = []
+        total = 0
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.tmp'): continue
+                path = os.path.join(folder, name)
+                try: st = os.stat(path)
+                except OSError: continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try: os.remove(path)
+                except OSError: continue
+                total -= size
+                if total <= self.max_bytes: break
+        self._total = total
+
+
+class MemoryCache:
+    """
+    Process-wide LRU of parsed objects, bounded by the approximate size of their source
+    files. Each entry carries a stamp (e.g. mtime and size of the file it came from); a
+    lookup with a different stamp is a miss, so edits on disk are never served stale.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != stamp:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, stamp):
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes: return
+            self._entries[key] = (value, size, stamp)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    @property
+    def size(self):
+        return self._size
+
+    def discard(self, *prefix):
+        """ Drops every entry whose key starts with the given parts. """
+        with self._lock:
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry: self._size -= entry[1]
+
+
+def file_stamp(path):
+    """ (mtime_ns, size) of a file, or None if it does not exist. """
+    try: st = os.stat(path)
+    except OSError: return None
+    return (st.st_mtime_ns, st.st_size)
@@ -0,0 +1,130 @@
+import numpy as np
+from matching import LineItemIndex
+from statement_mapping import load_templates, DEFAULT_TEMPLATE
+
+# Mapping templates (mappings/*.json) are parsed and compiled once, at import
+PLANS = load_templates()
+
+
+def get_plan(name=None):
+    return PLANS.get(name or DEFAULT_TEMPLATE)
+
+
+def index_statements(yearly_data, plan):
+    """ A LineItemIndex per (year, statement), built once per load. """
+    statements = {i.statement for i in plan.inputs.values()}
+    return {
+        y: {st: LineItemIndex(data.get(st), plan.matcher) for st in statements}
+        for y, data in yearly_data.items()
+    }
+
+
+def extract_columns(years, yearly_data, plan):
+    """ Every input of the plan pulled out of the extracted statements: one year vector per input. """
+    index = index_statements(yearly_data, plan)
+    return {
+        name: np.array([inp.lookup(index[y][inp.statement]) for y in years], dtype=float)
+        for name, inp in plan.inputs.items()
+    }
+
+
+# --- HELPER: BUILD ROW ---
+def build_row(years, label, values=None, format_as_percent=False, is_header=False):
+    row = {"line_item": label, "is_header": is_header, "is_percentage": format_as_percent} # Added is_percentage flag
+    if is_header:
+        for y in years: row[y] = ""
+    else:
+        # KEEP RAW NUMBERS for frontend calculation, formatting happens in UI
+        row.update(zip(years, values))
+    return row
+
+
+def iter_statements(years, plan, env):
+    """ (statement key, output rows) for each calculated statement in turn. """
+    for key, rows in plan.statements.items():
+        yield key, [
+            build_row(years, row["label"], None if row["header"] else env[row["value"]].tolist(), row["percent"], row["header"])
+            for row in rows
+        ]
+
+
+def build_statements(years, plan, env):
+    return {"years": years, **dict(iter_statements(years, plan, env))}
+
+
+def build_consolidation(years, yearly_data, plan=None, overrides=None):
+    """ The consolidated multi-year model: calculated income statement, balance sheet and cash flow. """
+    plan = plan or get_plan()
+    env = plan.evaluate(extract_columns(years, yearly_data, plan), pins_for(years, overrides))
+    return build_statements(years, plan, env)
+
+
+# --- MANUAL OVERRIDES ---
+# Overrides are {value name: {year: number}}; a pinned cell keeps the user's number and
+# everything downstream of it is recomputed from there.
+def pins_for(years, overrides):
+    """ Overrides keyed by year index, skipping years the project no longer has. """
+    position = {str(y): i for i, y in enumerate(years)}
+    return {
+        name: {position[str(y)]: v for y, v in cells.items() if str(y) in position}
+        for name, cells in (overrides or {}).items()
+    }
+
+
+def row_value(plan, statement, row):
+    """ The input/metric name behind one output row, or None for headers and bad indexes. """
+    rows = plan.statements.get(statement)
+    if rows is None or not 0 <= row < len(rows): return None
+    return rows[row]["value"]
+
+
+def recalculate(years, plan, env, overrides, name, year, value):
+    """
+    Pins one cell (already recorded in overrides) and re-evaluates only the metrics
+    downstream of it. Returns the new env and the delta: every output row whose values
+    changed, with all its years.
+    """
+    pins = pins_for(years, overrides)
+    pinned = dict(env)
+    pinned[name] = np.array(env[name], dtype=float)
+    pinned[name][[str(y) for y in years].index(str(year))] = value
+    new_env = plan.recompute(pinned, plan.downstream[name], pins)
+
+    changed = {n for n in [name] + plan.downstream[name] if not np.array_equal(env[n], new_env[n])}
+    delta = [
+        {"statement": key, "row": idx, "values": dict(zip(years, new_env[row["value"]].tolist()))}
+        for key, rows in plan.statements.items()
+        for idx, row in enumerate(rows)
+        if row["value"] in changed
+    ]
+    return new_env, delta
+
+
+def overrides_from_model(years, plan, columns, model):
+    """
+    The cells of a full consolidated model (e.g. an old saved file) that the formulas do
+    not reproduce. Inputs are compared first and metrics in evaluation order, so a
+    derived value that merely follows from an edited input is not pinned as well.
+    """
+    saved = {}
+    for key, rows in plan.statements.items():
+        for row, saved_row in zip(rows, model.get(key) or []):
+            if row["header"] or saved_row.get("is_header"): continue
+            cells = {str(y): saved_row.get(y, saved_row.get(str(y))) for y in years}
+            saved[row["value"]] = {y: float(v) for y, v in cells.items() if isinstance(v, (int, float))}
+
+    overrides = {}
+
+    def diff(name, values):
+        for i, y in enumerate(years):
+            value = saved.get(name, {}).get(str(y))
+            if value is not None and not np.isclose(value, values[i]):
+                overrides.setdefault(name, {})[str(y)] = value
+
+    for name in plan.inputs:
+        diff(name, columns[name])
+    env = plan.evaluate(columns, pins_for(years, overrides))
+    for name in plan.order:
+        env = plan.recompute(env, [name], pins_for(years, overrides))
+        diff(name, env[name])
+    return overrides
@@ -0,0 +1,175 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+# HTTP statuses worth retrying: rate limited, or the provider is briefly unavailable
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                    "DeadlineExceeded", "GatewayTimeout", "BadGateway"}
+
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def processes():
+    """ Server processes sharing one quota; gunicorn.conf.py sets WEB_WORKERS in each worker it forks. """
+    return max(int(os.getenv("WEB_WORKERS", 1)), 1)
+
+
+def process_share(total):
+    """ This process's part of an app-wide limit: rates are divided, counts too but never below one. """
+    if isinstance(total, float): return total / processes()
+    return max(total // processes(), 1)
+
+
+def is_retryable(e):
+    if isinstance(e, (ConnectionError, TimeoutError)): return True
+    code = getattr(e, 'code', None)
+    if isinstance(code, int) and code in RETRYABLE_STATUS: return True
+    return type(e).__name__ in RETRYABLE_ERRORS
+
+
+class TokenBucket:
+    """
+    per_minute units, refilled continuously. reserve() takes the units straight away
+    (the level may go negative) and returns how long the caller must wait before using
+    them, so concurrent callers queue up in the order they asked.
+    """
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= min(amount, self.capacity)
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount):
+        """ Gives back units that were reserved but not used (negative: charges extra). """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.at - time.monotonic()
+
+    def sleep(self, seconds, what):
+        """ Sleeps, or raises DeadlineExceeded if the wait would run past the deadline. """
+        if seconds > self.remaining(): raise DeadlineExceeded(f"Deadline exceeded while waiting for {what}")
+        if seconds > 0: time.sleep(seconds)
+
+
+class Governor:
+    """
+    Client-side limits for one model API quota: requests and tokens per minute (token
+    buckets), a cap on concurrent uploads, exponential backoff with full jitter on 429
+    and 5xx answers, polling that slows down the longer a file takes, and one overall
+    deadline per call so no request waits forever.
+    """
+
+    def __init__(self, rpm=60, tpm=1000000, max_uploads=2, retries=5, backoff=1.0, max_backoff=60.0,
+                 deadline=600.0, poll_min=0.5, poll_max=5.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.upload_slots = threading.BoundedSemaphore(max_uploads)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.stats = {"calls": 0, "retries": 0, "throttled_seconds": 0.0, "deadline_exceeded": 0}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """ The configured limits, which are for the whole app, as this process's share. """
+        return cls(
+            rpm=process_share(float(os.getenv("MODEL_RPM", 60))),
+            tpm=process_share(float(os.getenv("MODEL_TPM", 1000000))),
+            max_uploads=process_share(int(os.getenv("MAX_UPLOADS", 2))),
+            retries=int(os.getenv("MODEL_RETRIES", 5)),
+            deadline=float(os.getenv("MODEL_DEADLINE", 600)),
+        )
+
+    def _count(self, key, amount=1):
+        with self._stats_lock: self.stats[key] += amount
+
+    def new_deadline(self):
+        return Deadline(self.deadline)
+
+    def _throttle(self, tokens, deadline):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        try:
+            deadline.sleep(wait, "rate limit")
+        except DeadlineExceeded:
+            self.requests.refund(1)
+            self.tokens.refund(tokens)
+            raise
+        if wait: self._count("throttled_seconds", wait)
+
+    def call(self, fn, deadline, tokens=0, limited=True, what="model call"):
+        """
+        fn() retried with backoff on transient errors until the deadline. limited calls
+        also wait for the request and token budgets (uploads and status checks do not).
+        """
+        try:
+            for attempt in range(self.retries + 1):
+                if limited: self._throttle(tokens, deadline)
+                self._count("calls")
+                try:
+                    return fn()
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.retries: raise
+                    delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                    print(f"{what} failed ({e}); retrying in {delay:.1f}s")
+                    self._count("retries")
+                    deadline.sleep(delay, what)
+        except DeadlineExceeded:
+            self._count("deadline_exceeded")
+            raise
+
+    def settle(self, estimated, actual):
+        """ Corrects the token bucket once the real token count of a call is known. """
+        if actual: self.tokens.refund(estimated - actual)
+
+    @contextmanager
+    def upload(self, deadline):
+        if not self.upload_slots.acquire(timeout=max(0.0, deadline.remaining())):
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded("Deadline exceeded while waiting for an upload slot")
+        try:
+            yield
+        finally:
+            self.upload_slots.release()
+
+    def poll(self, check, deadline, what="file processing"):
+        """ Calls check() until it returns a truthy value, backing off from poll_min to poll_max seconds. """
+        interval = self.poll_min
+        while True:
+            result = check()
+            if result: return result
+            try:
+                deadline.sleep(interval, what)
+            except DeadlineExceeded:
+                self._count("deadline_exceeded")
+                raise
+            interval = min(self.poll_max, interval * 1.5)
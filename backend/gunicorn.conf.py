@@ -0,0 +1,33 @@
+import os
+
+# The app is imported and its read-only state (templates, matchers, account mappers)
+# built once in the master, then shared copy-on-write by the workers.
+#
+# One worker with many threads by default. Most request time is I/O or model calls, and
+# the CPU-heavy parts (PDF text, numpy) release the GIL or run in their own processes.
+# More workers (WEB_WORKERS, or -w) is supported, with these differences:
+#   - MODEL_RPM, MODEL_TPM, MAX_UPLOADS and MAX_MODEL_CALLS are app-wide: each worker
+#     enforces its share (counts rounded down, at least one each)
+#   - jobs, the remote file registry and journal edits are shared through data/
+#   - /metrics reports the worker that answered the scrape, and the in-memory caches
+#     are per worker
+wsgi_app = "wsgi:app"
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_WORKERS", 1))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 16))
+preload_app = True
+
+# Extraction runs in background jobs, but SSE streams and large uploads keep a thread for long
+timeout = int(os.getenv("WEB_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_fork(server, worker):
+    # The worker count actually running (-w on the command line wins over this file), for the
+    # per-worker share of the limits; the app reads it lazily, after the fork
+    os.environ["WEB_WORKERS"] = str(server.num_workers)
+    import app
+    # One catch-up of the search index is enough: the other workers only serve requests
+    app.start_background(search_sync=worker.age == 1)
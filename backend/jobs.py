@@ -0,0 +1,294 @@
+import os
+import json
+import threading
+import contextlib
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import metrics
+from locks import file_lock
+
+SPOOL_POLL = 0.25  # seconds between checks for new events of a job running in another process
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """ A unit of background work with a status, the current stage and its result. """
+
+    def __init__(self, kind, key, params, stages=None, spool=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.key = key
+        self.params = params
+        self.stages = list(stages or [])
+        self.status = "queued"
+        self.stage = None
+        self.result = None
+        self.partial = {}
+        self.events = []
+        self._changed = threading.Condition()
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.pid = os.getpid()
+        self.spool = spool   # folder shared by the app's processes, or None
+        self.remote = False  # a copy loaded from the spool, run by another process
+        self._offset = 0     # bytes of the spooled event log read so far
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self.emit("stage", stage=stage)
+
+    def emit(self, event, **data):
+        """
+        Records a progress event for streaming clients. A "section" event (key, value) is a
+        finished piece of the result; dicts (notes) from several pieces are merged.
+        """
+        with self._changed:
+            self._record(event, data)
+            if self.spool:
+                with open(self._path('events.jsonl'), 'a') as f: f.write(json.dumps([event, data]) + "\n")
+            self._changed.notify_all()
+
+    def _record(self, event, data):
+        if event == "section":
+            key, value = data["key"], data["value"]
+            if isinstance(value, dict) and isinstance(self.partial.get(key), dict):
+                value = {**self.partial[key], **value}
+            self.partial[key] = value
+        elif event == "stage":
+            self.stage = data["stage"]
+        self.events.append({"id": len(self.events) + 1, "event": event, "data": data})
+
+    def events_after(self, last_id, timeout=None):
+        """ Events newer than last_id, waiting up to timeout seconds for one if there are none yet. """
+        if self.remote: return self._follow(last_id, timeout)
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > last_id, timeout)
+            return self.events[last_id:]
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    # --- SPOOL (header, event log and result on disk, for the other processes) ---
+    def _path(self, ext):
+        return os.path.join(self.spool, f"{self.id}.{ext}")
+
+    def _write(self, ext, data):
+        tmp_path = f"{self._path(ext)}.tmp"
+        with open(tmp_path, 'w') as f: json.dump(data, f)
+        os.replace(tmp_path, self._path(ext))
+
+    def save(self):
+        """ Writes the job's status (and its result once done) to the spool. """
+        if not self.spool: return
+        if self.status == "done": self._write('result.json', self.result)
+        self._write('json', {k: getattr(self, k) for k in ("id", "kind", "key", "params", "stages", "status", "error",
+                                                           "created_at", "started_at", "finished_at", "pid")})
+
+    @classmethod
+    def load(cls, spool, job_id):
+        """ A read-only copy of a job run by another process, or None if the spool has no such job. """
+        job = cls(None, None, None, spool=spool)
+        job.id = job_id
+        job.remote = True
+        return job if job._refresh() else None
+
+    def _refresh(self):
+        try:
+            with open(self._path('json'), 'r') as f: header = json.load(f)
+        except (OSError, ValueError):
+            return False
+        for k, v in header.items(): setattr(self, k, v)
+        try:
+            with open(self._path('events.jsonl'), 'rb') as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'): break  # still being written
+                    self._offset += len(line)
+                    self._record(*json.loads(line))
+        except OSError:
+            pass
+        if not self.finished and not _alive(self.pid):
+            self.status, self.error, self.finished_at = "failed", "The process running this job exited", time.time()
+            if not self.events or self.events[-1]["event"] != "failed": self._record("failed", {"error": self.error})
+        if self.status == "done" and self.result is None:
+            try:
+                with open(self._path('result.json'), 'r') as f: self.result = json.load(f)
+            except (OSError, ValueError):
+                pass
+        return True
+
+    def _follow(self, last_id, timeout):
+        deadline = time.time() + (timeout or 0)
+        while True:
+            self._refresh()
+            # The final event is logged just after the status, so wait for it rather than stop at the status
+            if len(self.events) > last_id or time.time() >= deadline: return self.events[last_id:]
+            time.sleep(SPOOL_POLL)
+
+    def to_dict(self):
+        progress = 0
+        if self.status == "done":
+            progress = 100
+        elif self.stage in self.stages:
+            progress = int(self.stages.index(self.stage) / len(self.stages) * 100)
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": self.stages,
+            "progress": progress,
+            "partial_sections": sorted(self.partial),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _follow_future(job):
+    """ A future that resolves to a job run by another process once the spool shows it finished. """
+    future = Future()
+    def follow():
+        seen = 0
+        while not job.finished: seen += len(job.events_after(seen, SPOOL_POLL * 40))
+        future.set_result(job)
+    threading.Thread(target=follow, daemon=True, name=f"job-follow-{job.id[:8]}").start()
+    return future
+
+
+def _alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except OSError: pass  # exists, owned by someone else
+    return True
+
+
+class JobQueue:
+    """
+    Thread pool with a bounded backlog. At most `max_workers` jobs run at once and
+    at most `max_pending` wait behind them; further submissions raise QueueFull.
+    Finished jobs are kept for `ttl` seconds so clients can collect the result.
+    With a spool folder every job is also written to disk, so when the app runs as
+    several processes any of them can report on a job another one is running, and a
+    submission matching a job running elsewhere returns that job instead of a second run.
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, ttl=3600, spool=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self.spool = spool
+
+    def submit(self, kind, key, fn, params, stages=None):
+        """
+        Queues fn(job, **params). Returns the already running job if one exists for the same
+        key, in this process or (a read-only copy whose future follows it) in another one.
+        """
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.kind == kind and job.key == key and not job.finished:
+                    return job
+            with self._spool_lock():
+                job = self._running_elsewhere(kind, key)
+                if job is not None: return job
+                if not self._slots.acquire(blocking=False):
+                    raise QueueFull()
+                job = Job(kind, key, params, stages, self.spool)
+                job.save()
+            # Listed only once it has a future: a duplicate submit returns it and callers wait on it
+            job.future = self._executor.submit(self._run, job, fn)
+            self._jobs[job.id] = job
+        return job
+
+    def _spool_lock(self):
+        """ Serializes submissions across processes, so two cannot both start the same key. """
+        if not self.spool: return contextlib.nullcontext()
+        os.makedirs(self.spool, exist_ok=True)
+        return file_lock(os.path.join(self.spool, '.submit.lock'))
+
+    def _running_elsewhere(self, kind, key):
+        if not self.spool: return None
+        key = json.loads(json.dumps(key))  # as stored: tuples become lists
+        for name in os.listdir(self.spool):
+            job_id, _, ext = name.partition('.')
+            if ext != 'json': continue
+            try:
+                with open(os.path.join(self.spool, name), 'r') as f: header = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if (header.get("kind"), header.get("key")) != (kind, key) or header.get("status") not in ("queued", "running"): continue
+            if not header.get("pid") or header["pid"] == os.getpid() or not _alive(header["pid"]): continue
+            job = Job.load(self.spool, job_id)
+            if job is None or job.finished: continue
+            job.future = _follow_future(job)
+            return job
+        return None
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not self.spool: return job
+        try: uuid.UUID(job_id)
+        except ValueError: return None
+        return Job.load(self.spool, job_id)
+
+    def counts(self):
+        """ {status: number of jobs} over the jobs still kept. """
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values(): counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _run(self, job, fn):
+        job.status = "running"
+        job.started_at = time.time()
+        metrics.observe("job_wait_seconds", job.started_at - job.created_at, kind=job.kind)
+        job.save()
+        try:
+            job.result = fn(job, **job.params)
+            job.status = "done"
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            metrics.observe("job_seconds", job.finished_at - job.started_at, kind=job.kind, status=job.status)
+            self._slots.release()
+            try: job.save()
+            except Exception as e: print(f"Job {job.id} could not be saved: {e}")
+            job.emit(job.status, error=job.error)
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        expired = [jid for jid, j in self._jobs.items() if j.finished and j.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+        if not self.spool or not os.path.isdir(self.spool): return
+        # Spool files of every process's jobs, once none of a job's files changed for the ttl
+        # (a running job keeps appending to its event log)
+        files = {}
+        for name in os.listdir(self.spool):
+            if name.startswith('.'): continue  # the submit lock
+            path = os.path.join(self.spool, name)
+            try: files.setdefault(name.partition('.')[0], []).append((os.path.getmtime(path), path))
+            except OSError: pass
+        for paths in files.values():
+            if max(paths)[0] >= cutoff: continue
+            for _, path in paths:
+                try: os.remove(path)
+                except OSError: pass
@@ -0,0 +1,156 @@
+import re
+import json
+
+OPEN_BRACKET = re.compile(r'[{\[]')
+STRING_SPECIAL = re.compile(r'["\\]')
+SCALAR_END = re.compile(r'[\s,:\]}]')
+CLOSERS = {'{': '}', '[': ']'}
+
+
+class StreamParser:
+    """
+    Lenient, incremental reader for the JSON object a model streams back. Text before
+    the first bracket (a ```json fence, a sentence) and after the closing one is ignored;
+    trailing commas are dropped and missing commas between values put back. feed()
+    returns the top-level members completed by each chunk, so finished sections can be
+    used before the rest arrives. finish() returns (value, complete): a truncated
+    answer is cut back to its last complete value and its open brackets closed.
+    """
+
+    def __init__(self):
+        self.buf = ''
+        self.pos = 0
+        self.start = None
+        self.end = None
+        self.stack = []
+        self.states = []  # per open bracket: "key", "colon", "value" or "after"
+        self.edits = {}   # raw position -> replacement for that character
+        self.in_string = False
+        self.string_key = False
+        self.scalar = False
+        self.safe = None  # (position, open brackets) after the last complete value
+        self.member_start = None
+        self.last_sig = None
+        self.last_comma = None
+
+    def feed(self, chunk):
+        self.buf += chunk
+        members = []
+        buf, n = self.buf, len(self.buf)
+        i = self.pos
+        while i < n and self.end is None:
+            if self.start is None:
+                match = OPEN_BRACKET.search(buf, i)
+                if not match:
+                    i = n
+                    break
+                i = match.start()
+                self.start = i
+            if self.in_string:
+                match = STRING_SPECIAL.search(buf, i)
+                if not match:
+                    i = n
+                    break
+                if match.group() == '\\':
+                    if match.start() + 1 >= n:
+                        i = match.start()  # escape split across chunks: wait for the next one
+                        break
+                    i = match.start() + 2
+                    continue
+                i = match.end()
+                self.in_string = False
+                self.last_sig = '"'
+                if self.string_key: self.states[-1] = "colon"
+                else: self._value_done(i, members)
+                continue
+            if self.scalar:
+                match = SCALAR_END.search(buf, i)
+                if not match:
+                    i = n
+                    break
+                self.scalar = False
+                self._value_done(match.start(), members)
+                i = match.start()
+                continue
+
+            ch = buf[i]
+            if ch.isspace():
+                i += 1
+                continue
+            state = self.states[-1] if self.states else "value"
+            if ch in '}]':
+                if self.last_sig == ',': self.edits[self.last_comma] = ''
+                self.stack.pop()
+                self.states.pop()
+                self.last_sig = ch
+                if self.stack: self._value_done(i + 1, members)
+                else:
+                    self.end = i + 1
+                    self.safe = (self.end, '')
+            elif ch == ',':
+                if self.last_sig == ',': self.edits[i] = ''  # doubled comma
+                else:
+                    self.states[-1] = "key" if self.stack[-1] == '{' else "value"
+                    self.last_comma = i
+                    self.last_sig = ','
+                    if len(self.stack) == 1: self.member_start = i + 1
+            elif ch == ':':
+                self.states[-1] = "value"
+                self.last_sig = ':'
+            else:
+                if state == "after":
+                    # A value straight after another one: the model left out a comma
+                    self.edits[i] = ',' + ch
+                    self.states[-1] = "key" if self.stack[-1] == '{' else "value"
+                    if len(self.stack) == 1: self.member_start = i
+                    state = self.states[-1]
+                self.last_sig = ch
+                if ch in '{[':
+                    self.stack.append(ch)
+                    self.states.append("key" if ch == '{' else "value")
+                    if len(self.stack) == 1: self.member_start = i + 1
+                    self.safe = (i + 1, ''.join(self.stack))
+                elif ch == '"':
+                    self.in_string = True
+                    self.string_key = self.stack[-1] == '{' and state == "key"
+                else:
+                    self.scalar = True
+            i += 1
+        self.pos = i
+        return members
+
+    def _value_done(self, end, members):
+        self.states[-1] = "after"
+        self.safe = (end, ''.join(self.stack))
+        if self.stack == ['{'] and self.member_start is not None:
+            try:
+                members.extend(json.loads('{' + self._text(self.member_start, end) + '}').items())
+            except ValueError:
+                pass
+
+    def _text(self, a, b):
+        """ The raw text [a, b) with the recorded edits applied (none at a itself). """
+        edits = sorted(p for p in self.edits if a < p < b)
+        if not edits: return self.buf[a:b]
+        parts, last = [], a
+        for p in edits:
+            parts.append(self.buf[last:p])
+            parts.append(self.edits[p])
+            last = p + 1
+        parts.append(self.buf[last:b])
+        return ''.join(parts)
+
+    def finish(self):
+        if self.end is not None:
+            return json.loads(self._text(self.start, self.end)), True
+        if self.safe is None: raise ValueError("No JSON value in response")
+        end, stack = self.safe
+        text = self._text(self.start, end).rstrip().rstrip(',')
+        return json.loads(text + ''.join(CLOSERS[c] for c in reversed(stack))), False
+
+
+def repair(text):
+    """ (value, complete) from a whole model answer; see StreamParser. """
+    parser = StreamParser()
+    parser.feed(text)
+    return parser.finish()
@@ -0,0 +1,20 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: callers' thread locks still hold, but only within one process
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """ Exclusive lock on path (created if missing) shared by every process of the app; a no-op without flock. """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try: yield
+        finally: fcntl.flock(f, fcntl.LOCK_UN)
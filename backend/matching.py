@@ -0,0 +1,94 @@
+import re
+
+
+def trie_pattern(words):
+    """ Regex source for a set of words with common prefixes factored out, longest match first. """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        ends = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches: return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if ends else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Finds every keyword contained in a label with one compiled regex. The keywords are
+    folded into a trie-shaped pattern inside a lookahead, so each start position costs
+    one character dispatch and reports the longest keyword there; shorter keywords that
+    are prefixes of it match at the same spot and come from a table built up front.
+    Results are memoized per label, since the same labels recur every year. With
+    word_start a keyword only matches at the start of a word ("rent" in "rent expense",
+    not in "current"); it can still end inside one ("salar" matches "salaries").
+    """
+
+    def __init__(self, keywords, cache_size=8192, word_start=False):
+        self.keywords = sorted(set(keywords), key=len, reverse=True)
+        self.pattern = re.compile("(?=" + (r"\b" if word_start else "") + "(" + trie_pattern(self.keywords) + "))")
+        self.prefixes = {k: frozenset(j for j in self.keywords if k.startswith(j)) for k in self.keywords}
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def match(self, text):
+        found = self._cache.get(text)
+        if found is not None: return found
+        found = set()
+        for m in self.pattern.finditer(text):
+            if m.group(1): found.update(self.prefixes[m.group(1)])
+        found = frozenset(found)
+        if len(self._cache) >= self.cache_size: self._cache.clear()
+        self._cache[text] = found
+        return found
+
+
+class LineItemIndex:
+    """
+    One statement's line items indexed by keyword: labels are normalized and matched
+    once, after which a lookup only touches the items that actually matched, in
+    statement order.
+    """
+
+    def __init__(self, items, matcher):
+        self.items = items or []
+        self.positions = {}
+        for pos, item in enumerate(self.items):
+            label = str(item.get('line_item', '')).lower()
+            for keyword in matcher.match(label):
+                self.positions.setdefault(keyword, []).append(pos)
+
+    def _hits(self, keywords):
+        hits = set()
+        for k in keywords:
+            hits.update(self.positions.get(k, ()))
+        return sorted(hits)
+
+    def first(self, keywords):
+        """ Value of the first item matching any keyword (0 if none). """
+        hits = [self.positions[k][0] for k in keywords if k in self.positions]
+        if not hits: return 0
+        val = self.items[min(hits)].get('value', 0)
+        if isinstance(val, (int, float)): return val
+        return parse_number(val)
+
+    def matches(self, keywords):
+        """ Values of every item matching any keyword, in statement order. """
+        return [parse_number(self.items[pos].get('value', 0)) for pos in self._hits(keywords)]
+
+    def nth(self, keywords, n):
+        """ Value of the n-th match, e.g. the current portion of a liability listed twice. """
+        values = self.matches(keywords)
+        return values[n] if len(values) > n else 0
+
+
+def parse_number(val):
+    try: return float(str(val).replace(',', '').strip())
+    except: return 0
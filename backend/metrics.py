@@ -0,0 +1,112 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the timing histograms: sub-millisecond parsing up to long model calls
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs: return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """
+    Process-wide counters and timing histograms, rendered in the Prometheus text format.
+    Values that other objects already keep (queue lengths, cache sizes...) are read at
+    render time from collector callbacks instead of being copied in.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}    # name -> {labels: value}
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self._help = {}
+        self._collectors = []  # (name, type, help, fn() -> [(labels dict, value)])
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _labels(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _labels(labels)
+            values = series.get(key)
+            if values is None: values = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound: values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def collector(self, name, kind, text, fn):
+        """ Adds a series computed on every render: fn() returns [(labels dict, value)]. """
+        self._collectors.append((name, kind, text, fn))
+
+    def value(self, name, **labels):
+        with self._lock: return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def render(self):
+        lines = []
+        def header(name, kind, text=None):
+            text = text or self._help.get(name)
+            if text: lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {n: {k: list(v) for k, v in s.items()} for n, s in self._histograms.items()}
+        for name, series in sorted(counters.items()):
+            header(name, "counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format(labels)} {value}")
+        for name, series in sorted(histograms.items()):
+            header(name, "histogram")
+            for labels, values in sorted(series.items()):
+                for bound, count in zip(self.buckets, values):
+                    lines.append(f"{name}_bucket{_format(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format(labels, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{_format(labels)} {values[-2]}")
+                lines.append(f"{name}_count{_format(labels)} {values[-1]}")
+        for name, kind, text, fn in self._collectors:
+            try: samples = list(fn())
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            header(name, kind, text)
+            for labels, value in samples:
+                lines.append(f"{name}{_format(_labels(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("stage_seconds", "Time spent per pipeline stage")
+metrics.describe("pdf_pages_total", "PDF pages read (classified) and written for model calls (sent)")
+metrics.describe("pdf_bytes_total", "PDF bytes received, written for model calls and uploaded")
+metrics.describe("model_tokens_total", "Model tokens: estimated before each call, and prompt/output as reported")
+metrics.describe("model_calls_total", "Model extractions by provider and outcome")
+metrics.describe("cache_requests_total", "Cache lookups by cache and result (hit or miss)")
+metrics.describe("job_wait_seconds", "Time jobs spent queued before a worker picked them up")
+metrics.describe("job_seconds", "Job run time by kind and final status")
+metrics.describe("http_request_seconds", "Request handling time per route, method and status")
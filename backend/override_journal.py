@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import shutil
+from collections import deque
+
+SNAPSHOT_EVERY = int(os.getenv("JOURNAL_SNAPSHOT_EVERY", 200))
+UNDO_DEPTH = int(os.getenv("JOURNAL_UNDO_DEPTH", 1000))  # edits kept in the log; older ones are folded into its first line
+
+
+class JournalState:
+    """
+    Overrides as of one point in the journal: {template: {name: {year: value}}}. position
+    is the seq of the edit this state is equal to: after a revert, the edit it went back
+    to, so undoing again steps further back instead of undoing the revert.
+    """
+
+    def __init__(self, seq=0, offset=0, overrides=None, position=None):
+        self.seq = seq
+        self.offset = offset
+        self.overrides = overrides or {}
+        self.position = seq if position is None else position
+
+    def template(self, name):
+        return self.overrides.get(name, {})
+
+
+def apply_entry(overrides, entry):
+    op = entry["op"]
+    if op == "set":
+        overrides.setdefault(entry["template"], {}).setdefault(entry["name"], {})[entry["year"]] = entry["value"]
+    elif op == "replace":
+        overrides[entry["template"]] = {n: dict(c) for n, c in entry["overrides"].items()}
+    elif op == "reset":
+        overrides.clear()
+    elif op in ("revert", "base"):
+        overrides.clear()
+        overrides.update({t: {n: dict(c) for n, c in o.items()} for t, o in entry["overrides"].items()})
+
+
+def entry_position(entry):
+    if entry["op"] == "base": return entry["position"]
+    return entry["to"] if entry["op"] == "revert" else entry["seq"]
+
+
+class OverrideJournal:
+    """
+    A company's manual edits as an append-only JSON-lines log. Every save appends one
+    small entry; loading replays the log over the computed base model. Every
+    SNAPSHOT_EVERY entries the replayed state is checkpointed together with its byte
+    offset, so a load only reads the entries after the last snapshot. At a snapshot, once
+    the log holds more than undo_depth edits, the older ones are compacted into a "base"
+    first line holding the state they add up to; undo goes back as far as that line.
+    Callers serialize appends (the app holds the company lock).
+    """
+
+    def __init__(self, folder, snapshot_every=SNAPSHOT_EVERY, undo_depth=UNDO_DEPTH):
+        self.path = os.path.join(folder, 'overrides.jsonl')
+        self.snapshot_path = os.path.join(folder, 'overrides.snapshot.json')
+        self.snapshot_every = snapshot_every
+        self.undo_depth = max(undo_depth, 1)
+
+    def _snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r') as f: snap = json.load(f)
+            return JournalState(snap["seq"], snap["offset"], snap["overrides"], snap.get("position"))
+        except (OSError, ValueError, KeyError):
+            return JournalState()
+
+    def _entries(self, offset=0):
+        """ (entry, offset after it) from the given byte offset; a torn last line is skipped. """
+        if not os.path.exists(self.path): return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b'\n'): break
+                try: yield json.loads(line), offset
+                except ValueError: print(f"Skipping corrupt journal line in {self.path}")
+
+    def _start(self, seq):
+        """ The snapshot if seq is at or after it (reading can start there), else an empty state at byte 0. """
+        state = self._snapshot()
+        try: size = os.path.getsize(self.path)
+        except OSError: size = 0
+        return state if seq >= state.seq and state.offset <= size else JournalState()
+
+    def read(self, upto=None):
+        """ Replayed state, from the last snapshot when possible. upto stops after that seq. """
+        if upto is not None and upto < self.oldest(): raise ValueError(f"Edit {upto} is no longer in the journal")
+        state = self._start(upto if upto is not None else float('inf'))
+        for entry, offset in self._entries(state.offset):
+            if state.seq and entry["op"] != "base" and entry["seq"] != state.seq + 1:
+                return self._replay(upto)  # snapshot offset from before a compaction: start over
+            if upto is not None and entry["seq"] > upto: break
+            apply_entry(state.overrides, entry)
+            state.seq, state.offset, state.position = entry["seq"], offset, entry_position(entry)
+        return state
+
+    def _replay(self, upto):
+        state = JournalState()
+        for entry, offset in self._entries():
+            if upto is not None and entry["seq"] > upto: break
+            apply_entry(state.overrides, entry)
+            state.seq, state.offset, state.position = entry["seq"], offset, entry_position(entry)
+        return state
+
+    def oldest(self):
+        """ The earliest seq whose state is still in the log: 0, or the seq of the compacted first line. """
+        for entry, _ in self._entries():
+            return entry["seq"] if entry["op"] == "base" else 0
+        return 0
+
+    def position_of(self, seq):
+        """ The edit the state after seq is equal to (see JournalState.position). """
+        if seq == 0: return 0
+        start = self._start(seq)
+        if start.seq == seq: return start.position
+        for entry, _ in self._entries(start.offset):
+            if entry["seq"] == seq: return entry_position(entry)
+        return seq
+
+    def undo_target(self, state):
+        """ Where Undo goes from state: the edit before the current one, skipping reverts; None if there is none. """
+        if state.position == 0 or state.position - 1 < self.oldest(): return None
+        return self.position_of(state.position - 1)
+
+    def history(self, limit=100):
+        """ The most recent entries, oldest first. """
+        entries = deque((entry for entry, _ in self._entries() if entry["op"] != "base"), maxlen=limit)
+        return list(entries)
+
+    def append(self, state, op, **fields):
+        """ Appends one entry on top of state (the current replayed state) and returns the new state. """
+        entry = {"seq": state.seq + 1, "at": time.time(), "op": op, **fields}
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(line)
+            offset = f.tell()
+        # Copy what the entry touches: the state passed in may still be shared with readers
+        overrides = dict(state.overrides)
+        if "template" in entry:
+            overrides[entry["template"]] = {n: dict(c) for n, c in state.template(entry["template"]).items()}
+        apply_entry(overrides, entry)
+        state = JournalState(entry["seq"], offset, overrides, entry_position(entry))
+        if state.seq % self.snapshot_every == 0:
+            if state.seq - self.oldest() > self.undo_depth + self.snapshot_every: state = self._compact(state)
+            self._write_snapshot(state)
+        return state
+
+    def _compact(self, state):
+        """ Rewrites the log as one "base" line for the state at state.seq - undo_depth plus the entries after it. """
+        base = self.read(upto=state.seq - self.undo_depth)
+        line = {"seq": base.seq, "at": time.time(), "op": "base", "position": base.position, "overrides": base.overrides}
+        line = (json.dumps(line, separators=(',', ':')) + '\n').encode()
+        tmp_path = f"{self.path}.tmp"
+        with open(self.path, 'rb') as src, open(tmp_path, 'wb') as f:
+            f.write(line)
+            src.seek(base.offset)
+            shutil.copyfileobj(src, f)
+        # The old snapshot's offset points into the old file
+        if os.path.exists(self.snapshot_path): os.remove(self.snapshot_path)
+        os.replace(tmp_path, self.path)
+        return JournalState(state.seq, state.offset - base.offset + len(line), state.overrides, state.position)
+
+    def _write_snapshot(self, state):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"seq": state.seq, "offset": state.offset, "overrides": state.overrides, "position": state.position}, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    # --- Operations ---
+    def set(self, state, template, name, year, value):
+        return self.append(state, "set", template=template, name=name, year=str(year), value=value)
+
+    def replace(self, state, template, overrides):
+        return self.append(state, "replace", template=template, overrides=overrides)
+
+    def reset(self, state):
+        return self.append(state, "reset")
+
+    def revert(self, state, seq):
+        """ Appends one entry that brings every template back to how it was after seq (0 = no edits). """
+        return self.append(state, "revert", to=self.position_of(seq), overrides=self.read(upto=seq).overrides)
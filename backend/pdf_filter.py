@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from metrics import metrics
+
+# Section headers used to spot the primary statements and the start of the notes
+SECTION_HEADERS = {
+    "notes": ["notes to the financial statements"],
+    "statement_of_financial_position": ["statement of financial position", "balance sheet"],
+    "statement_of_profit_or_loss": ["statement of profit or loss", "comprehensive income", "income statement"],
+    "statement_of_changes_in_equity": ["statement of changes in equity"],
+    "statement_of_cash_flows": ["statement of cash flows", "cash flows"],
+}
+
+# All headers in one alternation, longest first, with a named group per section
+HEADER_PATTERN = re.compile("|".join(
+    f"(?P<{section}>{'|'.join(re.escape(h) for h in sorted(headers, key=len, reverse=True))})"
+    for section, headers in SECTION_HEADERS.items()
+))
+
+STATEMENT_SECTIONS = ("statement_of_financial_position", "statement_of_profit_or_loss", "statement_of_cash_flows")
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_PAGES = 24 # below this the process pool costs more than it saves
+PROGRESS_PAGES = 8 # pages per progress report when classifying in-process
+INDEX_VERSION = 2
+NOTE_CHUNK_PAGES = int(os.getenv("NOTE_CHUNK_PAGES", 8)) # notes pages per model call
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _pool
+
+
+def classify_text(text):
+    """ Returns the sections whose headers appear in a page's text, stopping at the notes header. """
+    sections = []
+    for match in HEADER_PATTERN.finditer(text.lower()):
+        if match.lastgroup not in sections:
+            sections.append(match.lastgroup)
+        if match.lastgroup == "notes":
+            break
+    return sections
+
+
+def _classify_chunk(path, start, stop):
+    """ Extracts and classifies pages [start, stop). Runs inside a worker process. """
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    pages = []
+    for i in range(start, stop):
+        text = reader.pages[i].extract_text()
+        pages.append({"has_text": bool(text), "sections": classify_text(text) if text else []})
+    return pages
+
+
+def _mark_notes(pages):
+    """
+    Clears the sections of every page after the notes header: from there on headers are
+    cross-references inside the notes. Done over the whole document once the chunks are
+    back, so the result does not depend on how the pages were split.
+    """
+    in_notes = False
+    for page in pages:
+        if in_notes: page["sections"] = []
+        in_notes = in_notes or "notes" in page["sections"]
+    return pages
+
+
+def _index_path(path):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.pages.json")
+
+
+def classify_pages(path, on_progress=None):
+    """
+    Per-page classification of a PDF: whether each page has text and which statement
+    headers it contains. Pages are processed in chunks across a process pool, and the
+    result is stored next to the PDF so it is only computed once per file version.
+    on_progress(pages done, total pages) is called as chunks finish.
+    """
+    stat = os.stat(path)
+    index_file = _index_path(path)
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+            if (index.get("version"), index.get("size"), index.get("mtime")) == (INDEX_VERSION, stat.st_size, stat.st_mtime):
+                metrics.inc("cache_requests_total", cache="page_index", result="hit")
+                return index
+        except Exception as e:
+            print(f"Page index error: {e}")
+    metrics.inc("cache_requests_total", cache="page_index", result="miss")
+
+    from pypdf import PdfReader
+    started = time.perf_counter()
+    num_pages = len(PdfReader(path).pages)
+    if num_pages < PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        if on_progress is None:
+            pages = _classify_chunk(path, 0, num_pages)
+        else:
+            pages = []
+            for start in range(0, num_pages, PROGRESS_PAGES):
+                pages.extend(_classify_chunk(path, start, min(start + PROGRESS_PAGES, num_pages)))
+                on_progress(len(pages), num_pages)
+    else:
+        chunk = max(8, math.ceil(num_pages / (PDF_WORKERS * 2)))
+        bounds = [(s, min(s + chunk, num_pages)) for s in range(0, num_pages, chunk)]
+        pages = []
+        for result in _get_pool().map(_classify_chunk, [path] * len(bounds), *zip(*bounds)):
+            pages.extend(result)
+            if on_progress: on_progress(len(pages), num_pages)
+    _mark_notes(pages)
+    metrics.observe("stage_seconds", time.perf_counter() - started, stage="page_text")
+    metrics.inc("pdf_pages_total", num_pages, stage="classified")
+
+    index = {"version": INDEX_VERSION, "size": stat.st_size, "mtime": stat.st_mtime,
+             "num_pages": num_pages, "pages": pages}
+    try:
+        with open(index_file, 'w') as f:
+            json.dump(index, f)
+    except OSError as e:
+        print(f"Page index error: {e}")
+    return index
+
+
+def select_pages(pages):
+    """ Statement pages plus everything from the start of the notes onwards; all pages if nothing matched. """
+    pages_to_keep = []
+    found_notes_start = False
+    for i, page in enumerate(pages):
+        if not page["has_text"]: continue
+        if found_notes_start or page["sections"]:
+            pages_to_keep.append(i)
+        found_notes_start = found_notes_start or "notes" in page["sections"]
+
+    if not pages_to_keep:
+        pages_to_keep = list(range(len(pages)))
+    return pages_to_keep
+
+
+def section_chunks(pages, note_pages=NOTE_CHUNK_PAGES):
+    """
+    The kept pages split by section for separate model calls: one chunk per primary
+    statement, then the notes in runs of note_pages. Returns [(name, [page, ...])], or
+    None when a primary statement header was not found (extract the document whole).
+    """
+    statements = {s: [] for s in STATEMENT_SECTIONS}
+    notes, in_notes = [], False
+    for i, page in enumerate(pages):
+        if not page["has_text"]: continue
+        if not in_notes:
+            for section in page["sections"]:
+                if section in statements: statements[section].append(i)
+        in_notes = in_notes or "notes" in page["sections"]
+        if in_notes: notes.append(i)
+
+    if not all(statements.values()): return None
+    chunks = list(statements.items())
+    for n, start in enumerate(range(0, len(notes), note_pages), 1):
+        chunks.append((f"notes_{n}", notes[start:start + note_pages]))
+    return chunks
+
+
+def write_pages(original_path, pages, output_path):
+    from pypdf import PdfReader, PdfWriter
+    with metrics.timer("stage_seconds", stage="page_filter"):
+        reader = PdfReader(original_path)
+        writer = PdfWriter()
+        for p in pages:
+            writer.add_page(reader.pages[p])
+
+        with open(output_path, "wb") as f:
+            writer.write(f)
+    metrics.inc("pdf_pages_total", len(pages), stage="sent")
+    metrics.inc("pdf_bytes_total", os.path.getsize(output_path), stage="sent")
+
+
+# --- SMART PDF FILTERING ---
+def create_filtered_pdf(original_path, output_path, on_progress=None):
+    index = classify_pages(original_path, on_progress)
+    pages_to_keep = select_pages(index["pages"])
+    write_pages(original_path, pages_to_keep, output_path)
+    return pages_to_keep
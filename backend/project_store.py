@@ -0,0 +1,90 @@
+import os
+import json
+import sqlite3
+import threading
+from locks import file_lock
+
+
+class ProjectStore:
+    """
+    Project metadata in SQLite (WAL mode): indexed lookup by company id, atomic
+    upserts that are safe across threads and processes, and paged listing. On first
+    use an existing projects.json is imported and renamed out of the way.
+    """
+
+    def __init__(self, db_path, legacy_json=None):
+        self.db_path = db_path
+        self.legacy_json = legacy_json
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._setup()
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _setup(self):
+        with self._init_lock:
+            if self._ready: return
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                with conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS projects ("
+                        " company_id TEXT PRIMARY KEY,"
+                        " name TEXT,"
+                        " data TEXT NOT NULL)"
+                    )
+                self._migrate(conn)
+            finally:
+                conn.close()
+            self._ready = True
+
+    def _migrate(self, conn):
+        if not self.legacy_json or not os.path.exists(self.legacy_json): return
+        # Every process starts here: the first to take the lock imports, the others find the file gone
+        with file_lock(f"{self.db_path}.migrate.lock"):
+            try:
+                with open(self.legacy_json, 'r') as f: projects = json.load(f)
+            except FileNotFoundError:
+                return
+            except Exception as e:
+                print(f"Project migration error: {e}")
+                return
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO projects (company_id, name, data) VALUES (?, ?, ?)",
+                    [(cid, meta.get("name"), json.dumps(meta)) for cid, meta in projects.items()]
+                )
+            os.replace(self.legacy_json, f"{self.legacy_json}.migrated")
+
+    def get(self, company_id):
+        row = self._conn().execute("SELECT data FROM projects WHERE company_id = ?", (company_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, company_id, data):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO projects (company_id, name, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(company_id) DO UPDATE SET name = excluded.name, data = excluded.data",
+                (company_id, data.get("name"), json.dumps(data))
+            )
+
+    def list(self, offset=0, limit=None):
+        """ Projects in creation order as [{"id": ..., **metadata}]; all of them without a limit. """
+        rows = self._conn().execute(
+            "SELECT company_id, data FROM projects ORDER BY rowid LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset)
+        ).fetchall()
+        return [{"id": cid, **json.loads(data)} for cid, data in rows]
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM projects").fetchone()[0]
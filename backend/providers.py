@@ -0,0 +1,372 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from pdf_filter import classify_text, STATEMENT_SECTIONS
+from json_repair import StreamParser
+from governor import Governor, DeadlineExceeded
+from remote_files import RemoteFileRegistry, file_digest, DISPLAY_PREFIX
+from metrics import metrics
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+REPLAY_DIR = os.getenv("REPLAY_DIR", os.path.join(os.getcwd(), 'data', '_replay'))
+REMOTE_CLEANUP_INTERVAL = int(os.getenv("REMOTE_CLEANUP_INTERVAL", 3600))  # seconds between sweeps of our expired uploads
+
+
+class ProviderError(Exception):
+    pass
+
+
+# --- RESULT SCHEMA ---
+def _number(value):
+    """ An amount as a number: "1,234" -> 1234, "(200)" -> -200, blanks -> 0; None if unreadable. """
+    if value is None or value in ('', '-'): return 0
+    if isinstance(value, (int, float)) and not isinstance(value, bool): return value
+    text = str(value).strip().replace(',', '')
+    negative = text.startswith('(') and text.endswith(')')
+    try: number = float(text.strip('()'))
+    except ValueError: return None
+    return -number if negative else number
+
+
+def _flag(value):
+    """ A yes/no field as a bool: models sometimes answer "false" or "0" as strings. """
+    if isinstance(value, str): return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+def validate_section(key, value):
+    """ One top-level section coerced to the extraction schema; malformed rows are dropped. """
+    if key in STATEMENT_SECTIONS:
+        rows = []
+        for row in value if isinstance(value, list) else []:
+            # A row cut off before its value is worth less than no row
+            if not isinstance(row, dict) or "value" not in row or not str(row.get("line_item") or "").strip(): continue
+            number = _number(row.get("value"))
+            rows.append({**row, "line_item": str(row["line_item"]).strip(), "note_ref": str(row.get("note_ref") or ""),
+                         "value": 0 if number is None else number, "is_header": _flag(row.get("is_header"))})
+        return rows
+    if key == "notes":
+        return {str(ref): str(text) for ref, text in value.items()} if isinstance(value, dict) else {}
+    if key == "note_tables":
+        if not isinstance(value, dict): return {}
+        return {str(ref): [r for r in rows if isinstance(r, dict)] for ref, rows in value.items() if isinstance(rows, list)}
+    return value
+
+
+class ExtractionProvider:
+    """
+    Turns (PDF, prompt) into the JSON the prompt asks for. section names what the PDF
+    holds: a statement key, "notes_<n>", or None for a whole filtered report.
+    Subclasses implement generate(), which returns the raw answer text, and may
+    override stream() to hand it over in chunks as it arrives.
+    """
+    name = None
+
+    def generate(self, pdf_path, prompt, section=None):
+        raise NotImplementedError
+
+    def stream(self, pdf_path, prompt, section=None, progress=None):
+        with metrics.timer("stage_seconds", stage="generation"):
+            text = self.generate(pdf_path, prompt, section)
+        yield text
+
+    def extract(self, pdf_path, prompt, section=None, progress=None):
+        """
+        The answer parsed as it streams in and validated. progress(event, **data), when
+        given, gets a "section" event (key, value) for each top-level section once it is
+        complete, plus any provider status events. If the answer is cut short, the
+        complete sections are kept and the result is flagged "repaired"; ValueError if none are.
+        """
+        parser = StreamParser()
+        parsing = 0.0  # time in the parser, summed over the chunks
+        try:
+            for chunk in self.stream(pdf_path, prompt, section, progress):
+                start = time.perf_counter()
+                members = parser.feed(chunk)
+                parsing += time.perf_counter() - start
+                for key, value in members:
+                    if progress: progress("section", key=key, value=validate_section(key, value))
+        except ProviderError:
+            metrics.inc("model_calls_total", provider=self.name, result="failed")
+            raise
+        except Exception as e:
+            if parser.safe is None:
+                metrics.inc("model_calls_total", provider=self.name, result="failed")
+                raise
+            print(f"{self.name} answer broke off ({e}); keeping what arrived")
+        start = time.perf_counter()
+        try:
+            result, complete = parser.finish()
+            if not isinstance(result, dict): raise ValueError("Model answer is not a JSON object")
+            result = {key: validate_section(key, value) for key, value in result.items()}
+        except ValueError:
+            metrics.inc("model_calls_total", provider=self.name, result="unparseable")
+            raise
+        finally:
+            metrics.observe("stage_seconds", parsing + time.perf_counter() - start, stage="json_parse")
+        if not complete: result["repaired"] = True
+        metrics.inc("model_calls_total", provider=self.name, result="ok" if complete else "repaired")
+        return result
+
+
+# --- GEMINI ---
+PDF_PAGE_TOKENS = 258  # Gemini bills each PDF page as an image of this many tokens
+
+
+def estimate_tokens(pdf_path, prompt):
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages) * PDF_PAGE_TOKENS + len(prompt) // 4
+
+
+class GeminiProvider(ExtractionProvider):
+    def __init__(self, model_name=GEMINI_MODEL, api_key=None, governor=None, files=None):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        self.genai = genai
+        self.name = model_name
+        self.governor = governor or Governor.from_env()
+        self.files = files or RemoteFileRegistry()
+        threading.Thread(target=self._cleanup_loop, daemon=True).start()
+        self._model = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        """ One GenerativeModel instance shared by every extraction worker. """
+        with self._lock:
+            if self._model is None:
+                self._model = self.genai.GenerativeModel(self.name)
+            return self._model
+
+    def _processed(self, name):
+        uploaded_file = self.genai.get_file(name)
+        if uploaded_file.state.name == "FAILED": raise ProviderError("AI File processing failed")
+        return uploaded_file if uploaded_file.state.name != "PROCESSING" else None
+
+    def _reused(self, digest, deadline):
+        """ The earlier upload of the same bytes, if the registry has one and it is still usable. """
+        name = self.files.get(digest)
+        if name is None: return None
+        try:
+            uploaded_file = self.governor.call(lambda: self.genai.get_file(name), deadline, limited=False, what="file status")
+            if uploaded_file.state.name not in ("ACTIVE", "PROCESSING"): raise ProviderError(uploaded_file.state.name)
+            return uploaded_file
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Remote file {name} not reusable ({e}); uploading again")
+            self.files.discard(digest)
+            return None
+
+    def upload(self, pdf_path, deadline, status=None):
+        """ An ACTIVE remote file with pdf_path's content, uploaded only if no live copy exists. """
+        gov = self.governor
+        status = status or (lambda state: None)
+        digest = file_digest(pdf_path)
+        uploaded_file = self._reused(digest, deadline)
+        metrics.inc("cache_requests_total", cache="remote_file", result="miss" if uploaded_file is None else "hit")
+        if uploaded_file is not None: status("reused")
+        else:
+            status("uploading")
+            with gov.upload(deadline), metrics.timer("stage_seconds", stage="upload"):
+                uploaded_file = gov.call(
+                    lambda: self.genai.upload_file(pdf_path, mime_type="application/pdf", display_name=f"{DISPLAY_PREFIX}{digest[:16]}"),
+                    deadline, limited=False, what="upload",
+                )
+            metrics.inc("pdf_bytes_total", os.path.getsize(pdf_path), stage="uploaded")
+            if uploaded_file.state.name == "FAILED": raise ProviderError("AI File processing failed")
+            expires = getattr(uploaded_file, "expiration_time", None)
+            self.files.put(digest, uploaded_file.name, expires.timestamp() if expires else None)
+        if uploaded_file.state.name == "PROCESSING":
+            status("processing")
+            name = uploaded_file.name
+            with metrics.timer("stage_seconds", stage="remote_processing"):
+                uploaded_file = gov.poll(lambda: gov.call(lambda: self._processed(name), deadline, limited=False, what="file status"), deadline)
+        return uploaded_file
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(REMOTE_CLEANUP_INTERVAL)
+            self.cleanup()
+
+    def cleanup(self):
+        """ Deletes remote files this process uploaded that the registry no longer tracks (expired or discarded). """
+        try:
+            print(f"Removed {self.files.cleanup(self.genai)} stale remote files")
+        except Exception as e:
+            print(f"Remote file cleanup failed: {e}")
+
+    def stream(self, pdf_path, prompt, section=None, progress=None):
+        gov = self.governor
+        deadline = gov.new_deadline()
+        status = (lambda state: progress("upload", section=section, state=state)) if progress else None
+        try:
+            uploaded_file = self.upload(pdf_path, deadline, status)
+            if status: status("generating")
+            estimate = estimate_tokens(pdf_path, prompt)
+            metrics.inc("model_tokens_total", estimate, kind="estimated")
+            started = time.perf_counter()
+            response = gov.call(
+                lambda: self.model().generate_content([uploaded_file, prompt], stream=True,
+                                                      request_options={"timeout": max(1.0, deadline.remaining())}),
+                deadline, tokens=estimate, what=f"{self.name} {section or 'report'}",
+            )
+        except DeadlineExceeded as e:
+            raise ProviderError(str(e))
+        for chunk in response:
+            try: text = chunk.text
+            except ValueError: continue  # a chunk without text parts (e.g. only a finish reason)
+            yield text
+        metrics.observe("stage_seconds", time.perf_counter() - started, stage="generation")
+        usage = getattr(response, "usage_metadata", None)
+        metrics.inc("model_tokens_total", getattr(usage, "prompt_token_count", 0) or 0, kind="prompt")
+        metrics.inc("model_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, kind="output")
+        gov.settle(estimate, getattr(usage, "prompt_token_count", 0))
+
+    def generate(self, pdf_path, prompt, section=None):
+        return ''.join(self.stream(pdf_path, prompt, section))
+
+
+# --- LOCAL RULES (no network) ---
+AMOUNT = re.compile(r'^\(?-?[\d,]+(?:\.\d+)?\)?$|^-$')
+NOTE_HEADING = re.compile(r'^(\d{1,2})\.?\s+([A-Z][^\d]{2,80})$')
+YEAR = re.compile(r'^(19|20)\d{2}$')
+
+
+def _amount(token):
+    if token == '-': return 0.0
+    negative = token.startswith('(') and token.endswith(')')
+    value = float(token.strip('()').replace(',', ''))
+    return -value if negative else value
+
+
+def parse_statement_line(line):
+    """ {"line_item", "note_ref", "value", "is_header"} from one text line, or None for noise. """
+    tokens = line.split()
+    n = len(tokens)
+    while n and AMOUNT.match(tokens[n - 1]): n -= 1
+    label, numbers = " ".join(tokens[:n]), tokens[n:]
+    if not label or all(YEAR.match(t) for t in tokens): return None
+    # "As at 31 December 2022": a date line, not an amount
+    if all(YEAR.match(t) for t in numbers): label, numbers = line.strip(), []
+    if not numbers:
+        if len(label) > 80 or label.isupper() and len(label) < 4: return None
+        return {"line_item": label, "note_ref": "", "value": 0, "is_header": True}
+    note_ref = ""
+    # "Revenue 17 1,234 1,100": a small bare integer before two amounts is the note reference
+    if len(numbers) >= 3 and numbers[0].isdigit() and int(numbers[0]) < 100:
+        note_ref, numbers = numbers[0], numbers[1:]
+    # Current year is the first amount column
+    return {"line_item": label, "note_ref": note_ref, "value": _amount(numbers[0]), "is_header": False}
+
+
+def parse_notes(lines):
+    notes, current = {}, None
+    for line in lines:
+        heading = NOTE_HEADING.match(line.strip())
+        if heading:
+            current = heading.group(1)
+            notes[current] = f"**{heading.group(2).strip()}**\n"
+        elif current:
+            notes[current] += line + "\n"
+    return {ref: text.strip() for ref, text in notes.items()}
+
+
+class LocalProvider(ExtractionProvider):
+    """
+    Deterministic extraction from the PDF's text layer: statement lines are split into
+    label, note reference and amounts; notes are split on numbered headings. No tables
+    are read from the notes. Good enough for cleanly typeset reports, and free.
+    """
+    name = "local-rules-1"
+
+    def generate(self, pdf_path, prompt, section=None):
+        from pypdf import PdfReader
+        pages = [page.extract_text() or "" for page in PdfReader(pdf_path).pages]
+        if section is None: return json.dumps(self._whole(pages))
+        if section in STATEMENT_SECTIONS: return json.dumps({section: self._statement(pages)})
+        return json.dumps({"notes": parse_notes("\n".join(pages).splitlines()), "note_tables": {}})
+
+    def _statement(self, pages):
+        rows = [parse_statement_line(line) for text in pages for line in text.splitlines()[1:]]
+        return [r for r in rows if r]
+
+    def _whole(self, pages):
+        result = {s: [] for s in STATEMENT_SECTIONS}
+        note_lines, section = [], None
+        for text in pages:
+            found = classify_text(text)
+            if "notes" in found or section == "notes":
+                section = "notes"
+                note_lines.extend(text.splitlines())
+                continue
+            section = next((s for s in found if s in result), section)
+            if section in result: result[section].extend(self._statement([text]))
+        result["notes"], result["note_tables"] = parse_notes(note_lines), {}
+        return result
+
+
+# --- RECORD / REPLAY ---
+class ReplayProvider(ExtractionProvider):
+    """
+    Serves answers recorded earlier, keyed by the PDF's bytes and the prompt, after a
+    configurable delay (latency +/- jitter seconds) standing in for the real call. With
+    a record_from provider, misses are forwarded to it and its answers stored.
+    """
+    name = "replay"
+
+    def __init__(self, folder=REPLAY_DIR, latency=0.0, jitter=0.0, record_from=None):
+        self.folder = folder
+        self.latency = latency
+        self.jitter = jitter
+        self.record_from = record_from
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, pdf_path, prompt, section):
+        h = hashlib.sha256()
+        with open(pdf_path, 'rb') as f: h.update(f.read())
+        h.update(prompt.encode('utf-8'))
+        h.update(str(section).encode('utf-8'))
+        return os.path.join(self.folder, f"{h.hexdigest()}.json")
+
+    def generate(self, pdf_path, prompt, section=None):
+        path = self._path(pdf_path, prompt, section)
+        if os.path.exists(path):
+            if self.latency or self.jitter: time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+            with open(path, 'r') as f: return json.load(f)["response"]
+        if self.record_from is None: raise ProviderError(f"No recorded response for section {section}")
+
+        text = self.record_from.generate(pdf_path, prompt, section)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"provider": self.record_from.name, "section": section, "response": text}, f)
+        os.replace(tmp_path, path)
+        return text
+
+
+# --- REGISTRY ---
+PROVIDERS = {
+    "gemini": lambda: GeminiProvider(),
+    "local": lambda: LocalProvider(),
+    "replay": lambda: ReplayProvider(latency=float(os.getenv("REPLAY_LATENCY", 0)), jitter=float(os.getenv("REPLAY_JITTER", 0))),
+    "record": lambda: ReplayProvider(record_from=get_provider("gemini")),
+}
+DEFAULT_PROVIDER = os.getenv("EXTRACTION_PROVIDER", "gemini")
+
+_instances = {}
+_instances_lock = threading.RLock()
+
+def active_providers():
+    """ {name: provider} for the providers created so far. """
+    with _instances_lock: return dict(_instances)
+
+def get_provider(name=None):
+    """ The named provider (EXTRACTION_PROVIDER by default), created on first use; None if unknown. """
+    name = name or DEFAULT_PROVIDER
+    if name not in PROVIDERS: return None
+    with _instances_lock:
+        if name not in _instances: _instances[name] = PROVIDERS[name]()
+        return _instances[name]
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from locks import file_lock
+
+REMOTE_FILES_PATH = os.getenv("REMOTE_FILES_PATH", os.path.join(os.getcwd(), 'data', '_remote_files.json'))
+FILE_TTL = 48 * 3600  # Gemini deletes uploaded files after 48 hours
+EXPIRY_MARGIN = 15 * 60  # Not worth reusing a file that may vanish mid-request
+DISPLAY_PREFIX = "fsx-"
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''): h.update(block)
+    return h.hexdigest()
+
+
+class RemoteFileRegistry:
+    """
+    Content hash -> uploaded file name and expiry, persisted as one JSON file, so a PDF
+    that was uploaded before (same bytes: a retried section, a new prompt) is reused
+    while the remote copy is alive instead of being uploaded and processed again. Every
+    change is a read-modify-write of the file under a lock, so the server's worker
+    processes share one registry.
+    """
+
+    def __init__(self, path=REMOTE_FILES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = self._read()
+        self.owned = set()  # names this process uploaded: the only ones its cleanup deletes
+        self.prune()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f: return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _update(self):
+        """ Yields the entries as on disk now and writes them back afterwards. """
+        with self._lock, file_lock(f"{self.path}.lock"):
+            entries = self._read()
+            yield entries
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f: json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+            self.entries = entries
+
+    def get(self, digest):
+        """ The remote file name for digest if it should still be alive, else None. """
+        with self._lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                # Maybe uploaded by another process since this one last read the file
+                self.entries = self._read()
+                entry = self.entries.get(digest)
+            if entry and entry["expires_at"] - EXPIRY_MARGIN > time.time(): return entry["name"]
+            return None
+
+    def put(self, digest, name, expires_at=None):
+        with self._update() as entries:
+            entries[digest] = {"name": name, "expires_at": expires_at or time.time() + FILE_TTL}
+            self.owned.add(name)
+
+    def discard(self, digest):
+        with self._update() as entries:
+            entries.pop(digest, None)
+
+    def prune(self):
+        """ Drops entries past their expiry; returns how many were dropped. """
+        now = time.time()
+        with self._update() as entries:
+            expired = [d for d, e in entries.items() if e["expires_at"] - EXPIRY_MARGIN <= now]
+            for digest in expired: del entries[digest]
+        return len(expired)
+
+    def cleanup(self, genai):
+        """
+        Deletes remote files this process uploaded (display name DISPLAY_PREFIX...) that
+        the registry no longer tracks, or that are about to expire. Files of other
+        processes are left alone, even untracked ones: another worker may be between
+        uploading a file and registering it. Orphans of a crashed process expire remotely.
+        Returns the number deleted.
+        """
+        self.prune()
+        with self._lock: live, owned = {e["name"] for e in self.entries.values()}, set(self.owned)
+        deleted = 0
+        for f in genai.list_files():
+            if not (getattr(f, "display_name", None) or "").startswith(DISPLAY_PREFIX): continue
+            if f.name in live or f.name not in owned: continue
+            try:
+                genai.delete_file(f.name)
+                deleted += 1
+                with self._lock: self.owned.discard(f.name)
+            except Exception as e:
+                print(f"Could not delete remote file {f.name}: {e}")
+        return deleted
@@ -0,0 +1,190 @@
+import os
+import re
+import glob
+import json
+import sqlite3
+import threading
+from cache import file_stamp
+
+TERM = re.compile(r'\w+', re.UNICODE)
+AMOUNT = re.compile(r'^\(?-?[\d,]+(?:\.\d+)?\)?$')
+SNIPPET_TOKENS = 12
+
+
+def fts_query(text):
+    """ Free text as an FTS5 query: every word must appear (quoted, so no operator injection). """
+    return " ".join(f'"{t}"' for t in TERM.findall(text.lower()))
+
+
+def _amount(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool): return float(value)
+    text = str(value).strip()
+    if not AMOUNT.match(text): return None
+    number = float(text.strip('()').replace(',', ''))
+    return -number if text.startswith('(') else number
+
+
+def _note_title(text):
+    first = text.strip().split('\n', 1)[0]
+    return first.strip('*# ').strip()[:200]
+
+
+class SearchIndex:
+    """
+    Notes and note tables of every extracted report in one SQLite FTS5 index: one
+    entry per note and per note-table row (porter-stemmed), plus every numeric table
+    cell in a plain table indexed by value. Files are re-indexed only when their
+    (mtime, size) stamp changes, one (company, year) at a time in a single transaction.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._setup()
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _setup(self):
+        with self._init_lock:
+            if self._ready: return
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                with conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS documents ("
+                        " company_id TEXT, year TEXT, stamp TEXT, first_entry INTEGER, last_entry INTEGER,"
+                        " PRIMARY KEY (company_id, year))"
+                    )
+                    conn.execute(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5("
+                        " title, content, company_id UNINDEXED, year UNINDEXED, note UNINDEXED, kind UNINDEXED,"
+                        " tokenize = 'porter unicode61')"
+                    )
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS cells ("
+                        " company_id TEXT, year TEXT, note TEXT, line_item TEXT, col TEXT, value REAL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS cells_value ON cells (value)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS cells_doc ON cells (company_id, year)")
+            finally:
+                conn.close()
+            self._ready = True
+
+    # --- Writing ---
+    def index_file(self, company_id, year, path):
+        """ (Re-)indexes one extracted JSON file if it changed since it was last indexed. Returns True if it did. """
+        year = str(year)
+        stamp = file_stamp(path)
+        if stamp is None: return self.remove(company_id, year)
+        conn = self._conn()
+        row = conn.execute("SELECT stamp FROM documents WHERE company_id = ? AND year = ?", (company_id, year)).fetchone()
+        if row and row[0] == json.dumps(stamp): return False
+
+        with open(path, 'r') as f: fs = json.load(f).get("financial_statements") or {}
+        notes = fs.get("notes") if isinstance(fs.get("notes"), dict) else {}
+        tables = fs.get("note_tables") if isinstance(fs.get("note_tables"), dict) else {}
+        titles = {str(ref): _note_title(str(text)) for ref, text in notes.items()}
+
+        entries, cells = [], []
+        for ref, text in notes.items():
+            entries.append((titles[str(ref)], str(text), company_id, year, str(ref), "note"))
+        for ref, rows in tables.items():
+            ref = str(ref)
+            for row in rows if isinstance(rows, list) else []:
+                if not isinstance(row, dict): continue
+                values = list(row.values())
+                label = str(values[0]) if values else ""
+                entries.append((titles.get(ref, ""), " | ".join(f"{k}: {v}" for k, v in row.items()), company_id, year, ref, "table"))
+                for col, value in list(row.items())[1:]:
+                    number = _amount(value)
+                    if number is not None: cells.append((company_id, year, ref, label, str(col), number))
+
+        with conn:
+            self._delete(conn, company_id, year)
+            # A document's entries get consecutive rowids, so they can be deleted by range later
+            first = conn.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM entries").fetchone()[0]
+            conn.executemany("INSERT INTO entries (rowid, title, content, company_id, year, note, kind) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             [(first + i, *entry) for i, entry in enumerate(entries)])
+            conn.executemany("INSERT INTO cells (company_id, year, note, line_item, col, value) VALUES (?, ?, ?, ?, ?, ?)", cells)
+            conn.execute("INSERT INTO documents (company_id, year, stamp, first_entry, last_entry) VALUES (?, ?, ?, ?, ?)",
+                         (company_id, year, json.dumps(stamp), first, first + len(entries) - 1))
+        return True
+
+    def _delete(self, conn, company_id, year):
+        # Filtering the FTS table on an unindexed column would scan all of it: delete by rowid range instead
+        row = conn.execute("SELECT first_entry, last_entry FROM documents WHERE company_id = ? AND year = ?", (company_id, year)).fetchone()
+        if row: conn.execute("DELETE FROM entries WHERE rowid BETWEEN ? AND ?", row)
+        conn.execute("DELETE FROM cells WHERE company_id = ? AND year = ?", (company_id, year))
+        conn.execute("DELETE FROM documents WHERE company_id = ? AND year = ?", (company_id, year))
+
+    def remove(self, company_id, year):
+        conn = self._conn()
+        with conn: self._delete(conn, company_id, str(year))
+        return True
+
+    def sync(self, base_dir):
+        """ Brings the index in line with every {company}/{year}/*_extracted.json under base_dir. """
+        conn = self._conn()
+        known = set(conn.execute("SELECT company_id, year FROM documents").fetchall())
+        seen, changed = set(), 0
+        for path in glob.glob(os.path.join(base_dir, '*', '*', '*_extracted.json')):
+            year_dir = os.path.dirname(path)
+            company_id, year = os.path.basename(os.path.dirname(year_dir)), os.path.basename(year_dir)
+            seen.add((company_id, year))
+            try:
+                changed += self.index_file(company_id, year, path)
+            except Exception as e:
+                print(f"Search index error for {path}: {e}")
+        for company_id, year in known - seen:
+            self.remove(company_id, year)
+        return changed
+
+    # --- Reading ---
+    def search(self, text=None, title=None, company_id=None, year=None, note=None, kind=None, limit=50, offset=0):
+        """ Best-matching notes/table rows: words in text (and the note title), most relevant first. """
+        match = []
+        if text and fts_query(text): match.append(f"content : ({fts_query(text)})")
+        if title and fts_query(title): match.append(f"title : ({fts_query(title)})")
+        if not match: return []
+        sql = ("SELECT company_id, year, note, kind, title, snippet(entries, 1, '[', ']', '…', ?), bm25(entries)"
+               " FROM entries WHERE entries MATCH ?")
+        params = [SNIPPET_TOKENS, " AND ".join(match)]
+        for column, value in (("company_id", company_id), ("year", year), ("note", note), ("kind", kind)):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                params.append(str(value))
+        sql += " ORDER BY bm25(entries) LIMIT ? OFFSET ?"
+        rows = self._conn().execute(sql, params + [limit, offset]).fetchall()
+        keys = ("company_id", "year", "note", "kind", "title", "snippet", "score")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def cells(self, low=None, high=None, label=None, company_id=None, year=None, note=None, limit=50, offset=0):
+        """ Numeric note-table cells within [low, high], optionally by line item substring. """
+        sql, params = "SELECT company_id, year, note, line_item, col, value FROM cells WHERE 1 = 1", []
+        if low is not None:
+            sql += " AND value >= ?"
+            params.append(low)
+        if high is not None:
+            sql += " AND value <= ?"
+            params.append(high)
+        if label:
+            sql += " AND line_item LIKE ?"
+            params.append(f"%{label}%")
+        for column, value in (("company_id", company_id), ("year", year), ("note", note)):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                params.append(str(value))
+        sql += " ORDER BY ABS(value) DESC LIMIT ? OFFSET ?"
+        rows = self._conn().execute(sql, params + [limit, offset]).fetchall()
+        return [dict(zip(("company_id", "year", "note", "line_item", "column", "value"), row)) for row in rows]
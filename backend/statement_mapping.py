@@ -0,0 +1,207 @@
+import os
+import ast
+import json
+import numpy as np
+from matching import KeywordMatcher
+
+MAPPINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mappings')
+DEFAULT_TEMPLATE = 'default'
+
+
+class MappingError(Exception):
+    pass
+
+
+# --- FORMULA FUNCTIONS (all operate on whole year vectors) ---
+def _safe(base):
+    return np.where(base != 0, base, 1)
+
+def growth(x):
+    """ Year-on-year % change; 0 for the first year and where the prior year is 0. """
+    prev = np.concatenate(([0.0], x[:-1]))
+    out = np.zeros_like(x)
+    nonzero = prev != 0
+    out[nonzero] = ((x[nonzero] - prev[nonzero]) / prev[nonzero]) * 100
+    return out
+
+def pct(x, base):
+    """ x as % of base, treating a zero base as 1. """
+    return (x / _safe(base)) * 100
+
+def coalesce(x, fallback):
+    """ x where it is non-zero, otherwise fallback. """
+    return np.where(x != 0, x, fallback)
+
+FUNCTIONS = {"abs": np.abs, "growth": growth, "pct": pct, "coalesce": coalesce}
+
+BINARY_OPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+
+
+def compile_formula(source, constants):
+    """ Parses a formula such as "gross_profit + other_income + ga" into (evaluate(env), dependencies). """
+    try:
+        tree = ast.parse(source, mode='eval').body
+    except SyntaxError as e:
+        raise MappingError(f"Invalid formula {source!r}: {e}")
+    deps = set()
+
+    def build(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            value = float(node.value)
+            return lambda env: value
+        if isinstance(node, ast.Name):
+            if node.id in constants:
+                value = float(constants[node.id])
+                return lambda env: value
+            deps.add(node.id)
+            name = node.id
+            return lambda env: env[name]
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPS:
+            op, left, right = BINARY_OPS[type(node.op)], build(node.left), build(node.right)
+            return lambda env: op(left(env), right(env))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            operand = build(node.operand)
+            return lambda env: -operand(env)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+            fn, args = FUNCTIONS[node.func.id], [build(a) for a in node.args]
+            return lambda env: fn(*[a(env) for a in args])
+        raise MappingError(f"Unsupported expression in formula {source!r}: {ast.dump(node)}")
+
+    return build(tree), deps
+
+
+class Input:
+    """
+    A value looked up in one extracted statement by keyword (the n-th match when
+    occurrence is set). tb optionally holds the rule that maps trial balance accounts to it.
+    """
+
+    def __init__(self, name, statement, keywords, occurrence=None, tb=None):
+        self.name = name
+        self.statement = statement
+        self.keywords = keywords
+        self.occurrence = occurrence
+        self.tb = tb
+
+    def lookup(self, index):
+        if self.occurrence is None: return index.first(self.keywords)
+        return index.nth(self.keywords, self.occurrence)
+
+
+class Plan:
+    """
+    A compiled mapping template: the statement inputs, the derived metrics in
+    dependency order, and the output rows of each calculated statement. Built once at
+    startup; evaluating it for a company is pure vector arithmetic.
+    """
+
+    def __init__(self, name, inputs, metrics, statements):
+        self.name = name
+        self.inputs = inputs
+        self.statements = statements
+        self.order = self._sort(metrics)
+        self.formulas = {name: metrics[name][0] for name in self.order}
+        self.depends_on = {name: metrics[name][1] for name in self.order}
+        self.matcher = KeywordMatcher([k for i in inputs.values() for k in i.keywords])
+        self.downstream = self._downstream()
+
+    def _sort(self, metrics):
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done": return
+            if state.get(name) == "visiting":
+                raise MappingError(f"Circular formula: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for dep in metrics[name][1]:
+                if dep in metrics: visit(dep, path + [name])
+                elif dep not in self.inputs: raise MappingError(f"Unknown name {dep!r} in formula for {name!r}")
+            state[name] = "done"
+            order.append(name)
+
+        for name in metrics:
+            visit(name, [])
+        return order
+
+    def _downstream(self):
+        """ For every input and metric, the metrics that (transitively) depend on it, in evaluation order. """
+        reaches = {name: set() for name in list(self.inputs) + self.order}
+        for name in self.order:
+            for dep in self.depends_on[name]:
+                reaches[dep].add(name)
+        result = {}
+        for name in reaches:
+            seen, stack = set(), [name]
+            while stack:
+                for child in reaches[stack.pop()]:
+                    if child not in seen:
+                        seen.add(child)
+                        stack.append(child)
+            result[name] = [m for m in self.order if m in seen]
+        return result
+
+    def evaluate(self, columns, pins=None):
+        """
+        Computes every derived metric, in order, on top of the input columns. pins maps a
+        name to {year index: value} cells that are held at a fixed (user-entered) value.
+        """
+        pins = pins or {}
+        env = {name: _pinned(np.asarray(col, dtype=float), pins.get(name)) for name, col in columns.items()}
+        return self.recompute(env, self.order, pins)
+
+    def recompute(self, env, names, pins=None):
+        """ Re-evaluates only the given metrics (in plan order) into a copy of env. """
+        pins = pins or {}
+        env = dict(env)
+        for name in names:
+            env[name] = _pinned(np.asarray(self.formulas[name](env), dtype=float), pins.get(name))
+        return env
+
+
+def _pinned(values, cells):
+    if not cells: return values
+    values = np.array(values, dtype=float)
+    for idx, value in cells.items():
+        values[idx] = value
+    return values
+
+
+def load_template(path):
+    with open(path, 'r') as f:
+        spec = json.load(f)
+    constants = spec.get("constants", {})
+
+    inputs = {name: Input(name, d["statement"], d["keywords"], d.get("occurrence"), d.get("tb"))
+              for name, d in spec.get("inputs", {}).items()}
+    metrics = {name: compile_formula(source, constants) for name, source in spec.get("metrics", {}).items()}
+
+    statements = {}
+    for key, section in spec.get("statements", {}).items():
+        rows = []
+        for idx, row in enumerate(section["rows"]):
+            if row.get("header"):
+                rows.append({"label": row["label"], "header": True, "value": None, "percent": False})
+                continue
+            value = row.get("value")
+            if value is None:
+                # Inline lookup row: becomes an input of its own
+                value = f"{key}:{idx}"
+                inputs[value] = Input(value, row.get("statement", section.get("source")), row["keywords"], row.get("occurrence"), row.get("tb"))
+            elif value not in inputs and value not in metrics:
+                raise MappingError(f"Row {row['label']!r} refers to unknown value {value!r}")
+            elif row.get("tb"):
+                raise MappingError(f"Row {row['label']!r}: trial balance rules belong on the input {value!r}")
+            rows.append({"label": row["label"], "header": False, "value": value, "percent": bool(row.get("percent"))})
+        statements[key] = rows
+
+    return Plan(spec.get("name", os.path.splitext(os.path.basename(path))[0]), inputs, metrics, statements)
+
+
+def load_templates(folder=MAPPINGS_DIR):
+    """ Every *.json template in the mappings folder, compiled. """
+    plans = {}
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.json'):
+            plan = load_template(os.path.join(folder, name))
+            plans[plan.name] = plan
+    return plans
@@ -0,0 +1,153 @@
+import numpy as np
+from matching import KeywordMatcher
+from statement_mapping import MappingError
+
+# Trial balance headers, most specific first (compared lower-cased, by prefix)
+CODE_COLUMNS = ("account code", "acc code", "gl code", "account no", "account number", "code")
+NAME_COLUMNS = ("account name", "account description", "account title", "description", "particulars", "account", "name")
+BALANCE_COLUMNS = ("closing balance", "net balance", "balance", "net", "amount")
+DEBIT_COLUMNS = ("closing debit", "debit", "dr")
+CREDIT_COLUMNS = ("closing credit", "credit", "cr")
+
+RECONCILE_TOLERANCE = 0.005  # relative difference still treated as a match
+UNMAPPED_LIMIT = 50
+
+
+def _find_column(tb, aliases, kind):
+    names = [c["name"] for c in tb.schema if c["kind"] == kind]
+    for alias in aliases:
+        for name in names:
+            if name.strip().lower().startswith(alias): return name
+    return None
+
+
+def detect_columns(tb):
+    """ (code column, name column, debit-positive balance per row) of a stored trial balance. """
+    code = _find_column(tb, CODE_COLUMNS, "text") or _find_column(tb, CODE_COLUMNS, "number")
+    name = _find_column(tb, NAME_COLUMNS, "text")
+    debit, credit = _find_column(tb, DEBIT_COLUMNS, "number"), _find_column(tb, CREDIT_COLUMNS, "number")
+    if debit and credit:
+        balance = np.nan_to_num(np.asarray(tb.columns[debit], dtype=float)) - np.nan_to_num(np.asarray(tb.columns[credit], dtype=float))
+    else:
+        column = _find_column(tb, BALANCE_COLUMNS, "number")
+        if column is None: raise MappingError("Trial balance has no debit/credit or balance column")
+        balance = np.nan_to_num(np.asarray(tb.columns[column], dtype=float))
+    if name is None and code is None: raise MappingError("Trial balance has no account code or name column")
+    return code, name, balance
+
+
+class AccountMapper:
+    """
+    Assigns trial balance accounts to the plan inputs that carry a "tb" rule: an account
+    goes to the first rule (in template order) whose code prefixes or name keywords it
+    matches, unless an exclude keyword appears in its name. Keywords match at the start
+    of a word, so short ones ("rent") do not fire inside others ("current", "parent"). Rules are evaluated once per
+    distinct account; the per-row amounts are then summed with one bincount.
+    """
+
+    def __init__(self, plan):
+        self.rules = [
+            (name, [k.lower() for k in inp.tb.get("names", [])], [str(c) for c in inp.tb.get("codes", [])],
+             [k.lower() for k in inp.tb.get("exclude", [])], float(inp.tb.get("sign", 1)))
+            for name, inp in plan.inputs.items() if inp.tb
+        ]
+        self.names = [r[0] for r in self.rules]
+        self.signs = np.array([r[4] for r in self.rules])
+        self.matcher = KeywordMatcher([k for r in self.rules for k in r[1] + r[3]], word_start=True)
+
+    def rule_for(self, code, label):
+        found = self.matcher.match(label.lower())
+        for i, (_, names, codes, exclude, _) in enumerate(self.rules):
+            if code and any(code.startswith(c) for c in codes): return i
+            if found.intersection(names) and not found.intersection(exclude): return i
+        return -1
+
+    def map(self, tb):
+        """ {"totals": {input: amount}, "accounts", "mapped", "unmapped": [...], "unmapped_balance"} for one year. """
+        code_col, name_col, balance = detect_columns(tb)
+        codes = _as_text(tb.columns[code_col]) if code_col else np.full(tb.rows, '')
+        labels = _as_text(tb.columns[name_col]) if name_col else np.full(tb.rows, '')
+
+        accounts, inverse = np.unique(np.char.add(np.char.add(codes, '\x1f'), labels), return_inverse=True)
+        per_account = np.array([self.rule_for(*a.split('\x1f', 1)) for a in accounts.tolist()], dtype=int)
+        assigned = per_account[inverse]
+
+        mapped = assigned >= 0
+        sums = np.bincount(assigned[mapped], weights=balance[mapped], minlength=len(self.rules)) * self.signs
+
+        # Largest unmapped accounts first: these are what the template is missing
+        account_balance = np.bincount(inverse, weights=balance, minlength=len(accounts))
+        unmapped = np.flatnonzero((per_account < 0) & (account_balance != 0))
+        unmapped = unmapped[np.argsort(-np.abs(account_balance[unmapped]), kind='stable')]
+        return {
+            "totals": dict(zip(self.names, sums.tolist())),
+            "accounts": len(accounts),
+            "mapped": int((per_account >= 0).sum()),
+            "unmapped": [
+                dict(zip(("code", "name"), accounts[i].split('\x1f', 1)), balance=float(account_balance[i]))
+                for i in unmapped[:UNMAPPED_LIMIT].tolist()
+            ],
+            "unmapped_balance": float(account_balance[unmapped].sum()),
+        }
+
+
+def _as_text(values):
+    values = np.asarray(values)
+    if values.dtype.kind == 'U': return values
+    return np.array(['' if v != v else str(int(v)) if float(v).is_integer() else str(v) for v in values.tolist()])
+
+
+_mappers = {}
+
+def get_mapper(plan):
+    """ One AccountMapper per template, built on first use. """
+    if plan.name not in _mappers: _mappers[plan.name] = AccountMapper(plan)
+    return _mappers[plan.name]
+
+
+def tb_columns(years, results, plan):
+    """ Input vectors from mapped trial balances (results: {year: map()}); NaN where there is no TB or rule. """
+    mapper = get_mapper(plan)
+    return {
+        name: np.array([results[y]["totals"][name] if y in results else np.nan for y in years], dtype=float)
+        for name in mapper.names
+    }
+
+
+def apply_tb_columns(columns, tb_cols):
+    """ The extracted input columns with every TB-derived value laid over them. """
+    merged = dict(columns)
+    for name, values in tb_cols.items():
+        merged[name] = np.where(np.isnan(values), columns[name], values)
+    return merged
+
+
+def input_labels(plan):
+    labels = {name: name for name in plan.inputs}
+    for rows in plan.statements.values():
+        for row in rows:
+            if row["value"] in labels and labels[row["value"]] == row["value"]: labels[row["value"]] = row["label"]
+    return labels
+
+
+def reconcile(years, plan, tb_cols, extracted):
+    """
+    Every mapped input, year by year: the TB figure against the one extracted from the
+    report, with status "match", "mismatch", "no_tb" or "no_extraction".
+    """
+    labels = input_labels(plan)
+    lines, counts = [], {"match": 0, "mismatch": 0, "no_tb": 0, "no_extraction": 0}
+    for name, tb_values in tb_cols.items():
+        for i, year in enumerate(years):
+            tb_value, ext_value = tb_values[i], float(extracted[name][i])
+            if np.isnan(tb_value): status = "no_tb"
+            elif ext_value == 0 and tb_value != 0: status = "no_extraction"
+            elif abs(tb_value - ext_value) <= max(1.0, RECONCILE_TOLERANCE * abs(ext_value)): status = "match"
+            else: status = "mismatch"
+            counts[status] += 1
+            lines.append({
+                "input": name, "label": labels[name], "year": year, "status": status,
+                "trial_balance": None if np.isnan(tb_value) else float(tb_value), "extracted": ext_value,
+                "difference": None if np.isnan(tb_value) else float(tb_value - ext_value),
+            })
+    return {"summary": counts, "lines": lines}
@@ -0,0 +1,71 @@
+from override_journal import OverrideJournal
+
+
+def undo(journal, state):
+    seq = journal.undo_target(state)
+    return None if seq is None else journal.revert(state, seq)
+
+
+def value(state):
+    return state.template("default").get("revenue", {}).get("2023")
+
+
+def test_repeated_undo_steps_back_through_history(tmp_path):
+    journal = OverrideJournal(str(tmp_path))
+    state = journal.read()
+    for v in (1.0, 2.0, 3.0):
+        state = journal.set(state, "default", "revenue", 2023, v)
+
+    seen = []
+    while (state := undo(journal, state)) is not None:
+        seen.append(value(state))
+        if len(seen) > 5: break
+    assert seen == [2.0, 1.0, None]
+
+
+def test_undo_after_new_edit_and_reload(tmp_path):
+    journal = OverrideJournal(str(tmp_path))
+    state = journal.read()
+    for v in (1.0, 2.0, 3.0):
+        state = journal.set(state, "default", "revenue", 2023, v)
+    state = undo(journal, state)
+    state = journal.set(state, "default", "revenue", 2023, 5.0)
+
+    # Replayed from disk, as another request would see it
+    state = journal.read()
+    assert state.position == state.seq
+    state = undo(journal, state)
+    assert value(state) == 2.0
+    state = undo(journal, journal.read())
+    assert value(state) == 1.0
+
+
+def test_undo_across_snapshot(tmp_path):
+    journal = OverrideJournal(str(tmp_path), snapshot_every=2)
+    state = journal.read()
+    for v in (1.0, 2.0, 3.0):
+        state = journal.set(state, "default", "revenue", 2023, v)
+    state = undo(journal, journal.read())
+    state = undo(journal, journal.read())
+    assert value(journal.read()) == 1.0
+    assert journal.read().position == 1
+
+
+def test_compaction_keeps_undo_depth(tmp_path):
+    journal = OverrideJournal(str(tmp_path), snapshot_every=5, undo_depth=10)
+    state = journal.read()
+    for v in range(1, 41):
+        state = journal.set(state, "default", "revenue", 2023, float(v))
+
+    with open(journal.path) as f: lines = f.readlines()
+    assert len(lines) == 10 + 1
+    assert journal.oldest() == 30
+    assert value(journal.read()) == 40.0
+    assert [e["value"] for e in journal.history(3)] == [38.0, 39.0, 40.0]
+
+    # Undo walks back to the compacted first line, then stops
+    state, seen = journal.read(), []
+    while (state := undo(journal, state)) is not None:
+        seen.append(value(state))
+    assert seen == [float(v) for v in range(39, 29, -1)]
+    assert value(journal.read()) == 30.0
@@ -0,0 +1,45 @@
+import pytest
+from consolidation import get_plan
+from tb_mapping import AccountMapper
+
+
+@pytest.fixture(scope="module")
+def mapper():
+    return AccountMapper(get_plan())
+
+
+def rule(mapper, label, code=""):
+    i = mapper.rule_for(code, label)
+    return mapper.names[i] if i >= 0 else None
+
+
+@pytest.mark.parametrize("label", [
+    "Shareholders current account",
+    "Current portion of term loan",
+    "Bank - current account",
+    "Due to parent company",
+    "Office equipment",
+    "Accumulated depreciation - office equipment",
+    "General reserve",
+    "Staff gratuity provision",
+    "Salaries payable",
+])
+def test_balance_sheet_accounts_are_not_ga(mapper, label):
+    assert rule(mapper, label) != "ga"
+
+
+@pytest.mark.parametrize("label, expected", [
+    ("Salaries and wages", "ga"),
+    ("Staff costs", "ga"),
+    ("Office rent", "ga"),
+    ("Rent expense - warehouse", "ga"),
+    ("General and administrative expenses", "ga"),
+    ("Office expenses", "ga"),
+    ("Utilities", "ga"),
+    ("Depreciation - office equipment", "depreciation_pl"),
+    ("Sales - local", "revenue"),
+    ("Cost of sales", "cogs"),
+    ("Interest expense on term loan", "interest"),
+])
+def test_pl_accounts(mapper, label, expected):
+    assert rule(mapper, label) == expected
@@ -0,0 +1,281 @@
+import os
+import json
+import shutil
+import datetime
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+from cache import file_stamp
+from locks import file_lock
+
+# pandas is imported where it is used: only ingesting a new upload needs it, and it is
+# the slowest import in the app (worker start-up and memory)
+
+CHUNK_ROWS = int(os.getenv("TB_CHUNK_ROWS", 50000))
+STORE_VERSION = 1
+
+
+# --- READING (streamed in chunks of rows) ---
+def _iter_csv(path):
+    import pandas as pd
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=CHUNK_ROWS):
+        yield None, list(chunk.columns), [chunk[c].tolist() for c in chunk.columns]
+
+
+def _iter_xlsx(path):
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None: continue
+            header = list(header)
+            chunk = []
+            for row in rows:
+                if all(v is None or v == '' for v in row): continue
+                chunk.append(row)
+                if len(chunk) >= CHUNK_ROWS:
+                    yield ws.title, header, _transpose(chunk, len(header))
+                    chunk = []
+            if chunk: yield ws.title, header, _transpose(chunk, len(header))
+    finally:
+        wb.close()
+
+
+def _iter_xls(path):
+    # Legacy .xls has no streaming reader: each sheet is read whole
+    import pandas as pd
+    for title, df in pd.read_excel(path, sheet_name=None, header=0, dtype=object).items():
+        yield title, list(df.columns), [df[c].tolist() for c in df.columns]
+
+
+def _transpose(rows, width):
+    return [list(col) for col in zip(*(tuple(r[:width]) + (None,) * (width - len(r)) for r in rows))]
+
+
+def _header_names(header):
+    """ Blank and duplicate headers get pandas-style names ("Unnamed: 3", "Amount.1"). """
+    names, seen = [], {}
+    for i, h in enumerate(header):
+        name = str(h).strip() if h is not None and str(h).strip() else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def read_chunks(path):
+    """ (sheet, column names, [column values]) chunks from a CSV or Excel trial balance. """
+    ext = path.rsplit('.', 1)[-1].lower()
+    reader = {'csv': _iter_csv, 'xlsx': _iter_xlsx, 'xls': _iter_xls}.get(ext)
+    if reader is None: raise ValueError(f"Unsupported trial balance format: .{ext}")
+    for sheet, header, columns in reader(path):
+        yield sheet, _header_names(header), columns
+
+
+# --- TYPING ---
+def _cell_text(v):
+    if v is None: return ''
+    if isinstance(v, float):
+        if v != v: return ''
+        return str(int(v)) if v.is_integer() else repr(v)
+    if isinstance(v, (datetime.date, datetime.time)): return v.isoformat()
+    return str(v).strip()
+
+
+def _parse_amounts(cells):
+    """ Amount strings as floats ("1,234.50", "(200)" -> -200); NaN where not a number. """
+    import pandas as pd
+    text = cells.astype(str).str.strip().str.replace(',', '', regex=False)
+    negative = text.str.startswith('(') & text.str.endswith(')')
+    text = text.where(~negative, '-' + text.str[1:-1])
+    return pd.to_numeric(text, errors='coerce').to_numpy(dtype=float), (text == '').to_numpy()
+
+
+def _numeric_chunk(values):
+    """ The chunk as float64 (NaN for blanks), or None if any cell is not an amount. """
+    import pandas as pd
+    cells = pd.Series(values, dtype=object)
+    numbers = np.array(pd.to_numeric(cells, errors='coerce'), dtype=float)
+    # Only cells the fast path could not read go through the formatted-amount parser
+    retry = np.isnan(numbers) & ~(cells.isna() | (cells == '')).to_numpy()
+    if retry.any():
+        parsed, blank = _parse_amounts(cells[retry])
+        if (np.isnan(parsed) & ~blank).any(): return None
+        numbers[retry] = parsed
+    # Codes such as "0101" are identifiers, not amounts
+    kind = pd.api.types.infer_dtype(cells, skipna=True)
+    if kind != 'string' and 'mixed' in kind: cells = cells[[isinstance(v, str) for v in values]]
+    if kind == 'string' or 'mixed' in kind:
+        if cells.str.match(r'\s*0\d').any(): return None
+    return numbers
+
+
+def _text_chunk(values):
+    import pandas as pd
+    cells = pd.Series(values, dtype=object)
+    if pd.api.types.infer_dtype(cells, skipna=False) == 'string': return cells.str.strip().to_numpy()
+    return np.array([_cell_text(v) for v in values], dtype=object)
+
+
+class ColumnBuilder:
+    """
+    Collects one column chunk by chunk. It stays numeric (float64, NaN for blanks) while
+    every non-blank cell parses as an amount; account codes with leading zeros count
+    as text. Once a text cell shows up, the chunks so far are turned back into text.
+    """
+
+    def __init__(self, name, rows_before=0):
+        self.name = name
+        self.numeric = True
+        self.chunks = []
+        if rows_before: self.add_empty(rows_before)
+
+    def add(self, values):
+        if self.numeric:
+            numbers = _numeric_chunk(values)
+            if numbers is not None:
+                self.chunks.append(numbers)
+                return
+            self.numeric = False
+            self.chunks = [_text_chunk(chunk) for chunk in self.chunks]
+        self.chunks.append(_text_chunk(values))
+
+    def add_empty(self, n):
+        self.chunks.append(np.full(n, np.nan) if self.numeric else np.full(n, '', dtype=object))
+
+    def finish(self):
+        if self.numeric:
+            return np.concatenate(self.chunks) if self.chunks else np.zeros(0)
+        values = np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=object)
+        return values.astype(str) if len(values) else np.zeros(0, dtype='U1')
+
+
+# --- STORAGE (one memory-mappable .npy file per column) ---
+def ingest_trial_balance(source, folder):
+    """ Streams a trial balance file into a columnar store at folder and opens it. """
+    builders, rows = {}, 0
+    multi_sheet = source.lower().endswith(('.xlsx', '.xls')) and _sheet_count(source) > 1
+    for sheet, names, columns in read_chunks(source):
+        n = len(columns[0]) if columns else 0
+        if not n: continue
+        if multi_sheet: names, columns = ["Sheet"] + names, [[sheet] * n] + columns
+        for name, values in zip(names, columns):
+            if name not in builders: builders[name] = ColumnBuilder(name, rows)
+            builders[name].add(values)
+        for name, builder in builders.items():
+            if name not in names: builder.add_empty(n)
+        rows += n
+
+    parent, name = os.path.split(folder)
+    os.makedirs(parent or '.', exist_ok=True)
+    tmp_folder = tempfile.mkdtemp(prefix=f"{name}.tmp-", dir=parent or None)
+    schema = {"version": STORE_VERSION, "source": list(file_stamp(source)), "rows": rows, "columns": []}
+    for i, builder in enumerate(builders.values()):
+        np.save(os.path.join(tmp_folder, f"c{i}.npy"), builder.finish())
+        schema["columns"].append({"name": builder.name, "kind": "number" if builder.numeric else "text", "file": f"c{i}.npy"})
+    with open(os.path.join(tmp_folder, 'schema.json'), 'w') as f: json.dump(schema, f)
+    # Move the old store aside first, so the new one appears in a single rename
+    old_folder = None
+    if os.path.exists(folder):
+        old_folder = tempfile.mkdtemp(prefix=f"{name}.old-", dir=parent or None)
+        os.replace(folder, os.path.join(old_folder, name))
+    os.replace(tmp_folder, folder)
+    if old_folder: shutil.rmtree(old_folder, ignore_errors=True)
+    return TrialBalance(folder)
+
+
+_ingest_locks = {}
+_ingest_locks_guard = threading.Lock()
+
+@contextmanager
+def _ingest_lock(folder):
+    """ One ingest per store at a time: across threads, and across processes where flock exists. """
+    with _ingest_locks_guard: lock = _ingest_locks.setdefault(os.path.abspath(folder), threading.Lock())
+    with lock, file_lock(f"{folder}.lock"):
+        yield
+
+
+def _sheet_count(path):
+    if path.lower().endswith('.xls'):
+        import pandas as pd
+        return len(pd.ExcelFile(path).sheet_names)
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try: return len(wb.sheetnames)
+    finally: wb.close()
+
+
+def _open_current(source, folder):
+    try:
+        with open(os.path.join(folder, 'schema.json'), 'r') as f: schema = json.load(f)
+        if schema.get("version") == STORE_VERSION and tuple(schema["source"]) == file_stamp(source):
+            return TrialBalance(folder, schema)
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def load_trial_balance(source, folder):
+    """ The stored trial balance for source, re-ingested if the source file changed since. """
+    tb = _open_current(source, folder)
+    if tb is not None: return tb
+    with _ingest_lock(folder):
+        # Another request may have ingested it while this one waited
+        return _open_current(source, folder) or ingest_trial_balance(source, folder)
+
+
+class TrialBalance:
+    """ A stored trial balance: typed columns memory-mapped from disk, read a page at a time. """
+
+    def __init__(self, folder, schema=None):
+        if schema is None:
+            with open(os.path.join(folder, 'schema.json'), 'r') as f: schema = json.load(f)
+        self.folder = folder
+        self.rows = schema["rows"]
+        self.schema = schema["columns"]
+        self.columns = {c["name"]: np.load(os.path.join(folder, c["file"]), mmap_mode='r') for c in self.schema}
+        self.kinds = {c["name"]: c["kind"] for c in self.schema}
+
+    def info(self):
+        return {"rows": self.rows, "columns": [{"name": c["name"], "kind": c["kind"]} for c in self.schema]}
+
+    def _cells(self, name, idx):
+        values = self.columns[name][idx]
+        if self.kinds[name] == "text": return values.tolist()
+        return [None if v != v else v for v in values.tolist()]
+
+    def page(self, offset=0, limit=100, sort=None, descending=False):
+        """ Rows [offset, offset + limit) as lists, optionally ordered by one column (blanks last). """
+        if sort is None:
+            idx = slice(offset, offset + limit)
+        else:
+            values = np.asarray(self.columns[sort])
+            order = np.argsort(values, kind='stable')
+            blanks = np.isnan(values[order]) if self.kinds[sort] == "number" else values[order] == ''
+            filled = order[~blanks]
+            idx = np.concatenate((filled[::-1] if descending else filled, order[blanks]))[offset:offset + limit]
+        cells = [self._cells(c["name"], idx) for c in self.schema]
+        return [list(row) for row in zip(*cells)]
+
+    def aggregate(self, by=None, values=None):
+        """ Count and sum of numeric columns, in total or per distinct value of one column. """
+        values = values or [c["name"] for c in self.schema if c["kind"] == "number" and c["name"] != by]
+        sums = {v: np.nan_to_num(np.asarray(self.columns[v], dtype=float)) for v in values}
+        totals = {"count": self.rows, **{v: float(s.sum()) for v, s in sums.items()}}
+        if by is None: return {"totals": totals}
+
+        keys, inverse = np.unique(np.asarray(self.columns[by]), return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        per_key = {v: np.bincount(inverse, weights=s, minlength=len(keys)) for v, s in sums.items()}
+        groups = [
+            {"key": None if self.kinds[by] == "number" and k != k else k.item(), "count": int(counts[i]),
+             **{v: float(per_key[v][i]) for v in values}}
+            for i, k in enumerate(keys)
+        ]
+        return {"by": by, "groups": groups, "totals": totals}
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+from locks import file_lock
+
+BLOCK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 500 * 1024 ** 2))
+
+PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+PAGE_TAIL = 32 # bytes carried between blocks so a page marker split across blocks is still seen whole
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    pass
+
+
+class UploadSink:
+    """
+    Writes an upload to disk block by block while hashing it, counting bytes against
+    the size limit and, for PDFs, counting page objects. Nothing is buffered beyond
+    one block.
+    """
+
+    def __init__(self, path, ext, max_bytes=MAX_UPLOAD_BYTES, append=False):
+        self.path = path
+        self.ext = ext
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.pages = 0
+        self._tail = b""
+        if append and os.path.exists(path):
+            # Resuming without the in-memory state: re-hash what is already on disk
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                    self._consume(block)
+        else:
+            open(path, 'wb').close()
+
+    def _consume(self, block):
+        if self.size == 0 and self.ext == 'pdf' and not block.startswith(b"%PDF-"):
+            raise UploadError("File is not a PDF")
+        if self.size + len(block) > self.max_bytes:
+            raise UploadError(f"File exceeds the {self.max_bytes} byte limit")
+        self.size += len(block)
+        self.sha256.update(block)
+        if self.ext == 'pdf':
+            # Matches starting in the last few bytes are left for the next block to decide
+            window = self._tail + block
+            cut = max(len(window) - PAGE_TAIL, 0)
+            self.pages += sum(1 for m in PAGE_PATTERN.finditer(window) if m.start() < cut)
+            self._tail = window[cut:]
+
+    def write_stream(self, stream):
+        with open(self.path, 'ab') as f:
+            for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                self._consume(block)
+                f.write(block)
+        return self.size
+
+    def meta(self):
+        pages = self.pages + len(PAGE_PATTERN.findall(self._tail))
+        if self.ext == 'pdf' and pages == 0:
+            # Page objects hidden in compressed object streams: fall back to the xref
+            from pypdf import PdfReader
+            try: pages = len(PdfReader(self.path).pages)
+            except Exception: pages = None
+        return {"sha256": self.sha256.hexdigest(), "size": self.size, "pages": pages if self.ext == 'pdf' else None}
+
+
+# --- FILE METADATA SIDECARS ---
+def _meta_path(path):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.meta.json")
+
+def write_file_meta(path, meta):
+    st = os.stat(path)
+    with open(_meta_path(path), 'w') as f:
+        json.dump({**meta, "mtime": st.st_mtime}, f)
+
+def read_file_meta(path):
+    """ Metadata recorded at upload time, or None if the file changed since. """
+    try:
+        with open(_meta_path(path), 'r') as f: meta = json.load(f)
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if meta.get("size") != st.st_size or meta.get("mtime") != st.st_mtime:
+        return None
+    return meta
+
+def content_hash(path):
+    """ SHA-256 of a stored file, from the upload sidecar when available. """
+    meta = read_file_meta(path)
+    if meta: return meta["sha256"]
+    sink = UploadSink(path, None, max_bytes=float('inf'), append=True)
+    write_file_meta(path, sink.meta())
+    return sink.sha256.hexdigest()
+
+def save_upload(stream, dest_path, ext):
+    """ Streams into dest_path via a temp file, recording hash/size/pages alongside it. """
+    tmp = f"{dest_path}.{uuid.uuid4().hex}.part"
+    try:
+        sink = UploadSink(tmp, ext)
+        sink.write_stream(stream)
+        meta = sink.meta()
+        os.replace(tmp, dest_path)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    write_file_meta(dest_path, meta)
+    return meta
+
+
+# --- RESUMABLE UPLOAD SESSIONS ---
+class UploadSessions:
+    """
+    Chunked uploads that survive dropped connections. Session state lives in a small
+    JSON file next to the partial upload; the hashing state is kept in memory and
+    rebuilt from the partial file if the process restarted in between. Chunks of one
+    upload are written one at a time, across threads and processes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._sinks = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """ Holds the upload's thread lock and a file lock next to its partial file. """
+        with self._lock:
+            lock = self._locks.setdefault(upload_id, threading.Lock())
+        with lock, file_lock(f"{self._part_path(upload_id)}.lock"):
+            yield
+
+    def create(self, target_path, ext, total_size=None):
+        if total_size is not None and (isinstance(total_size, bool) or not isinstance(total_size, int) or total_size < 0):
+            raise UploadError("size must be a non-negative integer")
+        if total_size is not None and total_size > MAX_UPLOAD_BYTES:
+            raise UploadError(f"File exceeds the {MAX_UPLOAD_BYTES} byte limit")
+        os.makedirs(self.root, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        state = {"upload_id": upload_id, "target": target_path, "ext": ext, "total_size": total_size, "offset": 0}
+        with self._lock:
+            self._sinks[upload_id] = UploadSink(self._part_path(upload_id), ext)
+        self._save_state(state)
+        return state
+
+    def get(self, upload_id):
+        try:
+            with open(self._state_path(upload_id), 'r') as f: return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        with open(self._state_path(state["upload_id"]), 'w') as f:
+            json.dump(state, f)
+
+    def _sink(self, state):
+        upload_id = state["upload_id"]
+        with self._lock:
+            sink = self._sinks.get(upload_id)
+            part = self._part_path(upload_id)
+            if sink is None or not os.path.exists(part) or sink.size != os.path.getsize(part):
+                sink = UploadSink(self._part_path(upload_id), state["ext"], append=True)
+                self._sinks[upload_id] = sink
+            return sink
+
+    def append(self, state, offset, stream):
+        """ Appends one chunk. The client must send it at the current offset. """
+        with self._locked(state["upload_id"]):
+            if not os.path.exists(self._state_path(state["upload_id"])):
+                raise UploadError("Upload was completed or aborted")
+            sink = self._sink(state)
+            state["offset"] = sink.size
+            if offset != sink.size:
+                raise OffsetMismatch(f"Expected offset {sink.size}")
+            try:
+                sink.write_stream(stream)
+            finally:
+                state["offset"] = sink.size
+                self._save_state(state)
+        return state
+
+    def complete(self, state):
+        upload_id = state["upload_id"]
+        with self._locked(upload_id):
+            sink = self._sink(state)
+            if state["total_size"] is not None and sink.size != state["total_size"]:
+                raise UploadError(f"Received {sink.size} of {state['total_size']} bytes")
+            meta = sink.meta()
+            os.replace(self._part_path(upload_id), state["target"])
+            write_file_meta(state["target"], meta)
+            self.abort(upload_id)
+        return meta
+
+    def abort(self, upload_id):
+        with self._lock:
+            self._sinks.pop(upload_id, None)
+            self._locks.pop(upload_id, None)
+        for path in (self._state_path(upload_id), self._part_path(upload_id), f"{self._part_path(upload_id)}.lock"):
+            if os.path.exists(path): os.remove(path)
@@ -0,0 +1,242 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+MC_CHUNK = int(os.getenv("MC_CHUNK", 50000))  # draws evaluated at once; bounds peak memory
+MC_MAX_DRAWS = int(os.getenv("MC_MAX_DRAWS", 2000000))
+VALUATION_WORKERS = int(os.getenv("VALUATION_WORKERS", 1))
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+HISTOGRAM_BINS = 40
+HISTORY_YEARS = 3  # recent years averaged for the default ratios
+
+IS, BS, CF = "calculated_income_statement", "calculated_balance_sheet", "calculated_cash_flow"
+
+# Consolidated rows the valuation reads: field -> [(statement, row label, sign)], matching rows summed
+MODEL_ROWS = {
+    "revenue": [(IS, "Revenue from Operations", 1)],
+    "ebitda": [(IS, "EBITDA", 1)],
+    "da": [(IS, "Depreciation", 1), (IS, "Amortization", 1)],
+    "capex": [(CF, "Purchase of property and equipment", -1)],
+    "working_capital": [(BS, "Inventories", 1), (BS, "Trade and other receivables", 1), (BS, "Trade and other payables", -1)],
+    "net_debt": [(BS, "Bank borrowings", 1), (BS, "Cash and cash equivalents", -1)],
+}
+
+ASSUMPTIONS = ("horizon", "base_revenue", "revenue_growth", "ebitda_margin", "da_pct", "capex_pct",
+               "nwc_pct", "tax_rate", "wacc", "terminal_growth", "net_debt")
+# Drawn per simulation in the Monte Carlo run unless the request says otherwise (normal, by sd)
+DEFAULT_SPREAD = {"revenue_growth": {"sd": 0.03}, "ebitda_margin": {"sd": 0.02},
+                  "wacc": {"sd": 0.01}, "terminal_growth": {"sd": 0.005}}
+DEFAULTS = {"horizon": 5, "tax_rate": 0.09, "wacc": 0.12, "terminal_growth": 0.03}
+
+
+class ValuationError(Exception):
+    pass
+
+
+# --- HISTORY (from the consolidated model) ---
+def history(model):
+    """ {field: year vector} summed from the consolidated statements (see MODEL_ROWS). """
+    years = model["years"]
+    out = {}
+    for field, rows in MODEL_ROWS.items():
+        total = np.zeros(len(years))
+        for statement, label, sign in rows:
+            for row in model.get(statement, []):
+                if row.get("is_header") or row["line_item"].strip().lower() != label.lower(): continue
+                total += sign * np.array([float(row.get(y) or 0) for y in years])
+        out[field] = total
+    return out
+
+
+def _recent_ratio(values, revenue):
+    valid = np.flatnonzero(revenue > 0)[-HISTORY_YEARS:]
+    return float(np.mean(values[valid] / revenue[valid])) if len(valid) else 0.0
+
+
+def default_assumptions(hist):
+    """ Projection assumptions from the historical figures: recent ratios and revenue CAGR. """
+    revenue = hist["revenue"]
+    positive = np.flatnonzero(revenue > 0)
+    if not len(positive): raise ValuationError("No historical revenue to project from")
+    first, last = positive[0], positive[-1]
+    growth = (revenue[last] / revenue[first]) ** (1 / (last - first)) - 1 if last > first else 0.0
+    return {
+        **DEFAULTS,
+        "base_revenue": float(revenue[last]),
+        "revenue_growth": float(np.clip(growth, -0.5, 1.0)),
+        "ebitda_margin": _recent_ratio(hist["ebitda"], revenue),
+        "da_pct": _recent_ratio(hist["da"], revenue),
+        "capex_pct": _recent_ratio(np.abs(hist["capex"]), revenue),
+        "nwc_pct": float(hist["working_capital"][last] / revenue[last]),
+        "net_debt": float(hist["net_debt"][last]),
+    }
+
+
+def _number(value, what):
+    """ value as a finite float, or a ValuationError naming what it is. """
+    try: value = float(value)
+    except (TypeError, ValueError): raise ValuationError(f"{what} must be a number")
+    if not np.isfinite(value): raise ValuationError(f"{what} must be finite")
+    return value
+
+
+def merge_assumptions(defaults, overrides):
+    if overrides is not None and not isinstance(overrides, dict): raise ValuationError("Assumptions must be an object")
+    unknown = set(overrides or {}) - set(ASSUMPTIONS)
+    if unknown: raise ValuationError(f"Unknown assumptions: {', '.join(sorted(unknown))}")
+    merged = {k: _number(v, k) for k, v in {**defaults, **(overrides or {})}.items()}
+    merged["horizon"] = int(merged["horizon"])
+    if not 1 <= merged["horizon"] <= 30: raise ValuationError("horizon must be between 1 and 30 years")
+    return merged
+
+
+# --- ENGINE (every parameter may be a vector: one entry per scenario) ---
+def project(a, n=1):
+    """
+    Free cash flow projection and DCF for n scenarios at once. a maps assumption names
+    to scalars or (n,) arrays. Returns (equity value (n,), per-year arrays (n, horizon)).
+    """
+    col = lambda name: np.broadcast_to(np.asarray(a[name], dtype=float), (n,))[:, None]
+    g, margin, wacc, tg = col("revenue_growth"), col("ebitda_margin"), col("wacc"), col("terminal_growth")
+    t = np.arange(1, int(a["horizon"]) + 1)
+
+    # Degenerate inputs (growth of -100%, WACC of -100%, overflow) give inf/nan, reported as None
+    with np.errstate(all='ignore'):
+        revenue = col("base_revenue") * (1 + g) ** t
+        previous = revenue / (1 + g)
+        ebitda = revenue * margin
+        da = revenue * col("da_pct")
+        nopat = (ebitda - da) * (1 - col("tax_rate"))
+        fcf = nopat + da - revenue * col("capex_pct") - col("nwc_pct") * (revenue - previous)
+
+        discount = (1 + wacc) ** -t
+        terminal = np.where(wacc > tg, fcf[:, -1:] * (1 + tg) / (wacc - tg), np.nan)
+        ev = (fcf * discount).sum(axis=1) + terminal[:, 0] * discount[:, -1]
+        equity = ev - col("net_debt")[:, 0]
+    return equity, {"revenue": revenue, "ebitda": ebitda, "fcf": fcf, "discount": discount, "terminal": terminal[:, 0], "ev": ev}
+
+
+def dcf(a):
+    """ The base case: yearly projection, enterprise and equity value. """
+    equity, p = project(a)
+    rows = {k: [_num(v) for v in p[k][0]] for k in ("revenue", "ebitda", "fcf", "discount")}
+    return {
+        "projection": [{"year": i + 1, **{k: v[i] for k, v in rows.items()}} for i in range(a["horizon"])],
+        "terminal_value": _num(p["terminal"][0]),
+        "enterprise_value": _num(p["ev"][0]),
+        "equity_value": _num(equity[0]),
+    }
+
+
+def sensitivity(a, rows, cols):
+    """ Equity value over a grid of two assumptions: rows/cols are {"name", "values"}. """
+    if not isinstance(rows, dict) or not isinstance(cols, dict): raise ValuationError("Sensitivity needs rows and cols")
+    for axis in (rows, cols):
+        if not isinstance(axis, dict) or not isinstance(axis.get("values"), list): raise ValuationError("Sensitivity axes need a name and a list of values")
+        if axis.get("name") not in ASSUMPTIONS or axis["name"] == "horizon": raise ValuationError(f"Cannot vary {axis.get('name')!r}")
+    try:
+        r, c = np.asarray(rows["values"], dtype=float), np.asarray(cols["values"], dtype=float)
+    except (TypeError, ValueError):
+        raise ValuationError("Sensitivity values must be numbers")
+    grid = {**a, rows["name"]: np.repeat(r, len(c)), cols["name"]: np.tile(c, len(r))}
+    equity, _ = project(grid, len(r) * len(c))
+    return {"rows": rows, "cols": cols, "equity_value": [[_num(v) for v in line] for line in equity.reshape(len(r), len(c))]}
+
+
+# --- MONTE CARLO ---
+def _draw(rng, base, spec, n):
+    if "sd" in spec: return rng.normal(base, spec["sd"], n)
+    if "mode" in spec: return rng.triangular(spec["low"], spec["mode"], spec["high"], n)
+    return rng.uniform(spec["low"], spec["high"], n)
+
+
+def _mc_chunk(a, spread, n, seed):
+    """ Equity values for n draws. Top-level so process pool workers can run it. """
+    rng = np.random.default_rng(seed)
+    drawn = {**a, **{name: _draw(rng, a[name], spec, n) for name, spec in spread.items()}}
+    return project(drawn, n)[0]
+
+
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=VALUATION_WORKERS)
+    return _pool
+
+
+def monte_carlo(a, draws=100000, spread=None, seed=None, workers=VALUATION_WORKERS):
+    """
+    Equity value distribution over random draws of the spread assumptions. Draws are
+    evaluated MC_CHUNK at a time, each chunk with its own seed from one SeedSequence,
+    so results for a seed are the same whether chunks run here or across a process pool.
+    """
+    try: draws = int(draws)
+    except (TypeError, ValueError, OverflowError): raise ValuationError("draws must be a number")
+    if not 1 <= draws <= MC_MAX_DRAWS: raise ValuationError(f"draws must be between 1 and {MC_MAX_DRAWS}")
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0): raise ValuationError("seed must be a non-negative integer")
+    spread = _check_spread(DEFAULT_SPREAD if spread is None else spread)
+
+    sizes = [min(MC_CHUNK, draws - s) for s in range(0, draws, MC_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers > 1 and len(sizes) > 1:
+        chunks = list(_get_pool().map(_mc_chunk, [a] * len(sizes), [spread] * len(sizes), sizes, seeds))
+    else:
+        chunks = [_mc_chunk(a, spread, n, s) for n, s in zip(sizes, seeds)]
+    values = np.concatenate(chunks)
+
+    valid = values[np.isfinite(values)]
+    if not len(valid): raise ValuationError("No draw produced a finite value (WACC at or below terminal growth?)")
+    with np.errstate(over='ignore', invalid='ignore'):
+        try: counts, edges = np.histogram(valid, bins=HISTOGRAM_BINS)
+        except ValueError: raise ValuationError("Simulated values are too large to summarize")
+        mean, std = valid.mean(), valid.std()
+    return {
+        "draws": draws,
+        "invalid": int(draws - len(valid)),
+        "mean": _num(mean),
+        "std": _num(std),
+        "percentiles": dict(zip((f"p{p}" for p in PERCENTILES), [_num(v) for v in np.percentile(valid, PERCENTILES)])),
+        "probability_negative": float((valid < 0).mean()),
+        "histogram": {"counts": counts.tolist(), "edges": [_num(v) for v in edges]},
+    }
+
+
+def _check_spread(spread):
+    """ The spread with every parameter a finite float; ValuationError for anything numpy would reject. """
+    if not isinstance(spread, dict): raise ValuationError("spread must be an object")
+    checked = {}
+    for name, spec in spread.items():
+        if name not in ASSUMPTIONS or name == "horizon": raise ValuationError(f"Cannot vary {name!r}")
+        if not isinstance(spec, dict) or not ("sd" in spec or {"low", "high"} <= set(spec)):
+            raise ValuationError(f"Spread for {name!r} needs sd, or low and high")
+        spec = {k: _number(spec[k], f"{name} {k}") for k in ("sd", "low", "mode", "high") if k in spec}
+        if spec.get("sd", 0) < 0: raise ValuationError(f"{name} sd must not be negative")
+        if "sd" not in spec and not (spec["low"] <= spec.get("mode", spec["low"]) <= spec["high"] and spec["low"] < spec["high"]):
+            raise ValuationError(f"Spread for {name!r} needs low < high, with low <= mode <= high")
+        checked[name] = spec
+    return checked
+
+
+def _num(v):
+    return None if not np.isfinite(v) else float(v)
+
+
+def value_company(model, assumptions=None, sensitivity_spec=None, monte_carlo_spec=None):
+    """ DCF for a consolidated model, plus an optional sensitivity grid and Monte Carlo run. """
+    hist = history(model)
+    a = merge_assumptions(default_assumptions(hist), assumptions)
+    result = {
+        "years": model["years"],
+        "history": {k: [_num(x) for x in v] for k, v in hist.items()},
+        "assumptions": a,
+        "dcf": dcf(a),
+    }
+    if sensitivity_spec:
+        if not isinstance(sensitivity_spec, dict): raise ValuationError("sensitivity must be an object")
+        result["sensitivity"] = sensitivity(a, sensitivity_spec.get("rows"), sensitivity_spec.get("cols"))
+    if monte_carlo_spec:
+        spec = monte_carlo_spec if isinstance(monte_carlo_spec, dict) else {}
+        result["monte_carlo"] = monte_carlo(a, spec.get("draws", 100000), spec.get("spread"), spec.get("seed"))
+    return result
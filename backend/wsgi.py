@@ -0,0 +1,6 @@
+""" Production entry point: gunicorn -c gunicorn.conf.py (see there for workers and threads). """
+from app import create_app, preload
+
+preload()
+# Background threads are started per worker, after the fork (gunicorn.conf.py post_fork)
+app = create_app(background=False)
@@ -7,15 +7,137 @@ import * as XLSX from 'xlsx';
 
 const API_URL = 'http://localhost:5000';
 
+// Extraction runs as a background job on the server: poll until the result is ready
+// (short first delays so cache hits come back almost instantly)
+const waitForJob = async (jobId, onProgress) => {
+  let delay = 250;
+  while (true) {
+    const { data: job } = await axios.get(`${API_URL}/jobs/${jobId}`);
+    if (job.status === 'done') return (await axios.get(`${API_URL}/jobs/${jobId}/result`)).data;
+    if (job.status === 'failed') throw new Error(job.error);
+    if (onProgress) onProgress(job);
+    await new Promise(resolve => setTimeout(resolve, delay));
+    delay = Math.min(delay * 2, 2000);
+  }
+};
+
+// Live progress over server-sent events (stages, pages scanned, uploads, parsed statements).
+// EventSource reconnects on its own; polling takes over only if the stream is refused.
+const watchJob = (jobId, onEvent) => new Promise((resolve, reject) => {
+  const source = new EventSource(`${API_URL}/jobs/${jobId}/events`);
+  let finished = false;
+  ['stage', 'pages', 'upload', 'section'].forEach(name =>
+    source.addEventListener(name, e => onEvent(name, JSON.parse(e.data))));
+  source.addEventListener('done', () => {
+    finished = true;
+    source.close();
+    axios.get(`${API_URL}/jobs/${jobId}/result`).then(res => resolve(res.data), reject);
+  });
+  source.addEventListener('failed', e => {
+    finished = true;
+    source.close();
+    reject(new Error(JSON.parse(e.data).error));
+  });
+  source.onerror = () => {
+    if (!finished && source.readyState === EventSource.CLOSED) waitForJob(jobId).then(resolve, reject);
+  };
+});
+
+const describeProgress = (event, data) => {
+  const label = text => text.replace(/_/g, ' ');
+  if (event === 'stage') return label(data.stage);
+  if (event === 'pages') return `scanned ${data.done}/${data.total} pages`;
+  if (event === 'upload') return `${data.section ? label(data.section) + ': ' : ''}${data.state}`;
+  return `parsed ${label(data.key)}`;
+};
+
 // ==========================================
 // 1. EXTRACTION VIEWER COMPONENT
 // ==========================================
-const ExtractionViewer = ({ data, year, onBack }) => {
+// Trial balances can run to 100k+ rows: the server keeps them as typed columns and sends one page at a time
+const TB_PAGE_SIZE = 100;
+
+const TrialBalanceTable = ({ companyId, year }) => {
+  const [page, setPage] = useState(null);
+  const [totals, setTotals] = useState(null);
+  const [offset, setOffset] = useState(0);
+  const [sort, setSort] = useState({ column: null, desc: false });
+  const [missing, setMissing] = useState(false);
+
+  useEffect(() => {
+    const params = { offset, limit: TB_PAGE_SIZE };
+    if (sort.column) { params.sort = sort.column; params.desc = sort.desc ? 1 : 0; }
+    axios.get(`${API_URL}/project/${companyId}/trial_balance/${year}`, { params })
+      .then(res => setPage(res.data))
+      .catch(() => setMissing(true));
+  }, [companyId, year, offset, sort]);
+
+  useEffect(() => {
+    axios.get(`${API_URL}/project/${companyId}/trial_balance/${year}/aggregate`)
+      .then(res => setTotals(res.data.totals))
+      .catch(() => setTotals(null));
+  }, [companyId, year]);
+
+  const toggleSort = (column) => {
+    setSort(s => ({ column, desc: s.column === column ? !s.desc : false }));
+    setOffset(0);
+  };
+
+  if (missing || (page && page.rows === 0)) return (
+    <div className="flex flex-col items-center justify-center h-full text-gray-400 space-y-2">
+      <span className="text-4xl">📊</span>
+      <p className="italic">No Trial Balance data found for this period.</p>
+    </div>
+  );
+  if (!page) return <div className="p-8 text-center text-gray-400 animate-pulse">Loading trial balance...</div>;
+
+  const formatCell = (v, kind) => kind === 'number' && v !== null ? v.toLocaleString() : v;
+
+  return (
+    <div className="space-y-3">
+      <div className="overflow-x-auto border rounded-lg shadow-sm">
+        <table className="min-w-full text-xs">
+          <thead className="bg-gray-100 text-gray-700">
+            <tr>{page.columns.map(c => (
+              <th key={c.name} onClick={() => toggleSort(c.name)} className={`px-4 py-3 font-semibold border-b cursor-pointer hover:bg-gray-200 ${c.kind === 'number' ? 'text-right' : 'text-left'}`}>
+                {c.name}{sort.column === c.name ? (sort.desc ? ' ▼' : ' ▲') : ''}
+              </th>
+            ))}</tr>
+          </thead>
+          <tbody className="divide-y divide-gray-200">
+            {page.data.map((row, i) => (
+              <tr key={offset + i} className="hover:bg-gray-50 transition-colors">
+                {row.map((v, j) => <td key={j} className={`px-4 py-2 truncate max-w-[200px] ${page.columns[j].kind === 'number' ? 'text-right font-mono' : ''}`}>{formatCell(v, page.columns[j].kind)}</td>)}
+              </tr>
+            ))}
+          </tbody>
+          {totals && (
+            <tfoot className="bg-gray-50 font-bold text-gray-700">
+              <tr>{page.columns.map((c, j) => (
+                <td key={c.name} className={`px-4 py-2 border-t ${c.kind === 'number' ? 'text-right font-mono' : ''}`}>
+                  {j === 0 ? 'Total' : (c.kind === 'number' && totals[c.name] !== undefined ? totals[c.name].toLocaleString() : '')}
+                </td>
+              ))}</tr>
+            </tfoot>
+          )}
+        </table>
+      </div>
+      <div className="flex justify-between items-center text-xs text-gray-500">
+        <span>Rows {offset + 1}–{Math.min(offset + TB_PAGE_SIZE, page.rows)} of {page.rows.toLocaleString()}</span>
+        <div className="flex gap-2">
+          <button disabled={offset === 0} onClick={() => setOffset(o => Math.max(o - TB_PAGE_SIZE, 0))} className="px-3 py-1 border rounded disabled:opacity-40 hover:bg-gray-50">← Prev</button>
+          <button disabled={offset + TB_PAGE_SIZE >= page.rows} onClick={() => setOffset(o => o + TB_PAGE_SIZE)} className="px-3 py-1 border rounded disabled:opacity-40 hover:bg-gray-50">Next →</button>
+        </div>
+      </div>
+    </div>
+  );
+};
+
+const ExtractionViewer = ({ companyId, data, year, onBack }) => {
   const [activeTab, setActiveTab] = useState('statement_of_financial_position');
   const [activeNote, setActiveNote] = useState(null);
 
   const fsData = data.financial_statements || {};
-  const tbData = data.trial_balance || [];
   const notes = fsData.notes || {};
 
   const handleNoteClick = (noteRef) => {
@@ -96,27 +218,7 @@ const ExtractionViewer = ({ data, year, onBack }) => {
 
         <div className="flex-1 overflow-y-auto p-6 scroll-smooth">
           {activeTab === 'trial_balance' ? (
-             tbData.length > 0 ? (
-               <div className="overflow-x-auto border rounded-lg shadow-sm">
-                 <table className="min-w-full text-xs">
-                   <thead className="bg-gray-100 text-gray-700">
-                     <tr>{Object.keys(tbData[0]).map((k, i) => <th key={i} className="px-4 py-3 text-left font-semibold border-b">{k}</th>)}</tr>
-                   </thead>
-                   <tbody className="divide-y divide-gray-200">
-                     {tbData.map((row, i) => (
-                       <tr key={i} className="hover:bg-gray-50 transition-colors">
-                         {Object.values(row).map((v, j) => <td key={j} className="px-4 py-2 truncate max-w-[200px]">{v}</td>)}
-                       </tr>
-                     ))}
-                   </tbody>
-                 </table>
-               </div>
-             ) : (
-               <div className="flex flex-col items-center justify-center h-full text-gray-400 space-y-2">
-                 <span className="text-4xl">📊</span>
-                 <p className="italic">No Trial Balance data found for this period.</p>
-               </div>
-             )
+            <TrialBalanceTable companyId={companyId} year={year} />
           ) : renderStatementTable(fsData[activeTab])}
         </div>
       </div>
@@ -155,6 +257,89 @@ const ExtractionViewer = ({ data, year, onBack }) => {
   );
 };
 
+// Valuation runs on the server (vectorized DCF + Monte Carlo), fast enough to re-run on every change of assumption
+const VALUATION_INPUTS = [
+  ['wacc', 'WACC'], ['terminal_growth', 'Terminal Growth'], ['revenue_growth', 'Revenue Growth'], ['ebitda_margin', 'EBITDA Margin'],
+];
+const fmt = v => (v === null || v === undefined) ? '—' : v.toLocaleString(undefined, { maximumFractionDigits: 0 });
+const pct = v => `${(v * 100).toFixed(1)}%`;
+
+const ValuationPanel = ({ companyId }) => {
+  const [overrides, setOverrides] = useState({});
+  const [result, setResult] = useState(null);
+  const [running, setRunning] = useState(false);
+
+  const run = (assumptions) => {
+    setRunning(true);
+    const base = result ? { ...result.assumptions, ...assumptions } : null;
+    const around = (name, step) => base ? [-2, -1, 0, 1, 2].map(i => +(base[name] + i * step).toFixed(4)) : [0.10, 0.11, 0.12, 0.13, 0.14];
+    axios.post(`${API_URL}/valuation`, {
+      company_id: companyId,
+      assumptions,
+      sensitivity: { rows: { name: 'wacc', values: around('wacc', 0.01) }, cols: { name: 'terminal_growth', values: base ? around('terminal_growth', 0.005) : [0.02, 0.025, 0.03, 0.035, 0.04] } },
+      monte_carlo: { draws: 100000, seed: 1 },
+    })
+      .then(res => setResult(res.data))
+      .catch(err => alert(err.response?.data?.error || "Valuation failed"))
+      .finally(() => setRunning(false));
+  };
+
+  useEffect(() => { run({}); }, [companyId]);
+
+  const handleChange = (name, value) => {
+    const num = parseFloat(value.replace('%', '')) / 100;
+    if (isNaN(num) || (result && num === result.assumptions[name])) return;
+    const next = { ...overrides, [name]: num };
+    setOverrides(next);
+    run(next);
+  };
+
+  if (!result) return <div className="p-8 text-purple-600 font-medium animate-pulse">Valuing...</div>;
+  const mc = result.monte_carlo, grid = result.sensitivity;
+
+  return (
+    <div className="space-y-6">
+      <div className="grid grid-cols-4 gap-4">
+        {VALUATION_INPUTS.map(([name, label]) => (
+          <label key={name} className="bg-white border border-gray-200 rounded-lg p-4 text-xs font-bold text-gray-500 uppercase">
+            {label}
+            <input key={`${name}-${result.assumptions[name]}`} type="text" defaultValue={pct(result.assumptions[name])}
+              onBlur={e => handleChange(name, e.target.value)}
+              className="block w-full mt-2 text-lg font-mono text-gray-900 border border-gray-200 focus:border-purple-500 focus:outline-none rounded px-2 py-1" />
+          </label>
+        ))}
+      </div>
+
+      <div className="grid grid-cols-3 gap-4">
+        <div className="bg-white border border-gray-200 rounded-lg p-4"><div className="text-xs font-bold text-gray-500 uppercase">Enterprise Value</div><div className="text-2xl font-black">{fmt(result.dcf.enterprise_value)}</div></div>
+        <div className="bg-white border border-gray-200 rounded-lg p-4"><div className="text-xs font-bold text-gray-500 uppercase">Equity Value</div><div className="text-2xl font-black text-purple-700">{fmt(result.dcf.equity_value)}</div></div>
+        <div className="bg-white border border-gray-200 rounded-lg p-4">
+          <div className="text-xs font-bold text-gray-500 uppercase">Monte Carlo ({mc.draws.toLocaleString()} draws) {running && <span className="text-blue-600 animate-pulse">…</span>}</div>
+          <div className="text-sm font-mono mt-1">P5 {fmt(mc.percentiles.p5)} · P50 {fmt(mc.percentiles.p50)} · P95 {fmt(mc.percentiles.p95)}</div>
+          <div className="text-xs text-gray-500 mt-1">Probability of negative equity: {pct(mc.probability_negative)}</div>
+        </div>
+      </div>
+
+      <table className="min-w-full text-sm border-collapse bg-white rounded-lg shadow-sm border border-gray-200">
+        <thead className="bg-gray-100 text-gray-700">
+          <tr>
+            <th className="border-b p-3 text-left font-bold">WACC ↓ / Terminal Growth →</th>
+            {grid.cols.values.map(v => <th key={v} className="border-b p-3 text-right font-bold">{pct(v)}</th>)}
+          </tr>
+        </thead>
+        <tbody className="divide-y divide-gray-100">
+          {grid.rows.values.map((w, i) => (
+            <tr key={w}>
+              <td className="p-3 font-bold text-gray-700">{pct(w)}</td>
+              {grid.equity_value[i].map((v, j) => <td key={j} className="p-3 text-right font-mono text-gray-600">{fmt(v)}</td>)}
+            </tr>
+          ))}
+        </tbody>
+      </table>
+    </div>
+  );
+};
+
 // ==========================================
 // 2. COMBINED VIEWER COMPONENT (Fixed Reset Race Condition)
 // ==========================================
@@ -169,15 +354,30 @@ const CombinedViewer = ({ companyId, onBack }) => {
     fetchData();
   }, [companyId]);
 
-  // FIX 1: Return the axios promise so we can chain off it
-  const fetchData = () => {
-    return axios.post(`${API_URL}/consolidate`, { company_id: companyId })
-      .then(res => {
-        setData(res.data);
-        return res.data; // Return data for chaining
-      })
-      .catch(err => alert("Failed to load combined view"));
-  };
+  // Statements stream in one by one (server-sent events), so the first tab shows before the rest are built.
+  // Returns a promise so callers can chain off the complete model.
+  const fetchData = () => new Promise(resolve => {
+    const source = new EventSource(`${API_URL}/project/${companyId}/consolidate/events`);
+    let model = {};
+    source.addEventListener('years', e => { model = { years: JSON.parse(e.data).years }; });
+    source.addEventListener('statement', e => {
+      const { key, rows } = JSON.parse(e.data);
+      model = { ...model, [key]: rows };
+      setData(prev => ({ ...(prev || {}), ...model }));
+    });
+    source.addEventListener('done', () => {
+      source.close();
+      setData(model);
+      resolve(model);
+    });
+    const fail = () => {
+      source.close();
+      alert("Failed to load combined view");
+      resolve(null);
+    };
+    source.addEventListener('failed', fail);
+    source.onerror = () => { if (source.readyState === EventSource.CLOSED) fail(); };
+  });
 
   // FIX 2: Wait for fetchData() to finish before incrementing viewVersion
   const handleReset = () => {
@@ -194,117 +394,44 @@ const CombinedViewer = ({ companyId, onBack }) => {
       .catch(err => alert("Reset failed"));
   };
 
-  // --- CALCULATION ENGINE ---
-  const recalculateFinancials = (currentData) => {
-    const newData = JSON.parse(JSON.stringify(currentData)); // Deep Copy
-    const years = newData.years;
-    const isRows = newData.calculated_income_statement;
-    
-    // Helpers
-    const findRow = (rows, labelPart) => rows.find(r => r.line_item.toLowerCase().includes(labelPart.toLowerCase()));
-    const getVal = (row, year) => {
-      if (!row) return 0;
-      let val = row[year];
-      if (typeof val === 'string') val = parseFloat(val.replace('%', '').replace(/,/g, ''));
-      return isNaN(val) ? 0 : val;
-    };
-    const setVal = (row, year, val, isPct=false) => {
-        if(row) row[year] = val; 
-    };
-
-    // 1. RECALCULATE INCOME STATEMENT
-    const revenueRow = findRow(isRows, "Revenue from Operations");
-    const cogsRow = findRow(isRows, "Cost Of Sales");
-    const gpRow = findRow(isRows, "Gross Profit");
-    const otherIncRow = findRow(isRows, "Other Income");
-    const gaRow = findRow(isRows, "General & Administrative");
-    const ebitdaRow = findRow(isRows, "EBITDA");
-    const deprRow = findRow(isRows, "Depreciation");
-    const amortRow = findRow(isRows, "Amortization");
-    const intRow = findRow(isRows, "Interest Expenses");
-    const niRow = findRow(isRows, "Net Income");
-    const taxRow = findRow(isRows, "Taxes");
-
-    years.forEach((year, idx) => {
-      // GP
-      const rev = getVal(revenueRow, year);
-      const cogs = getVal(cogsRow, year);
-      const gp = rev + cogs; 
-      setVal(gpRow, year, gp);
-
-      // Growth
-      if (idx > 0) {
-        const prevRev = getVal(revenueRow, years[idx-1]);
-        const growth = prevRev !== 0 ? ((rev - prevRev) / prevRev) * 100 : 0;
-        setVal(findRow(isRows, "Growth Rate"), year, growth, true);
-      }
+  // Undo appends to the server-side edit journal, so it can be undone again with Reset/Undo
+  const handleUndo = () => {
+    axios.post(`${API_URL}/undo_consolidated`, { company_id: companyId })
+      .then(() => fetchData().then(() => {
+        setViewVersion(v => v + 1);
+        setLastUpdated(new Date());
+      }))
+      .catch(err => alert(err.response?.data?.error || "Nothing to undo"));
+  };
 
-      // Margins
-      setVal(findRow(isRows, "COS%"), year, rev!==0 ? Math.abs((cogs/rev)*100) : 0, true);
-      setVal(findRow(isRows, "GP Margin"), year, rev!==0 ? (gp/rev)*100 : 0, true);
-
-      // EBITDA
-      const other = getVal(otherIncRow, year);
-      const ga = getVal(gaRow, year);
-      const ebitda = gp + other + ga;
-      setVal(ebitdaRow, year, ebitda);
-      setVal(findRow(isRows, "EBITDA Margin"), year, rev!==0 ? (ebitda/rev)*100 : 0, true);
-
-      // EBIT
-      const depr = getVal(deprRow, year);
-      const amort = getVal(amortRow, year);
-      const ebit = ebitda - depr - amort;
-      setVal(findRow(isRows, "EBIT"), year, ebit);
-      setVal(findRow(isRows, "EBIT Margin"), year, rev!==0 ? (ebit/rev)*100 : 0, true);
-
-      // EBT
-      const interest = getVal(intRow, year);
-      const ebt = ebit - interest;
-      setVal(findRow(isRows, "EBT"), year, ebt);
-      setVal(findRow(isRows, "EBT Margin"), year, rev!==0 ? (ebt/rev)*100 : 0, true);
-
-      // Net Income
-      const tax = getVal(taxRow, year);
-      const ni = ebt - tax;
-      setVal(niRow, year, ni);
-      setVal(findRow(isRows, "Net Income Margin"), year, rev!==0 ? (ni/rev)*100 : 0, true);
-    });
+  // --- RECALCULATION: the server re-evaluates what depends on the edited cell and returns only those rows ---
+  const STATEMENT_KEYS = { is: 'calculated_income_statement', bs: 'calculated_balance_sheet', cf: 'calculated_cash_flow' };
 
-    return newData;
-  };
+  const handleCellChange = (rowIndex, year, value) => {
+    const statement = STATEMENT_KEYS[activeTab];
+    const numVal = parseFloat(value.replace(/,/g, '').replace('%', ''));
+    if (isNaN(numVal) || numVal === data[statement][rowIndex][year]) return;
 
-  const handleUpdate = () => {
     setIsUpdating(true);
-    const updatedData = recalculateFinancials(data);
-    
-    axios.post(`${API_URL}/save_consolidated`, { company_id: companyId, data: updatedData })
-      .then(() => {
-        setData(updatedData);
-        setViewVersion(v => v + 1); // Refresh inputs
+    axios.post(`${API_URL}/recalculate`, { company_id: companyId, statement, row: rowIndex, year, value: numVal })
+      .then(res => {
+        setData(prev => {
+          const next = { ...prev };
+          res.data.delta.forEach(d => {
+            next[d.statement] = next[d.statement].map((row, i) => i === d.row ? { ...row, ...d.values } : row);
+          });
+          return next;
+        });
         setLastUpdated(new Date());
         setIsUpdating(false);
       })
       .catch(err => {
         setIsUpdating(false);
-        alert("Update failed");
+        setViewVersion(v => v + 1); // Put the inputs back to the last good values
+        alert(err.response?.data?.error || "Update failed");
       });
   };
 
-  const handleCellChange = (rowIndex, year, value) => {
-    const newData = { ...data }; 
-    let targetList;
-    if (activeTab === 'is') targetList = newData.calculated_income_statement;
-    else if (activeTab === 'bs') targetList = newData.calculated_balance_sheet;
-    else targetList = newData.calculated_cash_flow;
-
-    let cleanVal = value.replace(/,/g, '').replace('%', '');
-    let numVal = parseFloat(cleanVal);
-    if (isNaN(numVal)) numVal = 0;
-
-    targetList[rowIndex][year] = numVal;
-    setData(newData);
-  };
-
   const exportToExcel = () => {
     if (!data) return;
     const wb = XLSX.utils.book_new();
@@ -321,7 +448,12 @@ const CombinedViewer = ({ companyId, onBack }) => {
     XLSX.writeFile(wb, `Valuation_Model_${companyId.slice(0,5)}.xlsx`);
   };
 
-  if (!data) return (
+  let viewData = null;
+  if (data && activeTab === 'is') viewData = data.calculated_income_statement;
+  else if (data && activeTab === 'bs') viewData = data.calculated_balance_sheet;
+  else if (data && activeTab === 'cf') viewData = data.calculated_cash_flow;
+
+  if (!data || (activeTab !== 'val' && !viewData)) return (
     <div className="flex items-center justify-center h-[60vh]">
       <div className="animate-pulse flex flex-col items-center">
         <div className="w-12 h-12 bg-purple-200 rounded-full mb-4"></div>
@@ -330,11 +462,6 @@ const CombinedViewer = ({ companyId, onBack }) => {
     </div>
   );
 
-  let viewData = [];
-  if (activeTab === 'is') viewData = data.calculated_income_statement;
-  else if (activeTab === 'bs') viewData = data.calculated_balance_sheet;
-  else if (activeTab === 'cf') viewData = data.calculated_cash_flow;
-
   return (
     <div className="flex h-[88vh] flex-col bg-white rounded-xl shadow-lg border border-gray-200 overflow-hidden">
       <div className="px-6 py-4 border-b border-gray-200 flex justify-between items-center bg-purple-50">
@@ -349,14 +476,11 @@ const CombinedViewer = ({ companyId, onBack }) => {
           <button onClick={handleReset} className="px-4 py-2 text-xs font-bold text-red-400 hover:text-red-600 hover:bg-red-50 rounded-lg transition-colors">
             Reset Data
           </button>
-          
-          <button 
-            onClick={handleUpdate} 
-            disabled={isUpdating} 
-            className="px-6 py-2 bg-blue-600 text-white rounded-lg text-sm font-black hover:bg-blue-700 shadow-md hover:shadow-lg transition-all flex items-center gap-2 transform hover:-translate-y-0.5"
-          >
-            {isUpdating ? 'Calculating...' : '🔄 Update & Calculate'}
+          <button onClick={handleUndo} disabled={isUpdating} className="px-4 py-2 text-xs font-bold text-gray-500 hover:text-gray-700 hover:bg-gray-100 rounded-lg transition-colors">
+            ↶ Undo
           </button>
+          
+          {isUpdating && <span className="px-4 py-2 text-xs font-bold text-blue-600 animate-pulse">Calculating...</span>}
 
           <button onClick={exportToExcel} className="px-4 py-2 bg-emerald-600 text-white rounded-lg text-sm font-bold hover:bg-emerald-700 shadow-sm transition-all flex items-center gap-2">
             <span>⬇</span> XLSX
@@ -368,18 +492,19 @@ const CombinedViewer = ({ companyId, onBack }) => {
       </div>
 
       <div className="flex border-b border-gray-200 bg-white">
-        {['is', 'bs', 'cf'].map(tab => (
+        {['is', 'bs', 'cf', 'val'].map(tab => (
           <button
             key={tab}
             onClick={() => setActiveTab(tab)}
             className={`flex-1 py-4 text-sm font-bold border-b-2 transition-all ${activeTab === tab ? 'border-purple-600 text-purple-600 bg-purple-50/50' : 'border-transparent text-gray-400 hover:text-gray-600'}`}
           >
-            {tab === 'is' ? 'Income Statement' : tab === 'bs' ? 'Balance Sheet' : 'Cash Flow'}
+            {tab === 'is' ? 'Income Statement' : tab === 'bs' ? 'Balance Sheet' : tab === 'cf' ? 'Cash Flow' : 'Valuation'}
           </button>
         ))}
       </div>
       
       <div className="flex-1 overflow-auto p-6 bg-gray-50/30">
+        {activeTab === 'val' ? <ValuationPanel key={viewVersion} companyId={companyId} /> : (
         <table className="min-w-full text-sm border-collapse bg-white rounded-lg shadow-sm border border-gray-200 overflow-hidden">
           <thead className="bg-gray-100 text-gray-700 sticky top-0 z-10 shadow-sm">
             <tr>
@@ -398,6 +523,7 @@ const CombinedViewer = ({ companyId, onBack }) => {
                   <td key={y} className="p-2 text-right font-mono text-gray-600">
                     {row.is_header ? '' : (
                       <input 
+                        key={`${y}-${row[y]}`}
                         type="text" 
                         defaultValue={typeof row[y] === 'number' ? 
                             (row.line_item.includes('%') || row.line_item.includes('Rate') 
@@ -414,6 +540,7 @@ const CombinedViewer = ({ companyId, onBack }) => {
             ))}
           </tbody>
         </table>
+        )}
       </div>
     </div>
   );
@@ -421,11 +548,38 @@ const CombinedViewer = ({ companyId, onBack }) => {
 // ==========================================
 // 3. UPLOAD AND MAIN APP
 // ==========================================
+// Large files go through a resumable session: each chunk is retried from the offset the server has
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
+const uploadInChunks = async (file, fields) => {
+  const { data: session } = await axios.post(`${API_URL}/uploads`, { ...fields, filename: file.name, size: file.size });
+  let offset = 0;
+  let retries = 0;
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + session.chunk_size);
+    try {
+      const res = await axios.put(`${API_URL}/uploads/${session.upload_id}?offset=${offset}`, chunk, { headers: { 'Content-Type': 'application/octet-stream' } });
+      offset = res.data.offset;
+      retries = 0;
+    } catch (err) {
+      if (++retries > 5 || err.response?.status === 400) throw err;
+      offset = (await axios.get(`${API_URL}/uploads/${session.upload_id}`)).data.offset;
+    }
+  }
+  await axios.post(`${API_URL}/uploads/${session.upload_id}/complete`);
+};
+
 const UploadSlot = ({ year, docType, companyId, existingFileName, onFileChange }) => {
   const [status, setStatus] = useState(existingFileName ? 'done' : 'idle');
   useEffect(() => { setStatus(existingFileName ? 'done' : 'idle'); }, [existingFileName]);
   
   const onDrop = useCallback(async (acceptedFiles) => {
+    if (acceptedFiles[0].size > CHUNKED_UPLOAD_THRESHOLD) {
+      setStatus('uploading');
+      try { await uploadInChunks(acceptedFiles[0], { company_id: companyId, year, doc_type: docType }); onFileChange(); }
+      catch { setStatus('error'); alert("Upload failed"); }
+      return;
+    }
     const formData = new FormData();
     formData.append('file', acceptedFiles[0]);
     formData.append('company_id', companyId);
@@ -490,12 +644,51 @@ export default function App() {
     setLoadingMsg(`AI is digitizing ${year} report...`);
     try {
       const res = await axios.post(`${API_URL}/extract`, { company_id: projectData.company_id, year });
+      let result = res.data;
+      if (res.status === 202) {
+        result = await watchJob(res.data.job_id, (event, data) => setLoadingMsg(`AI is digitizing ${year} report... (${describeProgress(event, data)})`));
+      }
       await refreshProjectFiles(projectData.company_id);
-      setExtractedViewData({ year, data: res.data });
+      setExtractedViewData({ year, data: result });
       setViewMode('extract');
     } catch { alert("Extraction failed."); } finally { setLoadingMsg(''); }
   };
 
+  // Extract every year at once; the server streams one NDJSON line per finished year
+  const handleExtractAll = async () => {
+    setLoadingMsg('AI is digitizing all reports...');
+    try {
+      const res = await fetch(`${API_URL}/extract_batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ company_id: projectData.company_id })
+      });
+      if (!res.ok) throw new Error('Batch extraction failed');
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let finished = 0;
+      const failed = [];
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines.filter(Boolean)) {
+          const update = JSON.parse(line);
+          if (update.status === 'failed') failed.push(update.year);
+          if (['done', 'cached', 'failed', 'skipped'].includes(update.status)) {
+            finished += 1;
+            setLoadingMsg(`AI is digitizing all reports... (${finished}/${projectData.years.length} years)`);
+          }
+        }
+      }
+      await refreshProjectFiles(projectData.company_id);
+      if (failed.length) alert(`Extraction failed for: ${failed.join(', ')}`);
+    } catch { alert("Extraction failed."); } finally { setLoadingMsg(''); }
+  };
+
   const extractedCount = projectFiles ? Object.values(projectFiles).filter(f => f.Extracted).length : 0;
 
   if (loadingMsg) return (
@@ -505,7 +698,7 @@ export default function App() {
     </div>
   );
 
-  if (viewMode === 'extract') return <div className="p-8 bg-gray-100 min-h-screen"><ExtractionViewer data={extractedViewData.data} year={extractedViewData.year} onBack={() => setViewMode('project')} /></div>;
+  if (viewMode === 'extract') return <div className="p-8 bg-gray-100 min-h-screen"><ExtractionViewer companyId={projectData.company_id} data={extractedViewData.data} year={extractedViewData.year} onBack={() => setViewMode('project')} /></div>;
   if (viewMode === 'combined') return <div className="p-8 bg-gray-100 min-h-screen"><CombinedViewer companyId={projectData.company_id} onBack={() => setViewMode('project')} /></div>;
 
   return (
@@ -558,11 +751,16 @@ export default function App() {
           <div className="p-10 bg-gray-50/50 flex-1">
             <div className="flex justify-between items-center mb-8">
                <h3 className="font-black text-gray-400 uppercase tracking-widest text-xs">Period Management</h3>
-              {extractedCount >= 2 && (
-                <button onClick={() => setViewMode('combined')} className="bg-purple-600 text-white px-8 py-4 rounded-2xl font-black shadow-xl hover:bg-purple-700 hover:-translate-y-1 transition-all flex items-center gap-3 animate-bounce-short">
-                  <span className="text-xl">📊</span> View Consolidation
+              <div className="flex items-center gap-4">
+                <button onClick={handleExtractAll} className="bg-gray-900 text-white px-6 py-4 rounded-2xl font-black text-xs uppercase tracking-widest hover:bg-blue-600 transition-all">
+                  Analyze All Years
                 </button>
-              )}
+                {extractedCount >= 2 && (
+                  <button onClick={() => setViewMode('combined')} className="bg-purple-600 text-white px-8 py-4 rounded-2xl font-black shadow-xl hover:bg-purple-700 hover:-translate-y-1 transition-all flex items-center gap-3 animate-bounce-short">
+                    <span className="text-xl">📊</span> View Consolidation
+                  </button>
+                )}
+              </div>
             </div>
             
             <div className="space-y-6">